@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+u"""Per-user simulation catalog
+
+Each user's app directory has a sqlite file with a row per simulation. A
+row caches what is needed to list, search, and name simulations so
+`simulation_db` doesn't have to parse every simulation data file.
+Rows are refreshed by `simulation_db` from the data file's mtime and size.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkjson
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import contextlib
+import sqlite3
+
+#: sqlite file located in the user's app directory
+BASENAME = 'catalog.db'
+
+#: Increment when the table changes; the catalog is rebuilt from disk
+_SCHEMA_VERSION = 1
+
+#: Seconds to wait for another process's write
+_LOCK_TIMEOUT = 30
+
+_COLUMNS = (
+    'sid',
+    'mtime',
+    'size',
+    'version',
+    'name',
+    'folder',
+    'is_example',
+    'simulation',
+    'strings',
+)
+
+
+def delete(sim_dir, sids):
+    """Remove rows
+
+    Args:
+        sim_dir (py.path): user's app directory
+        sids (iterable): simulation ids
+    """
+    sids = list(sids)
+    if not sids:
+        return
+    with _connect(sim_dir) as c:
+        c.executemany('DELETE FROM sim_t WHERE sid = ?', [(s,) for s in sids])
+
+
+def load(sim_dir):
+    """All rows in the catalog
+
+    Args:
+        sim_dir (py.path): user's app directory
+    Returns:
+        dict: sid to row (simulation and strings are decoded)
+    """
+    res = pkcollections.Dict()
+    with _connect(sim_dir) as c:
+        for r in c.execute('SELECT {} FROM sim_t'.format(', '.join(_COLUMNS))):
+            r = pkcollections.Dict(zip(_COLUMNS, r))
+            r.is_example = bool(r.is_example)
+            r.simulation = pkjson.load_any(r.simulation)
+            r.strings = pkjson.load_any(r.strings)
+            res[r.sid] = r
+    return res
+
+
+def names_in_folder(sim_dir, folder, prefix):
+    """Simulations in `folder` whose names start with `prefix`
+
+    Uses the folder index so only the matching rows are read.
+
+    Args:
+        sim_dir (py.path): user's app directory
+        folder (str): exact folder
+        prefix (str): start of name
+    Returns:
+        list: Dicts with sid and name
+    """
+    with _connect(sim_dir) as c:
+        return [
+            pkcollections.Dict(sid=r[0], name=r[1])
+            for r in c.execute(
+                'SELECT sid, name FROM sim_t WHERE folder = ? AND substr(name, 1, ?) = ?',
+                (folder, len(prefix), prefix),
+            )
+        ]
+
+
+def update(sim_dir, rows):
+    """Insert or replace rows
+
+    Args:
+        sim_dir (py.path): user's app directory
+        rows (list): dicts with all `_COLUMNS`
+    """
+    if not rows:
+        return
+    with _connect(sim_dir) as c:
+        c.executemany(
+            'INSERT OR REPLACE INTO sim_t ({}) VALUES ({})'.format(
+                ', '.join(_COLUMNS),
+                ', '.join('?' * len(_COLUMNS)),
+            ),
+            [_encode(r) for r in rows],
+        )
+
+
+@contextlib.contextmanager
+def _connect(sim_dir):
+    c = sqlite3.connect(str(sim_dir.join(BASENAME)), timeout=_LOCK_TIMEOUT)
+    try:
+        v = c.execute('PRAGMA user_version').fetchone()[0]
+        if v != _SCHEMA_VERSION:
+            c.execute('DROP TABLE IF EXISTS sim_t')
+            c.execute(
+                '''CREATE TABLE sim_t (
+                    sid TEXT PRIMARY KEY,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    version TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    folder TEXT NOT NULL,
+                    is_example INTEGER NOT NULL,
+                    simulation TEXT NOT NULL,
+                    strings TEXT NOT NULL
+                )'''
+            )
+            c.execute('CREATE INDEX sim_folder_i ON sim_t (folder)')
+            c.execute('PRAGMA user_version = {}'.format(_SCHEMA_VERSION))
+            c.commit()
+        with c:
+            yield c
+    finally:
+        c.close()
+
+
+def _encode(row):
+    r = dict(row)
+    r['is_example'] = 1 if r['is_example'] else 0
+    r['simulation'] = pkjson.dump_bytes(r['simulation']).decode('utf-8')
+    r['strings'] = pkjson.dump_bytes(r['strings']).decode('utf-8')
+    return tuple(r[k] for k in _COLUMNS)
@@ -63,6 +63,7 @@ cfg = pkconfig.init(
     sim_types=(None, _cfg_sim_types, 'simulation types (codes) to be imported'),
     srw=dict(
         mask_in_toolbar=(pkconfig.channel_in_internal_test(), bool, 'Show the mask element in toolbar'),
+        wavefront_checkpoints=(False, bool, 'Resume watchpoint reports from the wavefront saved after each beamline element'),
     ),
     warpvnd=dict(
         allow_3d_mode=(pkconfig.channel_in_internal_test(), bool, 'Include 3D features in the Warp VND UI'),
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+u"""In-memory cache of serialized animation frames
+
+Frames of completed reports don't change, so the JSON generated by
+`get_simulation_frame` is kept, keyed on the run dir, the report's
+parameters hash, the mtime of the run's input file (which changes on
+every run), and the frame id. Entries carry an ETag so browsers can
+revalidate with If-None-Match and get a 304.
+
+The least recently used entries are dropped above `cfg.max_bytes`.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkconfig
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import collections
+import hashlib
+import os
+import threading
+
+#: Configuration
+cfg = None
+
+#: key to Dict(body, etag), most recently used last
+_cache = collections.OrderedDict()
+
+#: total bytes of bodies in `_cache`
+_cache_bytes = 0
+
+_lock = threading.Lock()
+
+
+def entry(body):
+    """Response body and its ETag
+
+    Args:
+        body (bytes): serialized frame
+    Returns:
+        Dict: body, etag
+    """
+    return pkcollections.Dict(
+        body=body,
+        etag=hashlib.md5(body).hexdigest(),
+    )
+
+
+def get(key):
+    """Cached entry for key
+
+    Args:
+        key (tuple): from `key`
+    Returns:
+        Dict: body, etag or None
+    """
+    if not cfg.max_bytes:
+        return None
+    with _lock:
+        res = _cache.get(key)
+        if res is not None:
+            # mark most recently used
+            del _cache[key]
+            _cache[key] = res
+        return res
+
+
+def key(run_dir, jhash, input_file, frame_id):
+    """Identify a frame of a specific run
+
+    Args:
+        run_dir (py.path): report's run dir
+        jhash (str): reportParametersHash of the run
+        input_file (py.path): run's in.json
+        frame_id (object): request's frame id and encoding
+    Returns:
+        tuple: key or None if input_file is missing
+    """
+    try:
+        m = os.path.getmtime(str(input_file))
+    except OSError:
+        return None
+    return (str(run_dir), jhash, m, frame_id)
+
+
+def put(key, value):
+    """Store the entry and evict old entries
+
+    Args:
+        key (tuple): from `key`
+        value (Dict): from `entry`
+    """
+    global _cache_bytes
+
+    n = len(value.body)
+    if not key or n > cfg.max_bytes:
+        return
+    with _lock:
+        if key in _cache:
+            return
+        _cache[key] = value
+        _cache_bytes += n
+        while _cache_bytes > cfg.max_bytes:
+            _, v = _cache.popitem(last=False)
+            _cache_bytes -= len(v.body)
+
+
+cfg = pkconfig.init(
+    max_bytes=(200 * 1024 ** 2, int, 'bytes of frames to keep in memory per process (0 disables)'),
+)
@@ -49,7 +49,7 @@ SIREPO.app.controller('VisualizationController', function (appState, flashServic
 
     self.simState = persistentSimulation.initSimulationState($scope, 'animation', handleStatus, {
         gridEvolutionAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '1', 'y1', 'y2', 'y3', 'startTime'],
-        varAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '1', 'var', 'startTime'],
+        varAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '2', 'var', 'gridSize', 'startTime'],
     });
 
     appState.whenModelsLoaded($scope, function() {
@@ -1327,8 +1327,29 @@ SIREPO.app.factory('requestSender', function(errorService, localRoutes, $http, $
     var getApplicationDataTimeout = {};
     var IS_HTML_ERROR_RE = new RegExp('^(?:<html|<!doctype)', 'i');
     var HTML_TITLE_RE = new RegExp('>([^<]+)</', 'i');
+    // heatmap z_matrix sent as base64 little-endian float32, see http_reply.encode_matrix
+    var MATRIX_ENCODING = 'float32-base64';
     var srException = null;
 
+    function decodeMatrix(data) {
+        var m = data.z_matrix;
+        if (! m || m.encoding != MATRIX_ENCODING) {
+            return;
+        }
+        var s = atob(m.data);
+        var bytes = new Uint8Array(s.length);
+        for (var i = 0; i < s.length; i++) {
+            bytes[i] = s.charCodeAt(i);
+        }
+        var values = new Float32Array(bytes.buffer);
+        var cols = m.shape[1];
+        var res = [];
+        for (var row = 0; row < m.shape[0]; row++) {
+            res.push(Array.prototype.slice.call(values.subarray(row * cols, (row + 1) * cols)));
+        }
+        data.z_matrix = res;
+    }
+
     function logError(data, status) {
         var err = SIREPO.APP_SCHEMA.customErrors[status];
         if (err && err.route) {
@@ -1506,7 +1527,10 @@ SIREPO.app.factory('requestSender', function(errorService, localRoutes, $http, $
         var timeout = $q.defer();
         var interval, t;
         var timed_out = false;
-        t = {timeout: timeout.promise};
+        t = {
+            timeout: timeout.promise,
+            headers: {'X-Sirepo-Matrix-Encoding': MATRIX_ENCODING},
+        };
         if (SIREPO.http_timeout > 0) {
             interval = $interval(
                 function () {
@@ -1581,6 +1605,7 @@ SIREPO.app.factory('requestSender', function(errorService, localRoutes, $http, $
                 var data = response.data;
                 $interval.cancel(interval);
                 if (angular.isObject(data)) {
+                    decodeMatrix(data);
                     successCallback(data, response.status);
                 }
                 else {
@@ -2066,8 +2066,8 @@ SIREPO.app.directive('simulationStatusPanel', function(appState, frameCache, pan
             $scope.simState = persistentSimulation.initSimulationState($scope, 'animation', handleStatus, {
                 currentAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '1', 'startTime'],
                 fieldAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '1', 'field', 'startTime'],
-                particleAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '3', 'renderCount', 'startTime'],
-                particle3d: [SIREPO.ANIMATION_ARGS_VERSION + '1', 'renderCount', 'startTime'],
+                particleAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '4', 'renderCount', 'maxPoints', 'startTime'],
+                particle3d: [SIREPO.ANIMATION_ARGS_VERSION + '4', 'renderCount', 'maxPoints', 'startTime'],
                 impactDensityAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '1', 'startTime'],
                 egunCurrentAnimation: [SIREPO.ANIMATION_ARGS_VERSION + '1', 'startTime'],
             });
@@ -31,7 +31,7 @@ def create_examples():
             simulation_db.verify_app_directory(sim_type)
             names = map(
                 lambda x: x['name'],
-                simulation_db.iterate_simulation_datafiles(sim_type, simulation_db.process_simulation_list, {
+                simulation_db.simulation_list(sim_type, {
                     'simulation.isExample': True,
                 }))
             for example in simulation_db.examples(sim_type):
@@ -7,16 +7,24 @@ u"""Operations run inside the report directory to extract data.
 
 from pykern import pkio
 from pykern import pkjson
+from pykern.pkdebug import pkdc, pkdexc, pkdlog
 from sirepo import simulation_db
 from sirepo.template import template_common
 import functools
+import os
 import sirepo
 import sys
 
 
+#: Extract commands by name, unwrapped (see worker)
+_CMDS = {}
+
+
 # These commands take json-encoded arguments, and then print their result as
 # json to stdout.
 def _extract_cmd(fn):
+    _CMDS[fn.__name__] = fn
+
     @functools.wraps(fn)
     def wrapper(arg):
         result = fn(*pkjson.load_any(arg))
@@ -73,3 +81,36 @@ def get_simulation_frame(frame_data):
     params = _input_params()
     template = sirepo.template.import_module(params)
     return template.get_simulation_frame(_run_dir(), frame_data, params)
+
+
+def worker(sim_type=None):
+    """Serve extract requests from the runner daemon until stdin is closed
+
+    Each request is a single line of json with ``run_dir``, ``subcmd`` and
+    ``arg`` (the same json-encoded argument list the commands above take).
+    Each reply is a single line of json with either ``result`` or ``error``.
+
+    The process stays alive between requests so the interpreter, numpy,
+    etc. and the template module are only imported once.
+
+    Args:
+        sim_type (str): template to preload [None]
+    """
+    # Replies go over the original stdout. Anything else written to stdout
+    # (e.g. by a code library) goes to stderr so it can't corrupt the protocol.
+    replies = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    requests = os.fdopen(os.dup(0), 'rb')
+    if sim_type:
+        sirepo.template.import_module(sim_type)
+    for line in iter(requests.readline, b''):
+        req = pkjson.load_any(line)
+        pkdc('{} {}', req.run_dir, req.subcmd)
+        try:
+            with pkio.save_chdir(req.run_dir):
+                res = dict(result=_CMDS[req.subcmd](*pkjson.load_any(req.arg)))
+        except Exception as e:
+            pkdlog('{} {}: error={} {}', req.run_dir, req.subcmd, e, pkdexc())
+            res = dict(error=pkdexc())
+        replies.write(pkjson.dump_bytes(res) + b'\n')
+        replies.flush()
@@ -10,42 +10,9 @@ from pykern.pkdebug import pkdp, pkdlog, pkdexc
 from sirepo import mpi
 from sirepo import simulation_db
 from sirepo.template import template_common
-import numpy as np
 import py.path
 import sirepo.template.shadow as template
 
-_MM_TO_CM = 0.1
-_CM_TO_M = 0.01
-_SCHEMA = simulation_db.get_schema(template.SIM_TYPE)
-
-_SCALE_COLUMNS = [1, 2, 3, 13, 20]
-_PLOT_LABELS = {
-    '1': ['X [m]'],
-    '2': ['Y [m]'],
-    '3': ['Z [m]'],
-    '4': ["X' [rad]"],
-    '5': ["Y' [rad]"],
-    '6': ["Z' [rad]"],
-    '11': ['Energy [eV]', 'E [eV]'],
-    '13': ['Optical Path [m]', 's'],
-    '14': [u'Phase s [rad]', u'ϕ s [rad]'],
-    '15': [u'Phase p [rad]', u'ϕ p [rad]'],
-    '19': [u'Wavelength [Å]', u'λ [Å]'],
-    '20': [u'R = sqrt(X² + Y² + Z²) [m]', 'R [m]'],
-    '21': [u'Theta (angle from Y axis) [rad]', u'θ [rad]'],
-    '22': ['Magnitude = |Es| + |Ep|', '|Es| + |Ep|'],
-    '23': [u'Total Intensity = |Es|² + |Ep|²', u'|Es|² + |Ep|²'],
-    '24': [u'S Intensity = |Es|²', u'|Es|²'],
-    '25': [u'P Intensity = |Ep|²', u'|Ep|²'],
-    '26': [u'|K| [Å⁻¹]'],
-    '27': [u'K X [Å⁻¹]'],
-    '28': [u'K Y [Å⁻¹]'],
-    '29': [u'K Z [Å⁻¹]'],
-    '30': [u'S0-stokes = |Ep|² + |Es|²', 'S0'],
-    '31': [u'S1-stokes = |Ep|² - |Es|²', 'S1'],
-    '32': ['S2-stokes = 2|Es||Ep|cos(Phase s-Phase p)', 'S2'],
-    '33': ['S3-stokes = 2|Es||Ep|sin(Phase s-Phase p)', 'S3'],
-}
 
 def run(cfg_dir):
     """Run shadow in ``cfg_dir``
@@ -56,83 +23,16 @@ def run(cfg_dir):
     with pkio.save_chdir(cfg_dir):
         beam = _run_shadow()
         data = simulation_db.read_json(template_common.INPUT_BASE_NAME)
-        model = data['models'][data['report']]
-        column_values = _SCHEMA['enum']['ColumnValue']
-
-        if 'y' in model:
-            x_range = None
-            y_range = None
-            if model['overrideSize'] == '1':
-                x_range = (np.array([
-                    model['horizontalOffset'] - model['horizontalSize'] / 2,
-                    model['horizontalOffset'] + model['horizontalSize'] / 2,
-                ]) * _MM_TO_CM).tolist()
-                y_range = (np.array([
-                    model['verticalOffset'] - model['verticalSize'] / 2,
-                    model['verticalOffset'] + model['verticalSize'] / 2,
-                ]) * _MM_TO_CM).tolist()
-            ticket = beam.histo2(int(model['x']), int(model['y']), nbins=template_common.histogram_bins(model['histogramBins']), ref=int(model['weight']), nolost=1, calculate_widths=0, xrange=x_range, yrange=y_range)
-            _scale_ticket(ticket)
-            res = {
-                'x_range': [ticket['xrange'][0], ticket['xrange'][1], ticket['nbins_h']],
-                'y_range': [ticket['yrange'][0], ticket['yrange'][1], ticket['nbins_v']],
-                'x_label': _label_with_units(model['x'], column_values),
-                'y_label': _label_with_units(model['y'], column_values),
-                'z_label': 'Frequency',
-                'title': u'{}, {}'.format(_label(model['x'], column_values), _label(model['y'], column_values)),
-                'z_matrix': ticket['histogram'].T.tolist(),
-                'frameCount': 1,
-            }
-        else:
-            weight = int(model['weight'])
-            ticket = beam.histo1(int(model['column']), nbins=template_common.histogram_bins(model['histogramBins']), ref=weight, nolost=1, calculate_widths=0)
-            _scale_ticket(ticket)
-            res = {
-                'title': _label(model['column'], column_values),
-                'x_range': [ticket['xrange'][0], ticket['xrange'][1], ticket['nbins']],
-                'y_label': u'{}{}'.format(
-                    'Number of Rays',
-                    u' weighted by {}'.format(_label_for_weight(model['weight'], column_values)) if weight else ''),
-                'x_label': _label_with_units(model['column'], column_values),
-                'points': ticket['histogram'].T.tolist(),
-                'frameCount': 1,
-            }
-            #pkdp('range amount: {}', res['x_range'][1] - res['x_range'][0])
-            #1.55431223448e-15
-            dist = res['x_range'][1] - res['x_range'][0]
-            #TODO(pjm): only rebalance range if outside of 0
-            if dist < 1e-14:
-                #TODO(pjm): include offset range for client
-                res['x_range'][0] = 0
-                res['x_range'][1] = dist
-        simulation_db.write_result(res)
+        run_dir = pkio.py_path(cfg_dir)
+        # plot-only changes are histogrammed from the saved rays
+        template.save_ray_table(run_dir, beam.rays)
+        template.prepare_output_file(run_dir, data)
 
 
 def run_background(cfg_dir):
     pass
 
 
-def _label(column, values):
-    for v in values:
-        if column == v[0]:
-            return v[1]
-    raise RuntimeError('unknown column value: ', column)
-
-
-def _label_for_weight(column, values):
-    if column in _PLOT_LABELS:
-        if len(_PLOT_LABELS[column]) > 1:
-            return _PLOT_LABELS[column][1]
-        return _PLOT_LABELS[column][0]
-    return _label(column, values)
-
-
-def _label_with_units(column, values):
-    if column in _PLOT_LABELS:
-        return _PLOT_LABELS[column][0]
-    return _label(column, values)
-
-
 def _run_shadow():
     """Run shadow program with isolated locals()
     """
@@ -143,17 +43,5 @@ def _run_shadow():
     return beam
 
 
-def _scale_ticket(ticket):
-    if 'xrange' in ticket:
-        col_h = ticket['col_h'] if 'col_h' in ticket else ticket['col']
-        if col_h in _SCALE_COLUMNS:
-            ticket['xrange'][0] *= _CM_TO_M
-            ticket['xrange'][1] *= _CM_TO_M
-    if 'yrange' in ticket:
-        if ticket['col_v'] in _SCALE_COLUMNS:
-            ticket['yrange'][0] *= _CM_TO_M
-            ticket['yrange'][1] *= _CM_TO_M
-
-
 def _script():
     return pkio.read_text(template_common.PARAMETERS_PYTHON_FILE)
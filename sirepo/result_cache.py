@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+u"""Content-addressed cache of completed report run dirs
+
+Output of finished, non-parallel reports is stored under a key computed
+from the simulation type, report, `template_common.report_parameters_hash`,
+and the contents of the report's lib files. A run with the same key, by
+any simulation or user, is satisfied by hard-linking the cached files
+into its run dir instead of running the job.
+
+The least recently used entries are removed when the cache exceeds
+`cfg.max_bytes`. The size of the cache is tracked as entries are saved
+and recounted from disk when it is over the limit or the count is
+older than `_RESCAN_SECONDS`, since other processes save entries, too.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkconfig
+from pykern import pkio
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo import simulation_db
+from sirepo import srdb
+from sirepo.template import template_common
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+#: Configuration
+cfg = None
+
+#: Directory name in `srdb.root`
+_DIR_NAME = 'result_cache'
+
+#: Written in the run dir once its result is in the cache
+_SAVED_FILE = 'result-cache-saved'
+
+#: Files which belong to the run, not the result. The status file is
+#: rewritten in place by `simulation_db.write_status` so it can't be linked.
+_EXCLUDE = frozenset((
+    template_common.INPUT_BASE_NAME + simulation_db.JSON_SUFFIX,
+    _SAVED_FILE,
+    'status',
+))
+
+#: Maximum age of `_total_bytes` before the cache is counted again
+_RESCAN_SECONDS = 600
+
+#: (path, mtime, size) to sha256 of lib files
+_lib_hashes = {}
+
+#: Serializes eviction within this process
+_lock = threading.Lock()
+
+#: time of the last count of the cache
+_scan_time = 0
+
+#: bytes in the cache at `_scan_time` plus entries saved since by this process
+_total_bytes = None
+
+
+def restore(data):
+    """Populate the run dir from the cache if there is a matching entry
+
+    Args:
+        data (dict): report request
+    Returns:
+        bool: True if run dir was populated and job need not run
+    """
+    if not _is_cacheable(data):
+        return False
+    try:
+        k = _key(data)
+        e = _entry_dir(k)
+        if not e.check(dir=True):
+            return False
+        run_dir = simulation_db.simulation_run_dir(data, remove_dir=True)
+        pkio.mkdir_parent(run_dir)
+        for f in _files(e):
+            t = run_dir.join(f)
+            pkio.mkdir_parent_only(t)
+            _link(e.join(f), t)
+        template_common.copy_lib_files(data, None, run_dir)
+        simulation_db.write_json(
+            run_dir.join(template_common.INPUT_BASE_NAME),
+            data,
+        )
+        simulation_db.write_status('completed', run_dir)
+        _mark_saved(run_dir)
+        # LRU is by mtime of the entry dir
+        e.setmtime()
+        pkdlog('{}: result cache hit key={}', simulation_db.job_id(data), k)
+        return True
+    except Exception as e:
+        # entry may have been evicted while linking so just run the job
+        pkdlog('{}: result cache restore failed: {}', data.get('report'), e)
+        return False
+
+
+def save(data, run_dir):
+    """Store the output of a completed report
+
+    Does nothing if the run dir was already saved or restored, or if an
+    entry already exists for the key.
+
+    Args:
+        data (dict): input (in.json) of the completed run
+        run_dir (py.path): report's run dir
+    """
+    if not _is_cacheable(data) or run_dir.join(_SAVED_FILE).check():
+        return
+    k = _key(data)
+    e = _entry_dir(k)
+    if e.check():
+        _mark_saved(run_dir)
+        return
+    t = _root().join('{}-{}{}'.format(k, uuid.uuid4().hex, srdb.TMP_DIR_SUFFIX))
+    n = 0
+    try:
+        for f in _files(run_dir):
+            d = t.join(f)
+            pkio.mkdir_parent_only(d)
+            _link(run_dir.join(f), d)
+            n += os.path.getsize(str(d))
+        pkio.mkdir_parent_only(e)
+        try:
+            os.rename(str(t), str(e))
+        except OSError as err:
+            # another request saved the same result
+            if err.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            pkio.unchecked_remove(t)
+            _mark_saved(run_dir)
+            return
+    except Exception:
+        pkdlog('{}: result cache save failed: {}', run_dir, pkdexc())
+        pkio.unchecked_remove(t)
+        return
+    pkdc('{}: saved key={} bytes={}', run_dir, k, n)
+    _mark_saved(run_dir)
+    _add_bytes(n)
+
+
+def _add_bytes(n):
+    global _total_bytes
+
+    with _lock:
+        if _total_bytes is not None and time.time() - _scan_time < _RESCAN_SECONDS:
+            _total_bytes += n
+            if _total_bytes <= cfg.max_bytes:
+                return
+        _evict()
+
+
+def _entry_dir(key):
+    return _root().join(key[:2], key)
+
+
+def _evict():
+    """Count the cache and remove least recently used entries until
+    under `cfg.max_bytes`
+
+    Called with `_lock` held.
+    """
+    global _scan_time, _total_bytes
+
+    _scan_time = time.time()
+    entries = []
+    total = 0
+    for d in _root().listdir():
+        if d.basename.endswith(srdb.TMP_DIR_SUFFIX) or not d.check(dir=True):
+            continue
+        for e in d.listdir():
+            try:
+                s = sum(
+                    os.path.getsize(str(e.join(f))) for f in _files(e)
+                )
+                entries.append((e.mtime(), s, e))
+            except Exception:
+                # evicted by another process
+                continue
+            total += s
+    if total > cfg.max_bytes:
+        for _, s, e in sorted(entries, key=lambda x: x[0]):
+            pkdc('{}: evict bytes={}', e, s)
+            pkio.unchecked_remove(e)
+            total -= s
+            if total <= cfg.max_bytes:
+                break
+    _total_bytes = total
+
+
+def _files(directory):
+    """Relative paths of regular files in `directory`
+
+    Symlinks are lib files, which `copy_lib_files` recreates.
+    """
+    res = []
+    d = str(directory)
+    for p, _, files in os.walk(d):
+        for f in files:
+            a = os.path.join(p, f)
+            if os.path.islink(a):
+                continue
+            r = os.path.relpath(a, d)
+            if r not in _EXCLUDE:
+                res.append(r)
+    return sorted(res)
+
+
+def _is_cacheable(data):
+    return cfg.enabled and 'models' in data \
+        and not simulation_db.is_parallel(data)
+
+
+def _key(data):
+    h = hashlib.sha256()
+    for v in (
+        data.simulationType,
+        data.report,
+        template_common.report_parameters_hash(data),
+    ):
+        h.update(v.encode('utf-8'))
+    for f in sorted(template_common.lib_files(data), key=str):
+        h.update(f.basename.encode('utf-8'))
+        h.update(_lib_hash(f).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _lib_hash(path):
+    try:
+        st = os.stat(str(path))
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return ''
+        raise
+    k = (str(path), st.st_mtime, st.st_size)
+    res = _lib_hashes.get(k)
+    if res is None:
+        h = hashlib.sha256()
+        with open(k[0], 'rb') as f:
+            for b in iter(lambda: f.read(1 << 20), b''):
+                h.update(b)
+        res = _lib_hashes[k] = h.hexdigest()
+    return res
+
+
+def _link(src, dst):
+    try:
+        os.link(str(src), str(dst))
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(str(src), str(dst))
+
+
+def _mark_saved(run_dir):
+    try:
+        run_dir.join(_SAVED_FILE).write('')
+    except Exception:
+        # save will be tried again on the next status
+        pass
+
+
+def _root():
+    return pkio.mkdir_parent(srdb.root().join(_DIR_NAME))
+
+
+cfg = pkconfig.init(
+    enabled=(False, bool, 'share results of identical non-parallel reports'),
+    max_bytes=(2 * 1024 ** 3, int, 'evict least recently used results above this size'),
+)
@@ -7,6 +7,9 @@ u"""sirepo package
 from __future__ import absolute_import, division, print_function
 
 from pykern import pkcollections
+from pykern import pkconfig
+from pykern import pkjson
+from pykern.pkdebug import pkdp, pkdc, pkdlog, pkdexc
 from sirepo import mpi
 from sirepo.template import template_common
 import os
@@ -71,6 +74,12 @@ class _LocalReportJob:
 
 
 async def run_extract_job(run_dir, cmd, backend_info):
+    if cfg.extract_pool_size > 0:
+        return await _pool.run(run_dir, cmd)
+    return await _run_extract_process(run_dir, cmd)
+
+
+async def _run_extract_process(run_dir, cmd):
     env = _subprocess_env()
     # we're in py3 mode, and regular subprocesses will inherit our
     # environment, so we have to manually switch back to py2 mode.
@@ -112,4 +121,168 @@ async def run_extract_job(run_dir, cmd, backend_info):
         stderr=stderr,
     )
 
-    return stdout.decode('utf-8')
+
+def _sim_type(run_dir):
+    """Which template will be used by extract jobs in run_dir, if known"""
+    p = run_dir.join(template_common.INPUT_BASE_NAME + '.json')
+    try:
+        return pkjson.load_any(p).simulationType
+    except Exception:
+        # the worker will report the real error
+        return None
+
+
+class _ExtractWorker:
+    """Long-lived `sirepo extract worker` process
+
+    Requests and replies are single lines of json over stdin/stdout. stderr
+    is inherited so the worker's logs end up in the daemon's log.
+    """
+    def __init__(self, sim_type):
+        self.sim_type = sim_type
+        self.requests = 0
+        self._buf = bytearray()
+        env = _subprocess_env()
+        env['PYENV_VERSION'] = 'py2'
+        cmd = ['pyenv', 'exec', 'sirepo', 'extract', 'worker']
+        if sim_type:
+            cmd.append(sim_type)
+        self._trio_process = trio.Process(
+            cmd,
+            start_new_session=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+
+    async def aclose(self):
+        self._trio_process.kill()
+        await self._trio_process.aclose()
+
+    async def call(self, run_dir, subcmd, arg):
+        self.requests += 1
+        await self._trio_process.stdin.send_all(
+            pkjson.dump_bytes(
+                {'run_dir': str(run_dir), 'subcmd': subcmd, 'arg': arg},
+            ) + b'\n',
+        )
+        while b'\n' not in self._buf:
+            data = await self._trio_process.stdout.receive_some(4096)
+            if not data:
+                raise EOFError('extract worker exited unexpectedly')
+            self._buf += data
+        i = self._buf.index(b'\n')
+        reply = pkjson.load_any(bytes(self._buf[:i]))
+        del self._buf[:i + 1]
+        return reply
+
+
+class _ExtractWorkerPool:
+    """Bounded pool of warm extract workers, one template per worker
+
+    Idle workers are reused for the same sim_type. When the pool is full,
+    the least recently used idle worker is closed to make room; if there
+    are none, the request waits for a worker to be released. Workers are
+    recycled after `cfg.extract_worker_max_requests` so leaks in templates
+    don't accumulate, and discarded if a request takes longer than
+    `cfg.extract_worker_timeout`.
+    """
+    def __init__(self):
+        # [_ExtractWorker], most recently used last
+        self._idle = []
+        self._count = 0
+        self._released = trio.hazmat.ParkingLot()
+
+    async def run(self, run_dir, cmd):
+        # cmd is ['sirepo', 'extract', subcmd, arg]
+        subcmd, arg = cmd[2:]
+        w = await self._acquire(_sim_type(run_dir))
+        reply = None
+        try:
+            with trio.move_on_after(cfg.extract_worker_timeout):
+                reply = await w.call(run_dir, subcmd, arg)
+        except (EOFError, trio.BrokenResourceError) as e:
+            await self._discard(w)
+            return pkcollections.Dict(
+                returncode=1,
+                stdout=b'',
+                stderr='extract worker failed: {}'.format(e).encode('utf-8'),
+            )
+        except BaseException:
+            # worker state is unknown, e.g. cancelled mid-request
+            await self._discard(w)
+            raise
+        if reply is None:
+            # hung template call, the worker can't be reused
+            await self._discard(w)
+            return pkcollections.Dict(
+                returncode=1,
+                stdout=b'',
+                stderr='extract worker timed out after {}s'.format(
+                    cfg.extract_worker_timeout,
+                ).encode('utf-8'),
+            )
+        await self._release(w)
+        if 'error' in reply:
+            return pkcollections.Dict(
+                returncode=1,
+                stdout=b'',
+                stderr=reply.error.encode('utf-8'),
+            )
+        return pkcollections.Dict(
+            returncode=0,
+            stdout=pkjson.dump_bytes(reply.result),
+            stderr=b'',
+        )
+
+    async def _acquire(self, sim_type):
+        while True:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i].sim_type == sim_type:
+                    return self._idle.pop(i)
+            if self._count >= cfg.extract_pool_size and self._idle:
+                # least recently used idle worker of another type
+                await self._discard(self._idle.pop(0))
+            if self._count < cfg.extract_pool_size:
+                self._count += 1
+                pkdc('starting extract worker sim_type={}', sim_type)
+                try:
+                    return _ExtractWorker(sim_type)
+                except BaseException:
+                    self._count -= 1
+                    raise
+            await self._released.park()
+
+    async def _discard(self, worker):
+        self._count -= 1
+        self._released.unpark()
+        with trio.CancelScope(shield=True):
+            await worker.aclose()
+
+    async def _release(self, worker):
+        if worker.requests >= cfg.extract_worker_max_requests:
+            await self._discard(worker)
+            return
+        self._idle.append(worker)
+        self._released.unpark()
+
+
+cfg = pkconfig.init(
+    extract_pool_size=(
+        4,
+        int,
+        'maximum warm extract workers (0 runs a process per extract job)',
+    ),
+    extract_worker_max_requests=(
+        100,
+        int,
+        'extract requests served before a worker is recycled',
+    ),
+    extract_worker_timeout=(
+        300,
+        int,
+        'seconds an extract request may take before its worker is discarded',
+    ),
+)
+
+_pool = _ExtractWorkerPool()
@@ -12,8 +12,10 @@ from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
 from sirepo.template import adm
 from sirepo import api_perm
 from sirepo import feature_config
+from sirepo import frame_cache
 from sirepo import http_reply
 from sirepo import http_request
+from sirepo import result_cache
 from sirepo import runner
 from sirepo import runner_client
 from sirepo import simulation_db
@@ -117,6 +119,10 @@ def api_deleteFile():
             'fileName': filename,
         })
     p = _lib_filepath(req['simulationType'], filename, req['fileType'])
+    template = sirepo.template.import_module(req['simulationType'])
+    if hasattr(template, 'remove_lib_file_cache'):
+        # caches may be keyed by the file's contents
+        template.remove_lib_file_cache(p)
     pkio.unchecked_remove(p)
     return http_reply.gen_json({})
 
@@ -238,9 +244,8 @@ def api_listFiles(simulation_type, simulation_id, file_type):
 def api_findByName(simulation_type, application_mode, simulation_name):
     sim_type = sirepo.template.assert_sim_type(simulation_type)
     # use the existing named simulation, or copy it from the examples
-    rows = simulation_db.iterate_simulation_datafiles(
+    rows = simulation_db.simulation_list(
         sim_type,
-        simulation_db.process_simulation_list,
         {
             'simulation.name': simulation_name,
             'simulation.isExample': True,
@@ -251,9 +256,8 @@ def api_findByName(simulation_type, application_mode, simulation_name):
             if s['models']['simulation']['name'] != simulation_name:
                 continue
             simulation_db.save_new_example(s)
-            rows = simulation_db.iterate_simulation_datafiles(
+            rows = simulation_db.simulation_list(
                 sim_type,
-                simulation_db.process_simulation_list,
                 {
                     'simulation.name': simulation_name,
                 },
@@ -578,28 +582,57 @@ def api_simulationFrame(frame_id):
     template = sirepo.template.import_module(data)
     data['report'] = template.get_animation_name(data)
     run_dir = simulation_db.simulation_run_dir(data)
-    model_data = simulation_db.read_json(run_dir.join(template_common.INPUT_BASE_NAME))
-    if feature_config.cfg.runner_daemon:
-        # XX TODO: it would be better if the frontend passed the jhash to this
-        # call. Since it doesn't, we have to read it out of the run_dir, which
-        # creates a race condition -- we might return a frame from a different
-        # version of the report than the one the frontend expects.
-        jhash = template_common.report_parameters_hash(model_data)
-        frame = runner_client.run_extract_job(
-            run_dir, jhash, 'get_simulation_frame', data,
-        )
+    input_file = simulation_db.json_filename(template_common.INPUT_BASE_NAME, run_dir)
+    model_data = simulation_db.read_json(input_file)
+    # XX TODO: it would be better if the frontend passed the jhash to this
+    # call. Since it doesn't, we have to read it out of the run_dir, which
+    # creates a race condition -- we might return a frame from a different
+    # version of the report than the one the frontend expects.
+    jhash = template_common.report_parameters_hash(model_data)
+    k = frame_cache.key(
+        run_dir,
+        jhash,
+        input_file,
+        (frame_id, http_reply.matrix_encoding()),
+    )
+    e = frame_cache.get(k)
+    if e:
+        is_final = True
     else:
-        frame = template.get_simulation_frame(run_dir, data, model_data)
-    resp = http_reply.gen_json(frame)
-    if 'error' not in frame and template.WANT_BROWSER_FRAME_CACHE:
+        # status must be read first: a frame extracted while the job is
+        # running isn't final even if the job completes right after
+        if feature_config.cfg.runner_daemon:
+            is_final = runner_client.report_job_status(run_dir, jhash) \
+                is runner_client.JobStatus.COMPLETED
+            frame = runner_client.run_extract_job(
+                run_dir, jhash, 'get_simulation_frame', data,
+            )
+        else:
+            is_final = simulation_db.read_status(run_dir) == 'completed'
+            frame = template.get_simulation_frame(run_dir, data, model_data)
+        if 'error' in frame:
+            return http_reply.headers_for_no_cache(http_reply.gen_json(frame))
+        e = frame_cache.entry(
+            simulation_db.generate_json(http_reply.encode_matrix(frame)).encode('utf-8'),
+        )
+        if is_final:
+            # frames of a running report may still change
+            frame_cache.put(k, e)
+    resp = flask.current_app.response_class(e.body, mimetype=http_reply.MIME_TYPE.json)
+    if template.WANT_BROWSER_FRAME_CACHE:
         now = datetime.datetime.utcnow()
         expires = now + datetime.timedelta(365)
         resp.headers['Cache-Control'] = 'public, max-age=31536000'
         resp.headers['Expires'] = expires.strftime("%a, %d %b %Y %H:%M:%S GMT")
         resp.headers['Last-Modified'] = now.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    elif is_final:
+        # browser must revalidate, which is a 304 when the frame is unchanged
+        resp.headers['Cache-Control'] = 'private, no-cache'
     else:
         http_reply.headers_for_no_cache(resp)
-    return resp
+    resp.vary.add(http_reply.MATRIX_ENCODING_HEADER)
+    resp.set_etag(e.etag)
+    return resp.make_conditional(flask.request)
 
 
 @api_perm.require_user
@@ -610,7 +643,7 @@ def api_listSimulations():
     simulation_db.verify_app_directory(sim_type)
     return http_reply.gen_json(
         sorted(
-            simulation_db.iterate_simulation_datafiles(sim_type, simulation_db.process_simulation_list, search),
+            simulation_db.simulation_list(sim_type, search),
             key=lambda row: row['name'],
         )
     )
@@ -671,10 +704,11 @@ def api_updateFolder():
     data = _parse_data_input()
     old_name = data['oldName']
     new_name = data['newName']
-    for row in simulation_db.iterate_simulation_datafiles(data['simulationType'], _simulation_data):
-        folder = row['models']['simulation']['folder']
-        if folder.startswith(old_name):
-            row['models']['simulation']['folder'] = re.sub(re.escape(old_name), new_name, folder, 1)
+    sim_type = data['simulationType']
+    for r in simulation_db.iterate_simulation_catalog(sim_type):
+        if r.folder.startswith(old_name):
+            row = simulation_db.read_simulation_json(sim_type, sid=r.sid)
+            row['models']['simulation']['folder'] = re.sub(re.escape(old_name), new_name, r.folder, 1)
             simulation_db.save_simulation_json(row)
     return http_reply.gen_json_ok()
 
@@ -849,12 +883,6 @@ def _simulation_error(err, *args, **kwargs):
     return {'state': 'error', 'error': err}
 
 
-def _simulation_data(res, path, data):
-    """Iterator function to return entire simulation data
-    """
-    res.append(data)
-
-
 def _simulation_name(res, path, data):
     """Iterator function to return simulation name
     """
@@ -983,6 +1011,8 @@ def _simulation_run_status(data, quiet=False):
                         return _simulation_error(err, 'error in read_result', rep.run_dir)
                 else:
                     res = res2
+                    if rep.cache_hit and res.get('state') == 'completed':
+                        result_cache.save(rep.cached_data, rep.run_dir)
         if simulation_db.is_parallel(data):
             new = template.background_percent_complete(
                 rep.model_name,
@@ -1031,7 +1061,11 @@ def _simulations_using_file(simulation_type, file_type, search_name, ignore_sim_
     template = sirepo.template.import_module(simulation_type)
     if not hasattr(template, 'validate_delete_file'):
         return res
-    for row in simulation_db.iterate_simulation_datafiles(simulation_type, _simulation_data):
+    for r in simulation_db.iterate_simulation_catalog(simulation_type):
+        # lib file names are built from (or equal to) a string field value
+        if not any(search_name.endswith(v) for v in r.strings):
+            continue
+        row = simulation_db.read_simulation_json(simulation_type, sid=r.sid)
         if template.validate_delete_file(row, search_name, file_type):
             sim = row['models']['simulation']
             if ignore_sim_id and sim['simulationId'] == ignore_sim_id:
@@ -1061,6 +1095,8 @@ def _start_simulation(data):
         'startTime': int(time.time()),
         'state': 'pending',
     }
+    if not data.get('forceRun') and result_cache.restore(data):
+        return
     runner.job_start(data)
 
 
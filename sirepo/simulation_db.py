@@ -12,6 +12,7 @@ from pykern import pkio
 from pykern import pkresource
 from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
 from sirepo import auth
+from sirepo import catalog_db
 from sirepo import feature_config
 from sirepo import srschema
 from sirepo import util
@@ -30,6 +31,7 @@ import re
 import sirepo.template
 import threading
 import time
+import weakref
 import werkzeug.exceptions
 
 #: Json files
@@ -101,6 +103,12 @@ _serial_prev = 0
 #: Locking for global operations like serial, user moves, etc.
 _global_lock = threading.RLock()
 
+#: Locks for a user's app directory (saves, serial validation), see `_user_lock`
+_user_locks = weakref.WeakValueDictionary()
+
+#: App directory to its `_catalog_dir_state` when the catalog was known to match the data files
+_catalog_state = {}
+
 #: configuration
 cfg = None
 
@@ -161,6 +169,7 @@ def delete_simulation(simulation_type, sid):
     """Deletes the simulation's directory.
     """
     pkio.unchecked_remove(simulation_dir(simulation_type, sid))
+    catalog_db.delete(simulation_dir(simulation_type), [sid])
 
 
 def examples(app):
@@ -358,6 +367,32 @@ def iterate_simulation_datafiles(simulation_type, op, search=None):
     return res
 
 
+def iterate_simulation_catalog(simulation_type, search=None):
+    """Catalog rows of the user's simulations
+
+    The catalog is brought up to date first: only data files which are
+    new, changed on disk, or from an older schema version are read.
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+        search (dict): only `simulation.` fields are supported [None]
+
+    Returns:
+        list: rows (see `catalog_db`)
+    """
+    assert _is_catalog_search(search), \
+        '{}: search must be on simulation fields'.format(search)
+    res = []
+    for row in _refresh_catalog(simulation_type).values():
+        if search and not _search_data(
+            pkcollections.Dict(models=pkcollections.Dict(simulation=row.simulation)),
+            search,
+        ):
+            continue
+        res.append(row)
+    return res
+
+
 def job_id(data):
     """A Job is a simulation and report name.
 
@@ -754,7 +789,8 @@ def save_simulation_json(data, do_validate=True):
     s = data.models.simulation
     sim_type = data.simulationType
     fn = sim_data_file(sim_type, s.simulationId)
-    with _global_lock:
+    sim_dir = fn.dirpath().dirpath()
+    with _user_lock(sim_dir):
         need_validate = True
         try:
             # OPTIMIZATION: If folder/name same, avoid reading entire folder
@@ -765,21 +801,60 @@ def save_simulation_json(data, do_validate=True):
         except Exception:
             pass
         if need_validate and do_validate:
+            if _catalog_state.get(str(sim_dir)) != _catalog_dir_state(sim_dir):
+                # changed by another process, a user move, etc.
+                _refresh_catalog(sim_type)
             srschema.validate_name(
                 data,
-                iterate_simulation_datafiles(
-                    sim_type,
-                    lambda res, _, d: res.append(d),
-                    pkcollections.Dict({'simulation.folder': s.folder}),
-                ),
+                [
+                    pkcollections.Dict(
+                        models=pkcollections.Dict(
+                            simulation=pkcollections.Dict(
+                                name=r.name,
+                                simulationId=r.sid,
+                            ),
+                        ),
+                    ) for r in catalog_db.names_in_folder(sim_dir, s.folder, s.name)
+                ],
                 SCHEMA_COMMON.common.constants.maxSimCopies
             )
             srschema.validate_fields(data, get_schema(data.simulationType))
         s.simulationSerial = _serial_new()
+        is_current = _catalog_state.get(str(sim_dir)) == _catalog_dir_state(sim_dir)
         write_json(fn, data)
+        catalog_db.update(sim_dir, [_catalog_row(fn, data)])
+        if is_current:
+            # only this save changed the directory
+            _catalog_state[str(sim_dir)] = _catalog_dir_state(sim_dir)
     return data
 
 
+def simulation_list(simulation_type, search=None):
+    """Same rows as `process_simulation_list` but from the catalog
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+        search (dict): fields to match [None]
+
+    Returns:
+        list: simulationId, name, folder, last_modified, isExample, simulation
+    """
+    if not _is_catalog_search(search):
+        return iterate_simulation_datafiles(simulation_type, process_simulation_list, search)
+    return [
+        pkcollections.Dict(
+            simulationId=r.sid,
+            name=r.name,
+            folder=r.folder,
+            last_modified=datetime.datetime.fromtimestamp(
+                r.mtime
+            ).strftime('%Y-%m-%d %H:%M'),
+            isExample=r.is_example,
+            simulation=r.simulation,
+        ) for r in iterate_simulation_catalog(simulation_type, search)
+    ]
+
+
 def sim_data_file(sim_type, sim_id):
     """Simulation data file name
 
@@ -925,8 +1000,8 @@ def validate_serial(req_data):
     Returns:
         object: None if all ok, or json response (bad)
     """
-    with _global_lock:
-        sim_type = sirepo.template.assert_sim_type(req_data['simulationType'])
+    sim_type = sirepo.template.assert_sim_type(req_data['simulationType'])
+    with _user_lock(simulation_dir(sim_type)):
         sid = parse_sid(req_data)
         req_ser = req_data['models']['simulation']['simulationSerial']
         curr = read_simulation_json(sim_type, sid=sid)
@@ -998,6 +1073,36 @@ def write_status(status, run_dir):
     pkio.write_text(run_dir.join(_STATUS_FILE), status)
 
 
+def _catalog_dir_state(sim_dir):
+    """Changes when simulations are added, removed, or moved, or the
+    directory is replaced
+
+    Returns:
+        tuple: inode and mtime or None
+    """
+    try:
+        st = os.stat(str(sim_dir))
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime)
+
+
+def _catalog_row(path, data):
+    st = os.stat(str(path))
+    s = data.models.simulation
+    return pkcollections.Dict(
+        sid=py.path.local(path).dirpath().basename,
+        mtime=st.st_mtime,
+        size=st.st_size,
+        version=data.version,
+        name=s.name,
+        folder=s.folder,
+        is_example=s.get('isExample', False),
+        simulation=s,
+        strings=sorted(_data_strings(data.models, set())),
+    )
+
+
 def _create_example_and_lib_files(simulation_type):
     d = simulation_dir(simulation_type)
     pkio.mkdir_parent(d)
@@ -1013,6 +1118,19 @@ def _create_example_and_lib_files(simulation_type):
             f.copy(d)
 
 
+def _data_strings(value, res):
+    """String values in models, used to find lib file references"""
+    if isinstance(value, dict):
+        for v in value.values():
+            _data_strings(v, res)
+    elif isinstance(value, list):
+        for v in value:
+            _data_strings(v, res)
+    elif isinstance(value, pkconfig.STRING_TYPES) and value:
+        res.add(value)
+    return res
+
+
 def _files_in_schema(schema):
     """Relative paths of local and external files of the given load and file type listed in the schema
     The order matters for javascript files
@@ -1036,9 +1154,8 @@ def _files_in_schema(schema):
 
 
 def _find_user_simulation_copy(simulation_type, sid):
-    rows = iterate_simulation_datafiles(
+    rows = simulation_list(
         simulation_type,
-        process_simulation_list,
         pkcollections.Dict({'simulation.outOfSessionSimulationId': sid}),
     )
     if len(rows):
@@ -1059,6 +1176,18 @@ def _init():
     )
 
 
+def _is_catalog_search(search):
+    """Can search be answered with only the simulation model?"""
+    if not search:
+        return True
+    for field in search:
+        path = field.split('.')
+        # single element paths are ignored by _search_data
+        if len(path) > 1 and path[0] != 'simulation':
+            return False
+    return True
+
+
 def _merge_dicts(base, derived, depth=-1):
     """Copy the items in the base dictionary into the derived dictionary, to the specified depth
 
@@ -1147,6 +1276,52 @@ def _random_id(parent_dir, simulation_type=None):
     raise RuntimeError('{}: failed to create unique directory'.format(parent_dir))
 
 
+def _refresh_catalog(simulation_type):
+    """Update the catalog from the data files on disk
+
+    Returns:
+        dict: sid to catalog row
+    """
+    sim_dir = simulation_dir(simulation_type)
+    with _user_lock(sim_dir):
+        return _refresh_catalog_locked(simulation_type, sim_dir)
+
+
+def _refresh_catalog_locked(simulation_type, sim_dir):
+    rows = catalog_db.load(sim_dir)
+    changed = []
+    found = set()
+    for path in glob.glob(
+        str(sim_dir.join('*', SIMULATION_DATA_FILE)),
+    ):
+        path = py.path.local(path)
+        sid = path.dirpath().basename
+        found.add(sid)
+        r = rows.get(sid)
+        st = os.stat(str(path))
+        if r and r.mtime == st.st_mtime and r.size == st.st_size \
+            and r.version == SCHEMA_COMMON.version:
+            continue
+        try:
+            data = open_json_file(simulation_type, path, fixup=False)
+            data, c = fixup_old_data(data)
+            # save changes to avoid re-applying fixups on each iteration
+            if c:
+                save_simulation_json(data, do_validate=False)
+        except ValueError as e:
+            pkdlog('{}: error: {}', path, e)
+            continue
+        rows[sid] = _catalog_row(path, data)
+        changed.append(rows[sid])
+    removed = set(rows.keys()) - found
+    for sid in removed:
+        del rows[sid]
+    catalog_db.delete(sim_dir, removed)
+    catalog_db.update(sim_dir, changed)
+    _catalog_state[str(sim_dir)] = _catalog_dir_state(sim_dir)
+    return rows
+
+
 def _report_dir(data):
     """Return the report execution directory name. Allows multiple models to get data from same simulation run.
     """
@@ -1231,4 +1406,23 @@ def _user_dir():
     auth.user_dir_not_found(uid)
 
 
+def _user_lock(sim_dir):
+    """Lock for operations on one user's app directory
+
+    Saves by different users do not serialize. The lock is discarded
+    when no thread holds a reference to it.
+
+    Args:
+        sim_dir (py.path): user's app directory
+    Returns:
+        threading.RLock: lock for `sim_dir`
+    """
+    k = str(sim_dir)
+    with _global_lock:
+        res = _user_locks.get(k)
+        if res is None:
+            res = _user_locks[k] = threading.RLock()
+        return res
+
+
 _init()
@@ -798,62 +798,35 @@ def _file_info(filename, run_dir, id, output_index):
                 'lastUpdateTime': int(os.path.getmtime(str(file_path))),
             }
         return None
-    try:
-        if sdds.sddsdata.InitializeInput(_SDDS_INDEX, str(file_path)) != 1:
-            return None
-        column_names = sdds.sddsdata.GetColumnNames(_SDDS_INDEX)
-        plottable_columns = []
-        double_column_count = 0
-        field_range = {}
-        for col in column_names:
-            col_type = sdds.sddsdata.GetColumnDefinition(_SDDS_INDEX, col)[4]
-            if col_type < _SDDS_STRING_TYPE:
-                plottable_columns.append(col)
-            if col_type in _SDDS_DOUBLE_TYPES:
-                double_column_count += 1
-            field_range[col] = []
-        parameter_names = sdds.sddsdata.GetParameterNames(_SDDS_INDEX)
-        parameters = dict([(p, []) for p in parameter_names])
-        page_count = 0
-        row_counts = []
-        while True:
-            if sdds.sddsdata.ReadPage(_SDDS_INDEX) <= 0:
-                break
-            row_counts.append(sdds.sddsdata.RowCount(_SDDS_INDEX))
-            page_count += 1
-            for i, p in enumerate(parameter_names):
-                parameters[p].append(_safe_sdds_value(sdds.sddsdata.GetParameter(_SDDS_INDEX, i)))
-            for col in column_names:
-                values = sdds.sddsdata.GetColumn(
-                    _SDDS_INDEX,
-                    column_names.index(col),
-                )
-                if not len(values):
-                    pass
-                elif len(field_range[col]):
-                    field_range[col][0] = min(_safe_sdds_value(min(values)), field_range[col][0])
-                    field_range[col][1] = max(_safe_sdds_value(max(values)), field_range[col][1])
-                else:
-                    field_range[col] = [_safe_sdds_value(min(values)), _safe_sdds_value(max(values))]
-        return {
-            'isAuxFile': False if double_column_count > 1 else True,
-            'filename': filename,
-            'id': '{}-{}'.format(id, output_index),
-            'rowCounts': row_counts,
-            'pageCount': page_count,
-            'columns': column_names,
-            'parameters': parameters,
-            'parameterDefinitions': _parameter_definitions(parameters),
-            'plottableColumns': plottable_columns,
-            'lastUpdateTime': int(os.path.getmtime(str(file_path))),
-            'isHistogram': _is_histogram_file(filename, column_names),
-            'fieldRange': field_range,
-        }
-    finally:
-        try:
-            sdds.sddsdata.Terminate(_SDDS_INDEX)
-        except Exception:
-            pass
+    summary = sdds_util.file_summary(str(file_path))
+    if not summary:
+        return None
+    column_names = summary['columns']
+    plottable_columns = []
+    double_column_count = 0
+    for col in column_names:
+        col_type = summary['columnDefinitions'][col][4]
+        if col_type < _SDDS_STRING_TYPE:
+            plottable_columns.append(col)
+        if col_type in _SDDS_DOUBLE_TYPES:
+            double_column_count += 1
+    parameters = dict([
+        (p, map(_safe_sdds_value, v)) for p, v in summary['parameters'].items()
+    ])
+    return {
+        'isAuxFile': False if double_column_count > 1 else True,
+        'filename': filename,
+        'id': '{}-{}'.format(id, output_index),
+        'rowCounts': summary['rowCounts'],
+        'pageCount': len(summary['rowCounts']),
+        'columns': column_names,
+        'parameters': parameters,
+        'parameterDefinitions': _parameter_definitions(summary['parameterDefinitions']),
+        'plottableColumns': plottable_columns,
+        'lastUpdateTime': int(os.path.getmtime(str(file_path))),
+        'isHistogram': _is_histogram_file(filename, column_names),
+        'fieldRange': summary['fieldRange'],
+    }
 
 
 def _find_first_command(data, command_type):
@@ -1172,13 +1145,13 @@ def _output_info(run_dir):
     return res
 
 
-def _parameter_definitions(parameters):
-    """Convert parameters to useful definitions"""
+def _parameter_definitions(definitions):
+    """Convert sdds parameter definitions to useful definitions"""
     res = {}
-    for p in parameters:
+    for p in definitions:
         res[p] = dict(zip(
             ['symbol', 'units', 'description', 'format_string', 'type', 'fixed_value'],
-            sdds.sddsdata.GetParameterDefinition(_SDDS_INDEX, p),
+            definitions[p],
         ))
     return res
 
@@ -10,6 +10,7 @@ from pykern.pkdebug import pkdc, pkdlog, pkdp
 from sirepo import simulation_db
 from sirepo.template import elegant_common
 from sirepo.template import elegant_lattice_parser
+from sirepo.template import elegant_rpn
 import ntpath
 import re
 import subprocess
@@ -97,6 +98,9 @@ def max_id(data):
 def parse_rpn_value(value, variable_list):
     variables = {x['name']: x['value'] for x in variable_list}
     depends = build_variable_dependency(value, variables, [])
+    res = elegant_rpn.evaluate(value, variables, depends)
+    if res is not None:
+        return res, None
     #TODO(robnagler) scan variable values for strings. Need to be parsable
     var_list = ' '.join(map(lambda x: '{} sto {}'.format(variables[x], x), depends))
     #TODO(pjm): security - need to scrub field value
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+u"""Evaluate elegant rpn expressions without starting rpnl
+
+Handles arithmetic, math functions, stack operators, ``sto``, the
+constants in defns.rpn, and the defns.rpn functions which use only
+those. Anything else (conditionals, strings, files, ...) returns None
+so the caller can run rpnl.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkio
+from pykern import pkjson
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo.template import elegant_common
+import collections
+import hashlib
+import math
+import re
+import threading
+
+#: Most expressions and variable sets remembered
+_CACHE_MAX = 10000
+
+#: Deepest nesting of defns.rpn functions
+_MAX_DEPTH = 50
+
+_NUMBER_RE = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+_BINARY = {
+    '*': lambda x, y: x * y,
+    '+': lambda x, y: x + y,
+    '-': lambda x, y: x - y,
+    '/': lambda x, y: x / y,
+    'pow': math.pow,
+}
+
+_UNARY = {
+    # defns.rpn defines abs with conditionals
+    'abs': abs,
+    'acos': math.acos,
+    'asin': math.asin,
+    'atan': math.atan,
+    'cos': math.cos,
+    'exp': math.exp,
+    'int': lambda x: float(int(x)),
+    'ln': math.log,
+    'sin': math.sin,
+    'sqr': lambda x: x * x,
+    'sqrt': math.sqrt,
+}
+
+#: (digest of variables, value) to result, least recently used first
+_cache = collections.OrderedDict()
+
+#: Dict(constants, functions) from defns.rpn
+_defns = None
+
+_lock = threading.Lock()
+
+#: digest of variables to values of variables evaluated so far, least recently used first
+_variable_values = collections.OrderedDict()
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def evaluate(value, variables, depends):
+    """Compute value the same way rpnl would
+
+    Each variable is evaluated once per set of variables.
+
+    Args:
+        value (str): postfix expression
+        variables (dict): name to postfix expression
+        depends (list): variables used by value, dependencies first
+    Returns:
+        float: result (formatted like rpnl output) or None if rpnl is needed
+    """
+    # a digest, because lattices may have hundreds of variables
+    k = hashlib.md5(pkjson.dump_bytes(sorted(variables.items()))).hexdigest()
+    with _lock:
+        res = _cache_get(_cache, (k, value))
+        if res is not None:
+            return res[0]
+        vals = _cache_get(_variable_values, k)
+        if vals is None:
+            vals = {}
+            _cache_put(_variable_values, k, vals)
+        memory = dict(_load_defns().constants)
+        res = None
+        for n in depends:
+            if n not in vals:
+                vals[n] = _run_expr(variables[n], memory)
+            if vals[n] is None:
+                break
+            memory[n] = vals[n]
+        else:
+            res = _run_expr(value, memory)
+            if res is not None:
+                # rpnl prints 15 significant digits
+                res = float('{:.15g}'.format(res))
+        _cache_put(_cache, (k, value), (res,))
+        return res
+
+
+def _cache_get(cache, key):
+    res = cache.pop(key, None)
+    if res is not None:
+        cache[key] = res
+    return res
+
+
+def _cache_put(cache, key, value):
+    cache[key] = value
+    while len(cache) > _CACHE_MAX:
+        cache.popitem(last=False)
+
+
+def _load_defns():
+    global _defns
+
+    if _defns:
+        return _defns
+    res = pkcollections.Dict(constants={}, functions={})
+    name = None
+    body = None
+    for line in pkio.read_text(elegant_common.RESOURCE_DIR.join('defns.rpn')).split('\n'):
+        line = line.strip()
+        if line.startswith('/*'):
+            continue
+        if body is not None:
+            if not line:
+                res.functions[name] = body
+                body = None
+            elif name is None:
+                name = line
+            else:
+                body.extend(line.split())
+            continue
+        if line == 'udf':
+            name = None
+            body = []
+        elif line:
+            try:
+                _run(line.split(), [], res.constants, res.functions, 0)
+            except Exception:
+                pkdc('{}: not a native constant: {}', line, pkdexc())
+    if body is not None and name:
+        res.functions[name] = body
+    _defns = res
+    return res
+
+
+def _run(tokens, stack, memory, functions, depth):
+    if depth > _MAX_DEPTH:
+        raise _Unsupported('too deep')
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        i += 1
+        if _NUMBER_RE.search(t):
+            stack.append(float(t))
+        elif t in _BINARY:
+            y = stack.pop()
+            stack.append(_BINARY[t](stack.pop(), y))
+        elif t in _UNARY:
+            stack.append(_UNARY[t](stack.pop()))
+        elif t == '=':
+            stack.append(stack[-1])
+        elif t == 'pop':
+            stack.pop()
+        elif t == 'swap':
+            stack[-2], stack[-1] = stack[-1], stack[-2]
+        elif t == 'sto':
+            memory[tokens[i]] = stack[-1]
+            i += 1
+        elif t in memory:
+            if t in functions:
+                # ambiguous, let rpnl decide
+                raise _Unsupported(t)
+            stack.append(memory[t])
+        elif t in functions:
+            _run(functions[t], stack, memory, functions, depth + 1)
+        else:
+            raise _Unsupported(t)
+
+
+def _run_expr(value, memory):
+    stack = []
+    try:
+        _run(str(value).split(), stack, memory, _load_defns().functions, 0)
+        res = stack[-1]
+    except Exception:
+        # unsupported token, stack underflow, domain error, ...
+        return None
+    if math.isinf(res) or math.isnan(res):
+        return None
+    return res
@@ -11,7 +11,6 @@ from pykern import pkjinja
 from pykern.pkdebug import pkdc, pkdp
 from sirepo import simulation_db
 from sirepo.template import template_common
-import glob
 import h5py
 import numpy as np
 import re
@@ -353,18 +352,51 @@ def write_parameters(data, run_dir, is_parallel):
     )
 
 
-def _apply_to_grid(grid, values, bounds, cell_size, xdomain, ydomain):
-    xsize = len(values)
-    ysize = len(values[0])
-    xi = _rounded_int((bounds[0][0] - xdomain[0]) / cell_size[0]) * xsize
-    yi = _rounded_int((bounds[1][0] - ydomain[0]) / cell_size[1]) * ysize
-    xscale = _rounded_int((bounds[0][1] - bounds[0][0]) / cell_size[0])
-    yscale = _rounded_int((bounds[1][1] - bounds[1][0]) / cell_size[1])
-    for x in xrange(xsize):
-        for y in xrange(ysize):
-            for x1 in xrange(xscale):
-                for y1 in xrange(yscale):
-                    grid[yi + (y * yscale) + y1][xi + (x * xscale) + x1] = values[y][x]
+def _amr_grid(values, bounding_box, leaves, cell_size, xdomain, ydomain, max_size=None):
+    """Rasterize AMR leaf blocks onto a uniform grid
+
+    Blocks with the same refinement are upsampled together with repeat
+    and written with one fancy-indexed assignment. If the finest grid
+    is larger than max_size, the grid is reduced by a power of two and
+    fine blocks are averaged.
+
+    Args:
+        values (ndarray): blocks x ny x nx
+        bounding_box (ndarray): blocks x dim x [min, max]
+        leaves (ndarray): indices of leaf blocks
+        cell_size (list): size of finest blocks
+        xdomain (list): min, max
+        ydomain (list): min, max
+        max_size (int): max cells per side [None]
+    Returns:
+        ndarray: grid (rows are y)
+    """
+    v = values[leaves]
+    b = bounding_box[leaves]
+    ny, nx = v.shape[1:]
+    xi = np.rint((b[:, 0, 0] - xdomain[0]) / cell_size[0]).astype(int) * nx
+    yi = np.rint((b[:, 1, 0] - ydomain[0]) / cell_size[1]).astype(int) * ny
+    # cells of finest grid per block cell
+    xs = np.rint((b[:, 0, 1] - b[:, 0, 0]) / cell_size[0]).astype(int)
+    ys = np.rint((b[:, 1, 1] - b[:, 1, 0]) / cell_size[1]).astype(int)
+    dim = (
+        _rounded_int((ydomain[1] - ydomain[0]) / cell_size[1]) * ny,
+        _rounded_int((xdomain[1] - xdomain[0]) / cell_size[0]) * nx,
+    )
+    d = 1
+    scales = set(xs.tolist() + ys.tolist())
+    while max_size and max(dim) > max_size * d \
+        and nx % (d * 2) == 0 and ny % (d * 2) == 0 \
+        and all(s % (d * 2) == 0 or (d * 2) % s == 0 for s in scales):
+        d *= 2
+    res = np.zeros((dim[0] // d, dim[1] // d))
+    for sx, sy in set(zip(xs.tolist(), ys.tolist())):
+        k = np.flatnonzero((xs == sx) & (ys == sy))
+        g = _scale_block_axis(_scale_block_axis(v[k], 1, sy, d), 2, sx, d)
+        rows = (yi[k] // d)[:, np.newaxis] + np.arange(g.shape[1])
+        cols = (xi[k] // d)[:, np.newaxis] + np.arange(g.shape[2])
+        res[rows[:, :, np.newaxis], cols[:, np.newaxis, :]] = g
+    return res
 
 
 def _cell_size(f, refine_max):
@@ -424,32 +456,31 @@ def _extract_meshed_plot(run_dir, data):
     frame_index = int(data['frameIndex'])
     report = template_common.parse_animation_args(
         data,
-        {'': ['var', 'startTime']},
+        {
+            '': ['var', 'startTime'],
+            2: ['var', 'gridSize', 'startTime'],
+        },
     )
     field = report['var']
+    # larger plots are averaged down on the server, 0 is full refinement
+    max_size = int(report.get('gridSize') or _SCHEMA.model.varAnimation.gridSize[2]) or None
     filename = _h5_file_list(run_dir)[frame_index]
-    with h5py.File(filename) as f:
+    with h5py.File(filename, 'r') as f:
         params = _parameters(f)
-        node_type = f['node type']
-        bounding_box = f['bounding box']
+        leaves = np.flatnonzero(f['node type'][:] == 1)
+        bounding_box = f['bounding box'][:]
         xdomain = [params['xmin'], params['xmax']]
         ydomain = [params['ymin'], params['ymax']]
-        size = _cell_size(f, params['lrefine_max'])
-        dim = (
-            _rounded_int((ydomain[1] - ydomain[0]) / size[1]) * params['nyb'],
-            _rounded_int((xdomain[1] - xdomain[0]) / size[0]) * params['nxb'],
+        grid = _amr_grid(
+            f[field][:, 0],
+            bounding_box,
+            leaves,
+            _cell_size(f, params['lrefine_max']),
+            xdomain,
+            ydomain,
+            max_size=max_size,
         )
-        grid = np.zeros(dim)
-        values = f[field]
-        amr_grid = []
-        for i in xrange(len(node_type)):
-            if node_type[i] == 1:
-                bounds = bounding_box[i]
-                _apply_to_grid(grid, values[i, 0], bounds, size, xdomain, ydomain)
-                amr_grid.append([
-                    (bounds[0] / 100).tolist(),
-                    (bounds[1] / 100).tolist(),
-                ])
+        amr_grid = (bounding_box[leaves, :2] / 100).tolist()
 
     # imgplot = plt.imshow(grid, extent=[xdomain[0], xdomain[1], ydomain[1], ydomain[0]], cmap='PiYG')
     aspect_ratio = float(params['nblocky']) / params['nblockx']
@@ -515,7 +546,13 @@ def _generate_parameters_file(data):
 
 
 def _h5_file_list(run_dir):
-    return sorted(glob.glob(str(run_dir.join('{}*'.format(_PLOT_FILE_PREFIX)))))
+    return [
+        str(f) for f in template_common.progress_files(
+            run_dir,
+            '.',
+            '{}*'.format(_PLOT_FILE_PREFIX),
+        )
+    ]
 
 
 def _parameters(f):
@@ -528,3 +565,14 @@ def _parameters(f):
 
 def _rounded_int(v):
     return int(round(v))
+
+
+def _scale_block_axis(blocks, axis, scale, reduce_by):
+    """Repeat cells by scale / reduce_by or average when reduce_by is larger"""
+    if scale >= reduce_by:
+        return blocks.repeat(scale // reduce_by, axis=axis)
+    n = reduce_by // scale
+    s = list(blocks.shape)
+    s[axis] //= n
+    s.insert(axis + 1, n)
+    return blocks.reshape(s).mean(axis=axis + 1)
@@ -284,19 +284,7 @@ def _compute_range_across_files(run_dir, data):
     dump_file = _dump_file(run_dir)
     if not os.path.exists(dump_file):
         return res
-    beam_header = hellweg_dump_reader.beam_header(dump_file)
-    for frame in xrange(beam_header.NPoints):
-        beam_info = hellweg_dump_reader.beam_info(dump_file, frame)
-        for field in res:
-            values = hellweg_dump_reader.get_points(beam_info, field)
-            if not len(values):
-                pass
-            elif len(res[field]):
-                res[field][0] = min(min(values), res[field][0])
-                res[field][1] = max(max(values), res[field][1])
-            else:
-                res[field] = [min(values), max(values)]
-    return res
+    return hellweg_dump_reader.beam_ranges(dump_file, list(res.keys()))
 
 
 def _dump_file(run_dir):
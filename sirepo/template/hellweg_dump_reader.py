@@ -6,38 +6,43 @@ u"""Hellweg dump parser.
 """
 from __future__ import absolute_import, division, print_function
 
+from pykern import pkcollections
 import ctypes
 import math
+import numpy as np
+import os.path
 
 _LIVE_PARTICLE = 0
 _LOSS_VALUES = ['live', 'radius_lost', 'phase_lost', 'bz_lost', 'br_lost', 'bth_lost', 'beta_lost', 'step_lost']
 _STRUCTURE_VALUES = ['ksi', 'z', 'a', 'rp', 'alpha', 'sbeta', 'ra', 'rb', 'b_ext', 'num', 'e0', 'ereal', 'prf', 'pbeam', 'bbeta', 'wav', 'wmax', 'xb', 'yb', 'er', 'ex', 'ey', 'enr', 'enx', 'eny', 'e4d', 'e4dn', 'et', 'ent']
 _We0 = 0.5110034e6
 
+# functions of particle record arrays (see `dump_view`) and beam_lmb
 _BEAM_PARAMETER = {
-    'r': lambda p, lmb: abs(p.r * lmb),
-    'th': lambda p, lmb: p.Th * 180.0 / math.pi,
-    'x': lambda p, lmb: p.r * math.cos(p.Th) * lmb,
-    'y': lambda p, lmb: p.r * math.sin(p.Th) * lmb,
-    'br': lambda p, lmb: math.copysign(p.beta.r, p.r),
-    'bth': lambda p, lmb: p.beta.th,
-    'bx': lambda p, lmb: p.beta.r * math.cos(p.Th) - p.beta.th * math.sin(p.Th) * lmb,
-    'by': lambda p, lmb: p.beta.r * math.sin(p.Th) + p.beta.th * math.cos(p.Th) * lmb,
-    'bz': lambda p, lmb: p.beta.z,
-    'ar': lambda p, lmb: math.atan2(p.beta.r, p.beta0),
-    'ath': lambda p, lmb: math.atan2(p.beta.th, p.beta0),
-    'ax': lambda p, lmb: math.atan2(p.beta.r * math.cos(p.Th) - p.beta.th * math.sin(p.Th) * lmb, p.beta.z),
-    'ay': lambda p, lmb: math.atan2(p.beta.r * math.sin(p.Th) + p.beta.th * math.cos(p.Th) * lmb, p.beta.z),
-    'az': lambda p, lmb: 0,
-    'phi': lambda p, lmb: p.phi * 180.0 / math.pi,
-    'zrel': lambda p, lmb: lmb * p.phi / (2 * math.pi),
-    'z0': lambda p, lmb: p.z,
-    'beta': lambda p, lmb: p.beta0,
-    'w': lambda p, lmb: _velocity_to_mev(p.beta0),
+    'r': lambda p, lmb: np.abs(p['r'] * lmb),
+    'th': lambda p, lmb: p['Th'] * 180.0 / math.pi,
+    'x': lambda p, lmb: p['r'] * np.cos(p['Th']) * lmb,
+    'y': lambda p, lmb: p['r'] * np.sin(p['Th']) * lmb,
+    'br': lambda p, lmb: np.copysign(p['beta']['r'], p['r']),
+    'bth': lambda p, lmb: p['beta']['th'],
+    'bx': lambda p, lmb: p['beta']['r'] * np.cos(p['Th']) - p['beta']['th'] * np.sin(p['Th']) * lmb,
+    'by': lambda p, lmb: p['beta']['r'] * np.sin(p['Th']) + p['beta']['th'] * np.cos(p['Th']) * lmb,
+    'bz': lambda p, lmb: p['beta']['z'],
+    'ar': lambda p, lmb: np.arctan2(p['beta']['r'], p['beta0']),
+    'ath': lambda p, lmb: np.arctan2(p['beta']['th'], p['beta0']),
+    'ax': lambda p, lmb: np.arctan2(p['beta']['r'] * np.cos(p['Th']) - p['beta']['th'] * np.sin(p['Th']) * lmb, p['beta']['z']),
+    'ay': lambda p, lmb: np.arctan2(p['beta']['r'] * np.sin(p['Th']) + p['beta']['th'] * np.cos(p['Th']) * lmb, p['beta']['z']),
+    'az': lambda p, lmb: np.zeros(p.shape),
+    'phi': lambda p, lmb: p['phi'] * 180.0 / math.pi,
+    'zrel': lambda p, lmb: lmb * p['phi'] / (2 * math.pi),
+    'z0': lambda p, lmb: p['z'],
+    'beta': lambda p, lmb: p['beta0'],
+    'w': lambda p, lmb: _velocity_to_mev(p['beta0']),
 }
 
+# functions of structure records or record arrays
 _STRUCTURE_PARAMETER = {
-    'z': lambda s: s.ksi * s.lmb,
+    'z': lambda s: s['ksi'] * s['lmb'],
 }
 
 _STRUCTURE_TITLE = {
@@ -168,36 +173,85 @@ def beam_header(filename):
 
 
 def beam_info(filename, idx):
-    info = {}
-    with open (filename, 'rb') as f:
-        header = THeader()
-        assert f.readinto(header) == ctypes.sizeof(header)
-        info['Header'] = header
-        structure = TStructure()
-        size = ctypes.sizeof(structure)
-        if idx > 0:
-            f.seek(idx * size, 1)
-        assert f.readinto(structure) == size
-        info['Structure'] = structure
-        if idx < header.NPoints - 1:
-            f.seek((header.NPoints - idx - 1) * size, 1)
-        beam_header = TBeamHeader()
-        size = ctypes.sizeof(beam_header) + ctypes.sizeof(TParticle()) * header.NParticles
-        if idx > 0:
-            f.seek(idx * size, 1)
-        assert f.readinto(beam_header) == ctypes.sizeof(beam_header)
-        info['BeamHeader'] = beam_header
-        particles = []
-        for _ in xrange(header.NParticles):
-            p = TParticle()
-            assert f.readinto(p) == ctypes.sizeof(p)
-            particles.append(p)
-        info['Particles'] = particles
-        # ensure the expected bytes are present
-        if idx < header.NPoints - 1:
-            f.seek((header.NPoints - idx - 1) * (ctypes.sizeof(beam_header) + ctypes.sizeof(p) * header.NParticles), 1)
-        assert f.readinto(header) == 0
-    return info
+    v = dump_view(filename)
+    return {
+        'Header': v.header,
+        'Structure': v.structures[idx],
+        'BeamHeader': v.beams[idx]['header'],
+        'Particles': v.beams[idx]['particles'],
+    }
+
+
+def beam_ranges(filename, fields):
+    """Min and max of live particle values across all points
+
+    Args:
+        filename (str): dump file
+        fields (list): names in `_BEAM_PARAMETER`
+    Returns:
+        dict: field to [min, max] or [] if there are no live particles
+    """
+    res = {f: [] for f in fields}
+    v = dump_view(filename)
+    for b in v.beams:
+        p = b['particles'][b['particles']['lost'] == _LIVE_PARTICLE]
+        if not len(p):
+            continue
+        lmb = b['header']['beam_lmb']
+        for f in fields:
+            x = _BEAM_PARAMETER[f](p, lmb)
+            r = res[f]
+            if r:
+                r[0] = min(np.min(x), r[0])
+                r[1] = max(np.max(x), r[1])
+            else:
+                res[f] = [np.min(x), np.max(x)]
+    for f in res:
+        res[f] = [float(x) for x in res[f]]
+    return res
+
+
+def dump_view(filename):
+    """Map the dump file as structured arrays
+
+    The file is a THeader, NPoints TStructures, and then for each point
+    a TBeamHeader followed by NParticles TParticles.
+
+    Args:
+        filename (str): dump file
+    Returns:
+        Dict: header (THeader), structures and beams (np.memmap)
+    """
+    h = beam_header(filename)
+    s = _STRUCTURE_DTYPE.itemsize * h.NPoints
+    b = np.dtype(
+        [
+            ('header', _BEAM_HEADER_DTYPE),
+            ('particles', _PARTICLE_DTYPE, (h.NParticles,)),
+        ],
+        align=True,
+    )
+    o = ctypes.sizeof(h)
+    # ensure the expected bytes are present
+    assert os.path.getsize(filename) == o + s + b.itemsize * h.NPoints, \
+        '{}: unexpected dump file size'.format(filename)
+    return pkcollections.Dict(
+        header=h,
+        structures=np.memmap(
+            filename,
+            dtype=_STRUCTURE_DTYPE,
+            mode='r',
+            offset=o,
+            shape=(h.NPoints,),
+        ),
+        beams=np.memmap(
+            filename,
+            dtype=b,
+            mode='r',
+            offset=o + s,
+            shape=(h.NPoints,),
+        ),
+    )
 
 
 def get_label(field):
@@ -218,14 +272,11 @@ def get_parameter_title(field):
 
 
 def get_points(info, field):
-    res = []
-    fn = _BEAM_PARAMETER[field]
-    lmb = info['BeamHeader'].beam_lmb
-
-    for p in info['Particles']:
-        if p.lost == _LIVE_PARTICLE:
-            res.append(fn(p, lmb))
-    return res
+    p = info['Particles']
+    return _BEAM_PARAMETER[field](
+        p[p['lost'] == _LIVE_PARTICLE],
+        info['BeamHeader']['beam_lmb'],
+    )
 
 
 def parameter_index(name):
@@ -233,62 +284,39 @@ def parameter_index(name):
 
 
 def particle_info(filename, field, count):
-    info = {}
-    with open (filename, 'rb') as f:
-        header = THeader()
-        assert f.readinto(header) == ctypes.sizeof(header)
-        info['Header'] = header
-        if count > header.NPoints:
-            count = header.NPoints
-        z_values = []
-        yfn = _BEAM_PARAMETER[field]
-        zfn = _STRUCTURE_PARAMETER['z']
-        for _ in xrange(header.NPoints):
-            structure = TStructure()
-            assert f.readinto(structure) == ctypes.sizeof(structure)
-            z_values.append(zfn(structure))
-        info['z_values'] = z_values
-        beam_header_size = ctypes.sizeof(TBeamHeader())
-        particle_size = ctypes.sizeof(TParticle())
-        y_map = {}
-        indices = []
-        for i in xrange(count):
-            idx = int(round((i * header.NParticles) / count))
-            y_map[idx] = []
-            indices.append(idx)
-        y_range = None
-
-        for _ in xrange(header.NPoints):
-            beam_header = TBeamHeader()
-            assert f.readinto(beam_header) == beam_header_size
-            lmb = beam_header.beam_lmb
-            pi = 0
-            for idx in indices:
-                assert idx >= pi
-                if idx > pi:
-                    f.seek((idx - pi) * particle_size, 1)
-                p = TParticle()
-                assert f.readinto(p) == particle_size
-                if p.lost == _LIVE_PARTICLE:
-                    v = yfn(p, lmb)
-                    y_map[idx].append(v)
-                    if y_range:
-                        if v < y_range[0]:
-                            y_range[0] = v
-                        elif v > y_range[1]:
-                            y_range[1] = v
-                    else:
-                        y_range = [v, v]
-                pi = idx + 1
-            if pi < header.NParticles:
-                f.seek((header.NParticles - pi) * particle_size, 1)
-        assert f.readinto(header) == 0
-        y_values = []
-        for idx in sorted(y_map.keys()):
-            y_values.append(y_map[idx])
-        info['y_values'] = y_values
-        info['y_range'] = y_range
-    return info
+    v = dump_view(filename)
+    header = v.header
+    if count > header.NPoints:
+        count = header.NPoints
+    indices = sorted(set(
+        int(round((i * header.NParticles) / count)) for i in range(count)
+    ))
+    # points x selected particles
+    p = v.beams['particles'][:, indices]
+    y = _BEAM_PARAMETER[field](p, v.beams['header']['beam_lmb'][:, np.newaxis])
+    live = p['lost'] == _LIVE_PARTICLE
+    y_range = None
+    if np.any(live):
+        y_range = [float(np.min(y[live])), float(np.max(y[live]))]
+    return {
+        'Header': header,
+        'z_values': _STRUCTURE_PARAMETER['z'](v.structures).tolist(),
+        'y_values': [y[live[:, i], i].tolist() for i in range(len(indices))],
+        'y_range': y_range,
+    }
+
+
+def _dtype(struct):
+    res = np.dtype(
+        [
+            (n, _dtype(t) if issubclass(t, ctypes.Structure) else np.dtype(t))
+            for n, t in struct._fields_
+        ],
+        align=True,
+    )
+    assert res.itemsize == ctypes.sizeof(struct), \
+        '{}: dtype does not match ctypes layout'.format(struct.__name__)
+    return res
 
 
 def _gamma_to_mev(g):
@@ -296,8 +324,13 @@ def _gamma_to_mev(g):
 
 
 def _velocity_to_energy(b):
-    return 1 / math.sqrt(1 - b ** 2)
+    return 1 / np.sqrt(1 - b ** 2)
 
 
 def _velocity_to_mev(b):
     return _gamma_to_mev(_velocity_to_energy(b))
+
+
+_STRUCTURE_DTYPE = _dtype(TStructure)
+_BEAM_HEADER_DTYPE = _dtype(TBeamHeader)
+_PARTICLE_DTYPE = _dtype(TParticle)
@@ -12,7 +12,6 @@ from pykern import pkjinja
 from pykern.pkdebug import pkdc, pkdp
 from sirepo import simulation_db
 from sirepo.template import template_common, sdds_util
-import glob
 import math
 import os.path
 import py.path
@@ -456,10 +455,10 @@ def _generate_parameters_file(data):
 def _ion_files(run_dir):
     # sort files by file number suffix
     res = []
-    for f in glob.glob(str(run_dir.join('{}*'.format(_ION_FILE_PREFIX)))):
-        m = re.match(r'^.*?(\d+)\.txt$', f)
+    for f in template_common.progress_files(run_dir, '.', '{}*'.format(_ION_FILE_PREFIX)):
+        m = re.match(r'^.*?(\d+)\.txt$', str(f))
         if m:
-            res.append([f, int(m.group(1))])
+            res.append([str(f), int(m.group(1))])
     return map(lambda v: v[0], sorted(res, key=lambda v: v[1]))
 
 
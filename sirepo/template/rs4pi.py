@@ -13,6 +13,7 @@ from pykern.pkdebug import pkdc, pkdp
 from scipy.ndimage.interpolation import zoom
 from sirepo import simulation_db
 from sirepo.template import template_common
+import concurrent.futures
 import ctypes
 import datetime
 import glob
@@ -22,7 +23,6 @@ import os
 import os.path
 import py.path
 import re
-import struct
 import time
 import werkzeug
 import zipfile
@@ -53,8 +53,6 @@ _DICOM_MIN_VALUE = -1000
 _DOSE_DICOM_FILE = RTDOSE_EXPORT_FILENAME
 _DOSE_FILE = 'dose3d.dat'
 _EXPECTED_ORIENTATION = np.array([1, 0, 0, 0, 1, 0])
-# using np.float32 for pixel storage
-_FLOAT_SIZE = 4
 _PIXEL_FILE = 'pixels3d.dat'
 _RADIASOFT_ID = 'RadiaSoft'
 _ROI_FILE_NAME = 'rs4pi-roi-data.json'
@@ -221,7 +219,15 @@ def get_simulation_frame(run_dir, data, model_data):
     if data['modelName'].startswith('dicomAnimation'):
         plane = args[0]
         res = simulation_db.read_json(_dicom_path(model_data['models']['simulation'], plane, frame_index))
-        res['pixel_array'] = _read_pixel_plane(plane, frame_index, model_data)
+        # optional display size after dicomPlane and startTime
+        pixels = _read_pixel_plane(
+            plane,
+            frame_index,
+            model_data,
+            max_size=int(args[2]) if len(args) > 2 and args[2] else None,
+        )
+        res['shape'] = list(pixels.shape)
+        res['pixel_array'] = pixels.tolist()
         return res
     if data['modelName'] == 'dicomDose':
         return {
@@ -324,10 +330,7 @@ def _calculate_domain(frame):
     ]
 
 
-def _compute_histogram(simulation, frames):
-    pixels = []
-    for frame in frames:
-        pixels.append(frame['pixels'])
+def _compute_histogram(simulation, frames, pixels):
     histogram = _histogram_from_pixels(pixels)
     filename = _roi_file(simulation['simulationId'])
     if os.path.exists(filename):
@@ -393,55 +396,62 @@ def _extract_series_frames(simulation, dicom_dir):
     #TODO(pjm): give user a choice between multiple study/series if present
     selected_series = None
     frames = {}
-    dicom_dose = None
     rt_struct_path = None
     res = {
         'description': '',
     }
+    paths = []
     for path in pkio.walk_tree(dicom_dir):
         if pkio.has_file_extension(str(path), 'dcm'):
-            plan = dicom.read_file(str(path))
-            if plan.SOPClassUID == _DICOM_CLASS['RT_STRUCT']:
-                rt_struct_path = str(path)
-            elif plan.SOPClassUID == _DICOM_CLASS['RT_DOSE']:
+            paths.append(str(path))
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        # headers only, pixels are decoded below for the selected series
+        for info in executor.map(_read_dicom_header, paths):
+            if info['SOPClassUID'] == _DICOM_CLASS['RT_STRUCT']:
+                rt_struct_path = info['path']
+            elif info['SOPClassUID'] == _DICOM_CLASS['RT_DOSE']:
+                plan = dicom.read_file(info['path'])
                 res['dicom_dose'] = _summarize_rt_dose(simulation, plan)
                 plan.save_as(_dose_dicom_filename(simulation))
-            if plan.SOPClassUID != _DICOM_CLASS['CT_IMAGE']:
+            if info['SOPClassUID'] != _DICOM_CLASS['CT_IMAGE']:
                 continue
-            orientation = _float_list(plan.ImageOrientationPatient)
-            if not (_EXPECTED_ORIENTATION == orientation).all():
+            if not (_EXPECTED_ORIENTATION == info['ImageOrientationPatient']).all():
                 continue
             if not selected_series:
-                selected_series = plan.SeriesInstanceUID
-                res['StudyInstanceUID'] = plan.StudyInstanceUID
-                res['PixelSpacing'] = plan.PixelSpacing
-                if hasattr(plan, 'SeriesDescription'):
-                    res['description'] = plan.SeriesDescription
-            if selected_series != plan.SeriesInstanceUID:
+                selected_series = info['SeriesInstanceUID']
+                res['StudyInstanceUID'] = info['StudyInstanceUID']
+                res['PixelSpacing'] = info['PixelSpacing']
+                if 'SeriesDescription' in info:
+                    res['description'] = info['SeriesDescription']
+            if selected_series != info['SeriesInstanceUID']:
                 continue
-            info = {
-                'pixels': np.float32(plan.pixel_array),
-                'shape': plan.pixel_array.shape,
-                'ImagePositionPatient': _string_list(plan.ImagePositionPatient),
-                'ImageOrientationPatient': _float_list(plan.ImageOrientationPatient),
-                'PixelSpacing': _float_list(plan.PixelSpacing),
-            }
-            for f in ('FrameOfReferenceUID', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID'):
-                info[f] = getattr(plan, f)
             z = _frame_id(info['ImagePositionPatient'][2])
             info['frameId'] = z
             if z in frames:
                 raise RuntimeError('duplicate frame with z coord: {}'.format(z))
-            _scale_pixel_data(plan, info['pixels'])
             frames[z] = info
-    if not selected_series:
-        raise RuntimeError('No series found with {} orientation'.format(_EXPECTED_ORIENTATION))
+        if not selected_series:
+            raise RuntimeError('No series found with {} orientation'.format(_EXPECTED_ORIENTATION))
+        sorted_frames = []
+        for z in sorted(_float_list(frames.keys())):
+            sorted_frames.append(frames[_frame_id(z)])
+        shape = sorted_frames[0]['shape']
+        for frame in sorted_frames:
+            if frame['shape'] != shape:
+                raise RuntimeError('frame shape {} differs from series shape {}'.format(frame['shape'], shape))
+        shape = [len(sorted_frames)] + shape
+        filename = _pixel_filename(simulation)
+        # preallocate the volume, each frame is written by a separate process
+        np.memmap(filename, dtype=np.float32, mode='w+', shape=tuple(shape)).flush()
+        for _ in executor.map(
+            _read_dicom_pixels,
+            [(f['path'], filename, i, shape) for i, f in enumerate(sorted_frames)],
+        ):
+            pass
     if rt_struct_path:
         res['regionsOfInterest'] = _summarize_rt_structure(simulation, dicom.read_file(rt_struct_path), frames.keys())
-    sorted_frames = []
     res['frames'] = sorted_frames
-    for z in sorted(_float_list(frames.keys())):
-        sorted_frames.append(frames[_frame_id(z)])
+    res['pixels'] = np.memmap(filename, dtype=np.float32, mode='r', shape=tuple(shape))
     return res
 
 
@@ -535,7 +545,7 @@ def _generate_rtstruct_file(sim_dir, target_dir):
 
 def _histogram_from_pixels(pixels):
     m = 50
-    extent = [np.array(pixels).min(), np.array(pixels).max()]
+    extent = [np.min(pixels), np.max(pixels)]
     if extent[0] < _DICOM_MIN_VALUE:
         extent[0] = _DICOM_MIN_VALUE
     if extent[1] > _DICOM_MAX_VALUE:
@@ -596,6 +606,55 @@ def _pixel_filename(simulation):
     return _sim_file(simulation['simulationId'], _PIXEL_FILE)
 
 
+def _pixel_volume(data):
+    """Memory map of the pixel file, indexed by [t, s, c]"""
+    planes = data['models']['dicomSeries']['planes']
+    return np.memmap(
+        _pixel_filename(data['models']['simulation']),
+        dtype=np.float32,
+        mode='r',
+        shape=(planes['t']['frameCount'], planes['s']['frameCount'], planes['c']['frameCount']),
+    )
+
+
+def _read_dicom_header(path):
+    """Read the fields needed to select the series, without pixel data
+
+    Called in a separate process by _extract_series_frames.
+    """
+    plan = dicom.read_file(path, stop_before_pixels=True)
+    res = {
+        'path': path,
+        'SOPClassUID': str(plan.SOPClassUID),
+    }
+    if res['SOPClassUID'] != _DICOM_CLASS['CT_IMAGE']:
+        return res
+    res.update({
+        'shape': [int(plan.Rows), int(plan.Columns)],
+        'ImagePositionPatient': _string_list(plan.ImagePositionPatient),
+        'ImageOrientationPatient': _float_list(plan.ImageOrientationPatient),
+        'PixelSpacing': _float_list(plan.PixelSpacing),
+    })
+    for f in ('FrameOfReferenceUID', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID'):
+        res[f] = str(getattr(plan, f))
+    if hasattr(plan, 'SeriesDescription'):
+        res['SeriesDescription'] = str(plan.SeriesDescription)
+    return res
+
+
+def _read_dicom_pixels(args):
+    """Decode and scale one frame into the shared pixel volume
+
+    Called in a separate process by _extract_series_frames.
+    """
+    path, filename, idx, shape = args
+    plan = dicom.read_file(path)
+    pixels = np.memmap(filename, dtype=np.float32, mode='r+', shape=tuple(shape))
+    pixels[idx] = plan.pixel_array
+    _scale_pixel_data(plan, pixels[idx])
+    pixels.flush()
+
+
 def _read_dose_frame(idx, data):
     res = []
     if 'dicomDose' not in data['models']:
@@ -604,54 +663,40 @@ def _read_dose_frame(idx, data):
     if idx >= dicom_dose['frameCount']:
         return res
     shape = dicom_dose['shape']
-    with open (_dose_filename(data['models']['simulation']), 'rb') as f:
-        f.seek(idx * _FLOAT_SIZE * shape[0] * shape[1], 1)
-        for r in range(shape[0]):
-            row = []
-            res.append(row)
-            for c in range(shape[1]):
-                row.append(struct.unpack('f', f.read(_FLOAT_SIZE))[0])
-    return res
-
-
-def _read_pixel_plane(plane, idx, data):
-    plane_info = data['models']['dicomSeries']['planes']
-    size = [plane_info['c']['frameCount'], plane_info['s']['frameCount'], plane_info['t']['frameCount']]
-    frame = []
-    # pixels = np.array(all_frame_pixels)[:, idx]
-    # pixels = np.array(all_frame_pixels)[:, :, idx]
-    with open (_pixel_filename(data['models']['simulation']), 'rb') as f:
-        if plane == 't':
-            if idx > 0:
-                f.seek(idx * _FLOAT_SIZE * size[0] * size[1], 1)
-            for r in range(size[1]):
-                row = []
-                frame.append(row)
-                for v in range(size[0]):
-                    row.append(struct.unpack('f', f.read(_FLOAT_SIZE))[0])
-        elif plane == 'c':
-            if idx > 0:
-                f.seek(idx * _FLOAT_SIZE * size[0], 1)
-            for r in range(size[2]):
-                row = []
-                frame.append(row)
-                for v in range(size[0]):
-                    row.append(struct.unpack('f', f.read(_FLOAT_SIZE))[0])
-                f.seek(_FLOAT_SIZE * (size[0] - 1) * size[1], 1)
-            frame = np.flipud(frame).tolist()
-        elif plane == 's':
-            if idx > 0:
-                f.seek(idx * _FLOAT_SIZE, 1)
-            for r in range(size[2]):
-                row = []
-                frame.append(row)
-                for v in range(size[1]):
-                    row.append(struct.unpack('f', f.read(_FLOAT_SIZE))[0])
-                    f.seek(_FLOAT_SIZE * (size[0] - 1), 1)
-            frame = np.flipud(frame).tolist()
-        else:
-            raise RuntimeError('plane not supported: {}'.format(plane))
-    return frame
+    dose = np.memmap(
+        _dose_filename(data['models']['simulation']),
+        dtype=np.float32,
+        mode='r',
+        shape=(dicom_dose['frameCount'], shape[0], shape[1]),
+    )
+    return dose[idx].tolist()
+
+
+def _read_pixel_plane(plane, idx, data, max_size=None):
+    """Read a single plane from the pixel volume
+
+    Args:
+        plane (str): t (transverse), c (coronal), or s (sagittal)
+        idx (int): plane index
+        data (dict): simulation
+        max_size (int): downsample so neither dimension exceeds max_size [None]
+    Returns:
+        ndarray: frame, bottom up for c and s
+    """
+    volume = _pixel_volume(data)
+    if plane == 't':
+        frame = volume[idx]
+    elif plane == 'c':
+        frame = volume[::-1, idx, :]
+    elif plane == 's':
+        frame = volume[::-1, :, idx]
+    else:
+        raise RuntimeError('plane not supported: {}'.format(plane))
+    if max_size:
+        step = int(np.ceil(max(frame.shape) / float(max_size)))
+        if step > 1:
+            frame = frame[::step, ::step]
+    return np.array(frame)
 
 
 def _read_roi_file(sim_id):
@@ -690,17 +735,14 @@ def _summarize_dicom_files(data, dicom_dir):
     info = _extract_series_frames(simulation, dicom_dir)
     frames = info['frames']
     info['pixelSpacing'] = _summarize_dicom_series(simulation, frames)
-    with open (_pixel_filename(simulation), 'wb') as f:
-        for frame in frames:
-            frame['pixels'].tofile(f)
     data['models']['dicomSeries'] = {
         'description': info['description'],
         'pixelSpacing': info['pixelSpacing'],
         'studyInstanceUID': info['StudyInstanceUID'],
         'planes': {
             't': _frame_info(len(frames)),
-            's': _frame_info(len(frames[0]['pixels'])),
-            'c': _frame_info(len(frames[0]['pixels'][0])),
+            's': _frame_info(frames[0]['shape'][0]),
+            'c': _frame_info(frames[0]['shape'][1]),
         }
     }
     time_stamp = int(time.time())
@@ -720,7 +762,7 @@ def _summarize_dicom_files(data, dicom_dir):
             data['models']['dvhReport']['roiNumbers'] = [selectedPTV]
     if 'dicom_dose' in info:
         data['models']['dicomDose'] = info['dicom_dose']
-    _compute_histogram(simulation, frames)
+    _compute_histogram(simulation, frames, info['pixels'])
 
 
 def _summarize_dicom_series(simulation, frames):
@@ -742,7 +784,7 @@ def _summarize_dicom_series(simulation, frames):
     frame0 = frames[0]
     shape = [
         len(frames),
-        len(frame0['pixels'][0]),
+        frame0['shape'][1],
     ]
     res = {
         'shape': shape,
@@ -756,7 +798,7 @@ def _summarize_dicom_series(simulation, frames):
             z_space,
         ],
     }
-    for idx in range(len(frame0['pixels'][0])):
+    for idx in range(frame0['shape'][1]):
         res['ImagePositionPatient'][2] = str(float(frame0['ImagePositionPatient'][1]) + idx * float(frame0['PixelSpacing'][0]))
         res['domain'] = _calculate_domain(res)
         filename = _dicom_path(simulation, 'c', idx)
@@ -764,7 +806,7 @@ def _summarize_dicom_series(simulation, frames):
 
     shape = [
         len(frames),
-        len(frame0['pixels'][1]),
+        frame0['shape'][1],
     ]
     res = {
         'shape': shape,
@@ -778,7 +820,7 @@ def _summarize_dicom_series(simulation, frames):
             z_space,
         ],
     }
-    for idx in range(len(frame0['pixels'][0])):
+    for idx in range(frame0['shape'][1]):
         res['ImagePositionPatient'][2] = str(float(frame0['ImagePositionPatient'][0]) + idx * float(frame0['PixelSpacing'][1]))
         res['domain'] = _calculate_domain(res)
         filename = _dicom_path(simulation, 's', idx)
@@ -6,12 +6,16 @@ u"""SDDS utilities.
 """
 from __future__ import absolute_import, division, print_function
 from pykern import pkio
+from pykern import pkjson
 from pykern import pksubprocess
 from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
 from sirepo.template import elegant_common
 import math
+import numpy as np
+import os
 import re
 import sdds
+import struct
 
 # elegant mux and muy are computed in sddsprocess below
 _ELEGANT_TO_MADX_COLUMNS = [
@@ -35,11 +39,144 @@ MADX_TWISS_COLUMS = map(lambda row: row[1], _ELEGANT_TO_MADX_COLUMNS)
 
 _SDDS_INDEX = 0
 
+#: Written next to the sdds file, see page_index()
+PAGE_INDEX_SUFFIX = '.page-index.json'
+
+#: Written next to sdds files which can't be indexed, see file_summary()
+SUMMARY_SUFFIX = '.summary.json'
+
+_SIDECAR_VERSION = 2
+
+#: Fixed size binary types which can be read directly by numpy
+_BINARY_TYPES = {
+    'double': 'f8',
+    'float': 'f4',
+    'long': 'i4',
+    'ulong': 'u4',
+    'long64': 'i8',
+    'ulong64': 'u8',
+    'short': 'i2',
+    'ushort': 'u2',
+    'character': 'S1',
+}
+
+_HEADER_ENTRY = re.compile(r'&(\w+)(.*?)&end', re.DOTALL)
+
+_HEADER_FIELD = re.compile(r'(\w+)\s*=\s*("(?:[^"\\]|\\.)*"|[^,\s]*)')
+
+#: In memory copies of page indexes, useful in long-lived extract workers
+_page_index_cache = {}
+
 
 def extract_sdds_column(filename, field, page_index):
+    res = _indexed_column(filename, field, page_index)
+    if res:
+        return res
     return process_sdds_page(filename, page_index, _sdds_column, field)
 
 
+def file_summary(filename):
+    """Column and parameter definitions, parameter values, row counts, and
+    column ranges across all pages
+
+    Per-page ranges are kept in the page index so only pages appended
+    since the last call are read. Files which can't be indexed are read
+    once with sddsdata and the result is cached in `SUMMARY_SUFFIX`. Both
+    are keyed on the file's mtime and size.
+
+    Args:
+        filename (str): sdds file
+    Returns:
+        dict: columns, columnDefinitions, parameters, parameterDefinitions,
+            rowCounts, fieldRange or None if the file can't be read
+    """
+    filename = str(filename)
+    index = page_index(filename)
+    if index:
+        return _indexed_summary(filename, index)
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    p = filename + SUMMARY_SUFFIX
+    res = _read_sidecar(p)
+    if _sidecar_is_current(res, st):
+        return res['summary']
+    res = _sdds_summary(filename)
+    if res:
+        _write_sidecar(
+            p,
+            dict(version=_SIDECAR_VERSION, mtime=st.st_mtime, size=st.st_size, summary=res),
+        )
+    return res
+
+
+def page_index(filename):
+    """Page offsets, row counts, and parameter values of a binary sdds file
+
+    The index is persisted next to the file (`PAGE_INDEX_SUFFIX`) and is
+    valid as long as the file's mtime and size don't change. If the file
+    has grown (the simulation is still writing), only the pages after the
+    last indexed page are scanned.
+
+    Args:
+        filename (str): sdds file
+    Returns:
+        dict: index or None if the file can't be read randomly (ascii,
+            arrays, string columns, etc.)
+    """
+    filename = str(filename)
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    res = _page_index_cache.get(filename)
+    if not _sidecar_is_current(res, st):
+        res = _read_sidecar(filename + PAGE_INDEX_SUFFIX)
+        if not _sidecar_is_current(res, st):
+            res = _update_page_index(filename, st, res)
+        _page_index_cache[filename] = res
+    return res if res and res['pages'] is not None else None
+
+
+def read_page_columns(filename, page_index_value, fields):
+    """Read columns of one page directly without reading the pages before it
+
+    Args:
+        filename (str): sdds file
+        page_index_value (int): page to read
+        fields (list): column names
+    Returns:
+        dict: column name to ndarray or None if the file isn't indexable
+    """
+    index = page_index(filename)
+    if not index or page_index_value >= len(index['pages']):
+        return None
+    page = index['pages'][page_index_value]
+    names = [c[0] for c in index['columns']]
+    dtype = _column_dtype(index)
+    res = {}
+    if index['columnMajor']:
+        offset = page['offset']
+        for n in names:
+            t = dtype.fields[n][0]
+            if n in fields:
+                res[n] = _read_array(filename, t, offset, page['rows'])
+            offset += t.itemsize * page['rows']
+        return res
+    rows = _read_array(filename, dtype, page['offset'], page['rows'])
+    for n in fields:
+        res[n] = np.array(rows[n])
+    return res
+
+
+def safe_sdds_values(values):
+    """Same as _safe_sdds_value for ndarrays, returns a list"""
+    if values.dtype.kind == 'f':
+        values = np.where(np.isfinite(values), values, 0)
+    return values.tolist()
+
+
 def process_sdds_page(filename, page_index, callback, *args, **kwargs):
     try:
         if sdds.sddsdata.InitializeInput(_SDDS_INDEX, filename) != 1:
@@ -94,6 +231,209 @@ def _safe_sdds_value(v):
     return v
 
 
+def _column_dtype(index):
+    return np.dtype([
+        (c[0], index['endian'] + _BINARY_TYPES[c[1]]) for c in index['columns']
+    ])
+
+
+def _column_range(values):
+    if not len(values):
+        return None
+    if values.dtype.kind in 'fiu':
+        if values.dtype.kind == 'f':
+            values = np.where(np.isfinite(values), values, 0)
+        return [values.min().item(), values.max().item()]
+    values = values.tolist()
+    return [min(values), max(values)]
+
+
+def _fixed_value(value, sdds_type):
+    """Parsed fixed_value or None if sddsdata must interpret it"""
+    try:
+        if sdds_type in ('double', 'float'):
+            return float(value)
+        if sdds_type in _BINARY_TYPES and sdds_type != 'character':
+            try:
+                return int(value)
+            except ValueError:
+                # e.g. "1.0" or "1e3"
+                return int(float(value))
+    except (ValueError, OverflowError):
+        return None
+    return value
+
+
+def _indexed_column(filename, field, page_index_value):
+    index = page_index(filename)
+    if not index or field not in index['columnDefinitions']:
+        return None
+    cols = read_page_columns(filename, page_index_value, [field])
+    if cols is None:
+        return None
+    return {
+        'values': safe_sdds_values(cols[field]),
+        'column_names': [c[0] for c in index['columns']],
+        'column_def': index['columnDefinitions'][field],
+        'err': None,
+    }
+
+
+def _indexed_summary(filename, index):
+    names = [c[0] for c in index['columns']]
+    changed = False
+    for i, page in enumerate(index['pages']):
+        if 'ranges' in page:
+            continue
+        cols = read_page_columns(filename, i, names)
+        page['ranges'] = dict((n, _column_range(cols[n])) for n in names)
+        changed = True
+    if changed:
+        _write_sidecar(filename + PAGE_INDEX_SUFFIX, index)
+    parameters = dict((p, []) for p in index['parameterNames'])
+    field_range = dict((n, []) for n in names)
+    fixed = dict((p[0], p[2]) for p in index['fixedParameters'])
+    for page in index['pages']:
+        for p in index['parameterNames']:
+            parameters[p].append(fixed[p] if p in fixed else page['parameters'][p])
+        for n in names:
+            _merge_range(field_range[n], page['ranges'][n])
+    return {
+        'columns': names,
+        'columnDefinitions': index['columnDefinitions'],
+        'parameters': parameters,
+        'parameterDefinitions': index['parameterDefinitions'],
+        'rowCounts': [p['rows'] for p in index['pages']],
+        'fieldRange': field_range,
+    }
+
+
+def _merge_range(res, page_range):
+    """Update res [min, max] in place with the range of a page"""
+    if not page_range:
+        return
+    if res:
+        res[0] = min(res[0], page_range[0])
+        res[1] = max(res[1], page_range[1])
+    else:
+        res.extend(page_range)
+
+
+def _parse_header(f):
+    """Parse the ascii header of a binary sdds file
+
+    Returns:
+        dict: columns, parameters, endian, etc. or None if unsupported
+    """
+    line = f.readline()
+    if not re.search(br'^SDDS\d', line):
+        return None
+    res = {
+        'endian': '<',
+        'columns': [],
+        'parameters': [],
+        'fixedParameters': [],
+        'columnMajor': False,
+    }
+    text = b''
+    while True:
+        line = f.readline()
+        if not line:
+            return None
+        if line.startswith(b'!#'):
+            if b'big-endian' in line:
+                res['endian'] = '>'
+            continue
+        text += line
+        if re.search(br'&data\b.*?&end', text, re.DOTALL):
+            break
+    for kind, fields in _HEADER_ENTRY.findall(text.decode('latin-1')):
+        v = dict(
+            (k, x.strip('"')) for k, x in _HEADER_FIELD.findall(fields)
+        )
+        if kind == 'column':
+            if v.get('type') not in _BINARY_TYPES:
+                return None
+            res['columns'].append([v['name'], v['type']])
+        elif kind == 'parameter':
+            if v.get('type') not in _BINARY_TYPES and v.get('type') != 'string':
+                return None
+            if 'fixed_value' in v:
+                x = _fixed_value(v['fixed_value'], v['type'])
+                if x is None:
+                    return None
+                res['fixedParameters'].append([v['name'], v['type'], x])
+            else:
+                res['parameters'].append([v['name'], v['type']])
+        elif kind in ('array', 'include'):
+            return None
+        elif kind == 'data':
+            if v.get('mode') != 'binary' or v.get('no_row_counts', '0') != '0':
+                return None
+            res['columnMajor'] = v.get('column_major_order', '0') != '0'
+    res['dataOffset'] = f.tell()
+    return res
+
+
+def _read_array(filename, dtype, offset, count):
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        return np.fromfile(f, dtype=dtype, count=count)
+
+
+def _read_sidecar(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        res = pkjson.load_any(pkio.py_path(path))
+        if res.get('version') == _SIDECAR_VERSION:
+            return res
+    except Exception:
+        pass
+    return None
+
+
+def _scan_pages(f, index, offset, size):
+    """Append complete pages starting at offset"""
+    dtype = _column_dtype(index)
+    e = index['endian']
+    while offset + 4 <= size:
+        f.seek(offset)
+        rows = struct.unpack(e + 'i', f.read(4))[0]
+        if rows == -2 ** 31:
+            # SDDS5 large row counts
+            b = f.read(8)
+            if len(b) < 8:
+                return
+            rows = struct.unpack(e + 'q', b)[0]
+        params = {}
+        for n, t in index['parameters']:
+            if t == 'string':
+                b = f.read(4)
+                if len(b) < 4:
+                    return
+                b = f.read(struct.unpack(e + 'i', b)[0])
+                params[n] = b.decode('latin-1')
+                continue
+            pt = np.dtype(e + _BINARY_TYPES[t])
+            b = f.read(pt.itemsize)
+            if len(b) < pt.itemsize:
+                return
+            params[n] = np.frombuffer(b, dtype=pt)[0].item()
+        start = f.tell()
+        end = start + rows * dtype.itemsize
+        if rows < 0 or end > size:
+            # page is still being written
+            return
+        index['pages'].append(dict(
+            offset=start,
+            rows=rows,
+            parameters=params,
+            end=end,
+        ))
+        offset = end
+
+
 def _sdds_column(field):
     column_names = sdds.sddsdata.GetColumnNames(_SDDS_INDEX)
     column_def = sdds.sddsdata.GetColumnDefinition(_SDDS_INDEX, field)
@@ -109,8 +449,120 @@ def _sdds_column(field):
     }
 
 
+def _sdds_column_definitions(column_names):
+    return dict(
+        (c, list(sdds.sddsdata.GetColumnDefinition(_SDDS_INDEX, c))) for c in column_names
+    )
+
+
+def _sdds_definitions(filename, header):
+    """Add column definitions, as returned by sddsdata, to the header"""
+    try:
+        if sdds.sddsdata.InitializeInput(_SDDS_INDEX, filename) != 1:
+            return None
+        column_names = sdds.sddsdata.GetColumnNames(_SDDS_INDEX)
+        if column_names != [c[0] for c in header['columns']]:
+            return None
+        parameter_names = sdds.sddsdata.GetParameterNames(_SDDS_INDEX)
+        if sorted(parameter_names) != sorted(
+            [p[0] for p in header['parameters'] + header['fixedParameters']],
+        ):
+            return None
+        header['columnDefinitions'] = _sdds_column_definitions(column_names)
+        header['parameterNames'] = parameter_names
+        header['parameterDefinitions'] = _sdds_parameter_definitions(parameter_names)
+        return header
+    finally:
+        try:
+            sdds.sddsdata.Terminate(_SDDS_INDEX)
+        except Exception:
+            pass
+
+
 def _sdds_error(error_text='invalid data file'):
     sdds.sddsdata.Terminate(_SDDS_INDEX)
     return {
         'error': error_text,
     }
+
+
+def _sdds_parameter_definitions(parameter_names):
+    return dict(
+        (p, list(sdds.sddsdata.GetParameterDefinition(_SDDS_INDEX, p))) for p in parameter_names
+    )
+
+
+def _sdds_summary(filename):
+    """Same as _indexed_summary for files which must be read with sddsdata"""
+    try:
+        if sdds.sddsdata.InitializeInput(_SDDS_INDEX, filename) != 1:
+            return None
+        column_names = sdds.sddsdata.GetColumnNames(_SDDS_INDEX)
+        parameter_names = sdds.sddsdata.GetParameterNames(_SDDS_INDEX)
+        res = {
+            'columns': column_names,
+            'columnDefinitions': _sdds_column_definitions(column_names),
+            'parameters': dict((p, []) for p in parameter_names),
+            'parameterDefinitions': _sdds_parameter_definitions(parameter_names),
+            'rowCounts': [],
+            'fieldRange': dict((c, []) for c in column_names),
+        }
+        while sdds.sddsdata.ReadPage(_SDDS_INDEX) > 0:
+            res['rowCounts'].append(sdds.sddsdata.RowCount(_SDDS_INDEX))
+            for i, p in enumerate(parameter_names):
+                res['parameters'][p].append(sdds.sddsdata.GetParameter(_SDDS_INDEX, i))
+            for i, c in enumerate(column_names):
+                _merge_range(
+                    res['fieldRange'][c],
+                    _column_range(np.array(sdds.sddsdata.GetColumn(_SDDS_INDEX, i))),
+                )
+        return res
+    finally:
+        try:
+            sdds.sddsdata.Terminate(_SDDS_INDEX)
+        except Exception:
+            pass
+
+
+def _sidecar_is_current(value, st):
+    return value is not None and value['mtime'] == st.st_mtime \
+        and value['size'] == st.st_size
+
+
+def _update_page_index(filename, st, prev):
+    res = None
+    with open(filename, 'rb') as f:
+        h = _parse_header(f)
+        if h:
+            res = _sdds_definitions(filename, h)
+    if res is None:
+        # not indexable, remember that so the header isn't parsed each time
+        res = dict(pages=None)
+    else:
+        res['pages'] = []
+        if prev and prev.get('pages') and prev['size'] < st.st_size \
+            and prev['columns'] == res['columns'] \
+            and prev['parameters'] == res['parameters']:
+            # the last page may have been incomplete or rewritten
+            res['pages'] = prev['pages'][:-1]
+        offset = res['pages'][-1]['end'] if res['pages'] else res['dataOffset']
+        with open(filename, 'rb') as f:
+            _scan_pages(f, res, offset, st.st_size)
+    res.update(
+        version=_SIDECAR_VERSION,
+        mtime=st.st_mtime,
+        size=st.st_size,
+    )
+    _write_sidecar(filename + PAGE_INDEX_SUFFIX, res)
+    return res
+
+
+def _write_sidecar(path, value):
+    p = pkio.py_path(path)
+    t = p + '.tmp'
+    try:
+        pkjson.dump_pretty(value, filename=t)
+        t.rename(p)
+    except Exception as e:
+        # value is still usable in memory
+        pkdlog('{}: unable to write: {}', p, e)
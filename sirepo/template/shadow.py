@@ -8,9 +8,13 @@ u"""shadow execution template.
 from __future__ import absolute_import, division, print_function
 from pykern import pkcollections
 from pykern import pkio
+from pykern import pkjson
 from pykern.pkdebug import pkdc, pkdp
 from sirepo import simulation_db
 from sirepo.template import template_common
+import hashlib
+import json
+import numpy as np
 import os.path
 import py.path
 import xraylib
@@ -25,6 +29,82 @@ _SHADOW_OUTPUT_FILE = 'shadow-output.dat'
 
 _REPORT_STYLE_FIELDS = ['colorMap', 'notes', 'aspectRatio']
 
+#: Report fields which only change the histogram of the final beam
+_PLOT_FIELDS = [
+    'column',
+    'histogramBins',
+    'horizontalOffset',
+    'horizontalSize',
+    'overrideSize',
+    'verticalOffset',
+    'verticalSize',
+    'weight',
+    'x',
+    'y',
+]
+
+#: Prefix of the empty file named for the plot fields of out.json
+_PLOT_MARKER = 'out-plot-'
+
+#: Good rays of the final beam
+_RAY_TABLE_FILE = 'rays.npy'
+
+#: SHADOW's wavenumber [cm^-1] per eV
+_A2EV = 2.0 * np.pi / 12398.419843320026e-8
+
+_CM_TO_M = 0.01
+
+_MM_TO_CM = 0.1
+
+_SCALE_COLUMNS = [1, 2, 3, 13, 20]
+
+_PLOT_LABELS = {
+    '1': ['X [m]'],
+    '2': ['Y [m]'],
+    '3': ['Z [m]'],
+    '4': ["X' [rad]"],
+    '5': ["Y' [rad]"],
+    '6': ["Z' [rad]"],
+    '11': ['Energy [eV]', 'E [eV]'],
+    '13': ['Optical Path [m]', 's'],
+    '14': [u'Phase s [rad]', u'ϕ s [rad]'],
+    '15': [u'Phase p [rad]', u'ϕ p [rad]'],
+    '19': [u'Wavelength [Å]', u'λ [Å]'],
+    '20': [u'R = sqrt(X² + Y² + Z²) [m]', 'R [m]'],
+    '21': [u'Theta (angle from Y axis) [rad]', u'θ [rad]'],
+    '22': ['Magnitude = |Es| + |Ep|', '|Es| + |Ep|'],
+    '23': [u'Total Intensity = |Es|² + |Ep|²', u'|Es|² + |Ep|²'],
+    '24': [u'S Intensity = |Es|²', u'|Es|²'],
+    '25': [u'P Intensity = |Ep|²', u'|Ep|²'],
+    '26': [u'|K| [Å⁻¹]'],
+    '27': [u'K X [Å⁻¹]'],
+    '28': [u'K Y [Å⁻¹]'],
+    '29': [u'K Z [Å⁻¹]'],
+    '30': [u'S0-stokes = |Ep|² + |Es|²', 'S0'],
+    '31': [u'S1-stokes = |Ep|² - |Es|²', 'S1'],
+    '32': ['S2-stokes = 2|Es||Ep|cos(Phase s-Phase p)', 'S2'],
+    '33': ['S3-stokes = 2|Es||Ep|sin(Phase s-Phase p)', 'S3'],
+}
+
+#: Directory in the simulation dir with the beam after each beamline element
+_CHECKPOINT_DIR = 'beam-checkpoints'
+
+#: Oldest checkpoints are removed above this size
+_MAX_CHECKPOINT_BYTES = 1024 ** 3
+
+#: Models which determine the beam generated by the source
+_SOURCE_MODELS = [
+    'bendingMagnet',
+    'electronBeam',
+    'geometricSource',
+    'rayFilter',
+    'simulation.istar1',
+    'simulation.npoint',
+    'simulation.sourceType',
+    'sourceDivergence',
+    'wiggler',
+]
+
 _CENTIMETER_FIELDS = {
     'electronBeam': ['sigmax', 'sigmaz', 'epsi_x', 'epsi_z', 'epsi_dx', 'epsi_dz'],
     'geometricSource': ['wxsou', 'wzsou', 'sigmax', 'sigmaz', 'wysou', 'sigmay'],
@@ -118,27 +198,41 @@ def models_related_to_report(data):
         list: Named models, model fields or values (dict, list) that affect report
     """
     r = data['report']
-    res = template_common.report_fields(data, r, _REPORT_STYLE_FIELDS) + [
-        'bendingMagnet',
-        'electronBeam',
-        'geometricSource',
-        'rayFilter',
-        'simulation.istar1',
-        'simulation.npoint',
-        'simulation.sourceType',
-        'sourceDivergence',
-        'wiggler',
-    ]
+    # plot fields are applied to the saved rays by prepare_output_file
+    res = template_common.report_fields(data, r, _REPORT_STYLE_FIELDS + _PLOT_FIELDS) + _SOURCE_MODELS
     if r == 'initialIntensityReport' and len(data['models']['beamline']):
         res.append([data['models']['beamline'][0]['position']])
-    #TODO(pjm): only include items up to the current watchpoint
     if template_common.is_watchpoint(r):
-        res.append('beamline')
+        # elements after the watchpoint aren't traced
+        w = template_common.watchpoint_id(r)
+        b = []
+        for item in data['models']['beamline']:
+            b.append(item)
+            if int(item['id']) == w:
+                break
+        res.append(b)
     for f in template_common.lib_files(data):
         res.append(f.mtime())
     return res
 
 
+def prepare_output_file(run_dir, data):
+    """Histogram the saved rays if the report's plot fields changed"""
+    m = data['models'][data['report']]
+    marker = run_dir.join(_PLOT_MARKER + hashlib.md5(pkjson.dump_bytes(
+        [m.get(f) for f in _PLOT_FIELDS],
+    )).hexdigest())
+    rays = run_dir.join(_RAY_TABLE_FILE)
+    if marker.exists() or not rays.exists():
+        return
+    res = _extract_report_data(np.load(str(rays)), m)
+    pkio.unchecked_remove(simulation_db.json_filename(template_common.OUTPUT_BASE_NAME, run_dir))
+    simulation_db.write_result(res, run_dir=run_dir)
+    for f in run_dir.listdir(_PLOT_MARKER + '*'):
+        f.remove()
+    marker.write('')
+
+
 def python_source_for_model(data, model):
     beamline = data['models']['beamline']
     watch_id = None
@@ -165,6 +259,16 @@ def resource_files():
     return pkio.sorted_glob(_RESOURCE_DIR.join('*.txt'))
 
 
+def save_ray_table(run_dir, rays):
+    """Save the good rays of the final beam for `prepare_output_file`
+
+    Args:
+        run_dir (py.path): report's run dir
+        rays (ndarray): Shadow.Beam.rays
+    """
+    np.save(str(run_dir.join(_RAY_TABLE_FILE)), rays[rays[:, 9] > 0])
+
+
 def validate_delete_file(data, filename, file_type):
     """Returns True if the filename is in use by the simulation data."""
     return filename in _simulation_files(data)
@@ -192,6 +296,17 @@ def write_parameters(data, run_dir, is_parallel):
     )
 
 
+def _checkpoint_step(code, step, key):
+    return '''
+
+if checkpoint_step <= {}:{}
+    save_checkpoint('{}')'''.format(
+        step,
+        code.replace('\n', '\n    '),
+        key,
+    )
+
+
 def _convert_meters_to_centimeters(models):
     for m in models:
         if isinstance(m, dict):
@@ -215,6 +330,68 @@ def _eq(item, field, *values):
             item[field], item['type'], field, t))
 
 
+def _extract_report_data(rays, model):
+    """Same as Shadow.Beam histo1 and histo2 with nolost=1"""
+    column_values = _SCHEMA['enum']['ColumnValue']
+    nbins = template_common.histogram_bins(model['histogramBins'])
+    weight = int(model['weight'])
+    w = _ray_column(rays, weight) if weight else None
+    if 'y' in model:
+        x = int(model['x'])
+        y = int(model['y'])
+        if model['overrideSize'] == '1':
+            x_range = (np.array([
+                model['horizontalOffset'] - model['horizontalSize'] / 2,
+                model['horizontalOffset'] + model['horizontalSize'] / 2,
+            ]) * _MM_TO_CM).tolist()
+            y_range = (np.array([
+                model['verticalOffset'] - model['verticalSize'] / 2,
+                model['verticalOffset'] + model['verticalSize'] / 2,
+            ]) * _MM_TO_CM).tolist()
+        else:
+            x_range = _good_range(rays, x)
+            y_range = _good_range(rays, y)
+        hist, _, _ = np.histogram2d(
+            _ray_column(rays, x),
+            _ray_column(rays, y),
+            bins=[nbins, nbins],
+            range=[x_range, y_range],
+            weights=w,
+        )
+        return {
+            'x_range': _scale_range(x, x_range) + [nbins],
+            'y_range': _scale_range(y, y_range) + [nbins],
+            'x_label': _label_with_units(model['x'], column_values),
+            'y_label': _label_with_units(model['y'], column_values),
+            'z_label': 'Frequency',
+            'title': u'{}, {}'.format(_label(model['x'], column_values), _label(model['y'], column_values)),
+            'z_matrix': hist.T.tolist(),
+            'frameCount': 1,
+        }
+    c = int(model['column'])
+    v = _ray_column(rays, c)
+    # histo1 without xrange uses the column's extent, not get_good_range
+    x_range = [float(np.min(v)), float(np.max(v))] if len(v) else [-1.0, 1.0]
+    hist, _ = np.histogram(v, bins=nbins, range=x_range, weights=w)
+    res = {
+        'title': _label(model['column'], column_values),
+        'x_range': _scale_range(c, x_range) + [nbins],
+        'y_label': u'{}{}'.format(
+            'Number of Rays',
+            u' weighted by {}'.format(_label_for_weight(model['weight'], column_values)) if weight else ''),
+        'x_label': _label_with_units(model['column'], column_values),
+        'points': hist.tolist(),
+        'frameCount': 1,
+    }
+    dist = res['x_range'][1] - res['x_range'][0]
+    #TODO(pjm): only rebalance range if outside of 0
+    if dist < 1e-14:
+        #TODO(pjm): include offset range for client
+        res['x_range'][0] = 0
+        res['x_range'][1] = dist
+    return res
+
+
 def _field_value(name, field, value):
     return "\n{}.{} = {}".format(name, field.upper(), value)
 
@@ -240,7 +417,13 @@ def _generate_autotune_element(item):
     return res
 
 
-def _generate_beamline_optics(models, last_id):
+def _generate_beamline_optics(models, last_id, checkpoints=None):
+    """Generate the code which traces each element
+
+    If checkpoints is a list, each element's code is skipped when a later
+    checkpoint exists, and the element's key is appended to checkpoints.
+    The key of an element is the hash of the previous key and its code.
+    """
     beamline = models['beamline']
     res = ''
     prev_position = 0
@@ -250,6 +433,7 @@ def _generate_beamline_optics(models, last_id):
         item = beamline[i]
         if _is_disabled(item):
             continue
+        start = len(res)
         count += 1
         source_distance = item.position - prev_position
         image_distance = 0
@@ -297,6 +481,12 @@ oe.THETA = calc_oe.T_INCIDENCE * 180.0 / math.pi
                    + _field_value('oe', 't_image', 0.0) \
                    + _field_value('oe', 't_source', source_distance) \
                    + "\n" + 'beam.traceOE(oe, {})'.format(count)
+        if checkpoints is not None:
+            code = res[start:]
+            checkpoints.append(
+                hashlib.md5((checkpoints[-1] + code).encode('utf-8')).hexdigest(),
+            )
+            res = res[:start] + _checkpoint_step(code, len(checkpoints) - 1, checkpoints[-1])
         if last_element:
             break
         prev_position = item.position
@@ -566,7 +756,16 @@ def _generate_parameters_file(data, run_dir=None, is_parallel=False):
     if r == 'initialIntensityReport':
         v['distanceFromSource'] = beamline[0]['position'] if len(beamline) else template_common.DEFAULT_INTENSITY_DISTANCE
     elif template_common.is_watchpoint(r):
-        v['beamlineOptics'] = _generate_beamline_optics(data['models'], template_common.watchpoint_id(r))
+        c = None
+        if run_dir:
+            c = [_source_checkpoint_key(data, run_dir)]
+            d = simulation_db.simulation_dir(SIM_TYPE, simulation_db.parse_sid(data)).join(_CHECKPOINT_DIR)
+            pkio.mkdir_parent(d)
+            template_common.prune_files(d, '*.dat', _MAX_CHECKPOINT_BYTES)
+            v['checkpointDir'] = str(d)
+        v['beamlineOptics'] = _generate_beamline_optics(data['models'], template_common.watchpoint_id(r), c)
+        if c:
+            v['checkpointKeys'] = c
     else:
         v['distanceFromSource'] = report_model['distanceFromSource']
 
@@ -606,6 +805,27 @@ def _generate_wiggler(data):
           + _field_value('source', 'file_traj', "b'{}'".format(_WIGGLER_TRAJECTOR_FILENAME))
 
 
+def _good_range(rays, column):
+    # same as Shadow.Beam.get_good_range
+    if not len(rays):
+        return [-1.0, 1.0]
+    c = _ray_column(rays, column)
+    rmin0 = float(np.min(c))
+    rmax0 = float(np.max(c))
+    rmin = rmin0 * (0.95 if rmin0 > 0 else 1.05)
+    rmax = rmax0 * (0.95 if rmax0 < 0 else 1.05)
+    if rmin0 == rmax0 and rmin0 != 0:
+        rmin = rmin0 * 0.95
+        rmax = rmax0 * 1.05
+    if rmin0 == 0:
+        rmin = -1.0
+        rmax = 1.0
+    if (rmax - rmin) / 1.25 > rmax0 - rmin0 and rmin0 != rmax0:
+        rmin = 0.5 * (rmax0 + rmin0) - 0.55 * (rmax0 - rmin0)
+        rmax = 0.5 * (rmax0 + rmin0) + 0.55 * (rmax0 - rmin0)
+    return [rmin, rmax]
+
+
 def _item_field(item, fields):
     return _fields('oe', item, fields)
 
@@ -614,6 +834,68 @@ def _is_disabled(item):
     return 'isDisabled' in item and item['isDisabled']
 
 
+def _label(column, values):
+    for v in values:
+        if column == v[0]:
+            return v[1]
+    raise RuntimeError('unknown column value: ', column)
+
+
+def _label_for_weight(column, values):
+    if column in _PLOT_LABELS:
+        if len(_PLOT_LABELS[column]) > 1:
+            return _PLOT_LABELS[column][1]
+        return _PLOT_LABELS[column][0]
+    return _label(column, values)
+
+
+def _label_with_units(column, values):
+    if column in _PLOT_LABELS:
+        return _PLOT_LABELS[column][0]
+    return _label(column, values)
+
+
+def _ray_column(rays, column):
+    """Same as Shadow.Beam.getshcol"""
+    if column <= 18 and column != 11:
+        return rays[:, column - 1]
+    k = rays[:, 10]
+    if column == 11:
+        return k / _A2EV
+    if column == 19:
+        return 2.0 * np.pi * 1.0e8 / k
+    if column == 20:
+        return np.sqrt(np.sum(rays[:, 0:3] ** 2, axis=1))
+    if column == 21:
+        return np.arccos(np.clip(rays[:, 4], -1.0, 1.0))
+    if 26 <= column <= 29:
+        return (k if column == 26 else rays[:, column - 24] * k) * 1.0e8
+    es2 = np.sum(rays[:, 6:9] ** 2, axis=1)
+    ep2 = np.sum(rays[:, 15:18] ** 2, axis=1)
+    if column == 22:
+        return np.sqrt(es2 + ep2)
+    if column in (23, 30):
+        return es2 + ep2
+    if column == 24:
+        return es2
+    if column == 25:
+        return ep2
+    if column == 31:
+        return es2 - ep2
+    phase = rays[:, 13] - rays[:, 14]
+    if column == 32:
+        return 2.0 * np.sqrt(es2 * ep2) * np.cos(phase)
+    if column == 33:
+        return 2.0 * np.sqrt(es2 * ep2) * np.sin(phase)
+    raise RuntimeError('unknown column: {}'.format(column))
+
+
+def _scale_range(column, value):
+    if column in _SCALE_COLUMNS:
+        return [v * _CM_TO_M for v in value]
+    return list(value)
+
+
 def _simulation_files(data):
     res = []
     if data['models']['simulation']['sourceType'] == 'wiggler':
@@ -622,6 +904,17 @@ def _simulation_files(data):
     return res
 
 
+def _source_checkpoint_key(data, run_dir):
+    res = hashlib.md5()
+    for m in _SOURCE_MODELS:
+        name, field = m.split('.') if '.' in m else (m, None)
+        value = data['models'][name][field] if field else data['models'][name]
+        res.update(json.dumps(value, sort_keys=True).encode('utf-8'))
+    for f in _simulation_files(data):
+        res.update(run_dir.join(f).read_binary())
+    return res.hexdigest()
+
+
 def _source_field(model, fields):
     return _fields('source', model, fields)
 
@@ -6,14 +6,19 @@ u"""SRW execution template.
 """
 from __future__ import absolute_import, division, print_function
 from pykern import pkcollections
+from pykern import pkcompat
 from pykern import pkio
+from pykern import pkjson
 from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
 from sirepo import crystal
+from sirepo import feature_config
 from sirepo import simulation_db
 from sirepo.template import template_common
 import bnlcrl.pkcli.simulate
 import copy
 import glob
+import hashlib
+import json
 import math
 import numpy as np
 import os
@@ -40,6 +45,12 @@ _MIRROR_OUTPUT_FILE = 'res_mirror.dat'
 
 _WATCHPOINT_REPORT_NAME = 'watchpointReport'
 
+#: Oldest wavefront checkpoints are removed above this size
+_MAX_WAVEFRONT_CHECKPOINT_BYTES = 2 * 1024 ** 3
+
+#: Directory in the simulation dir with the wavefront after each beamline element
+_WAVEFRONT_CHECKPOINT_DIR = 'wavefront-checkpoints'
+
 _DATA_FILE_FOR_MODEL = pkcollections.Dict({
     'fluxAnimation': {'filename': 'res_spec_me.dat', 'dimension': 2},
     'fluxReport': {'filename': 'res_spec_me.dat', 'dimension': 2},
@@ -54,6 +65,20 @@ _DATA_FILE_FOR_MODEL = pkcollections.Dict({
     _WATCHPOINT_REPORT_NAME: {'filename': 'res_int_pr_se.dat', 'dimension': 3},
 })
 
+#: Fields which determine the wavefront before the beamline
+_INITIAL_WAVEFRONT_FIELDS = [
+    'simulation.horizontalPointCount',
+    'simulation.horizontalPosition',
+    'simulation.horizontalRange',
+    'simulation.photonEnergy',
+    'simulation.sampleFactor',
+    'simulation.samplingMethod',
+    'simulation.verticalPointCount',
+    'simulation.verticalPosition',
+    'simulation.verticalRange',
+    'simulation.distanceFromSource',
+]
+
 _EXAMPLE_FOLDERS = pkcollections.Dict({
     'Bending Magnet Radiation': '/SR Calculator',
     'Diffraction by an Aperture': '/Wavefront Propagation',
@@ -86,8 +111,14 @@ _LOG_DIR = '__srwl_logs__'
 #: Where server files and static files are found
 _RESOURCE_DIR = template_common.resource_dir(SIM_TYPE)
 
+#: Prefix of the empty file named for the style fields of out.json
+_OUTPUT_STYLE_MARKER = 'out-style-'
+
 _PREDEFINED = None
 
+#: Parsed output file next to the output file, see `_load_output_file`
+_RAW_OUTPUT_SUFFIX = '.raw.npz'
+
 _REPORT_STYLE_FIELDS = ['intensityPlotsWidth', 'intensityPlotsScale', 'colorMap', 'plotAxisX', 'plotAxisY', 'plotAxisY2', 'copyCharacteristic', 'notes', 'aspectRatio']
 
 _RUN_ALL_MODEL = 'simulation'
@@ -177,7 +208,7 @@ def background_percent_complete(report, run_dir, is_running):
             'particle_number': 0,
             'total_num_of_particles': 0,
         })
-        status_files = pkio.sorted_glob(run_dir.join(_LOG_DIR, 'srwl_*.json'))
+        status_files = template_common.progress_files(run_dir, _LOG_DIR, 'srwl_*.json')
         if status_files:  # Read the status file if SRW produces the multi-e logs
             progress_file = py.path.local(status_files[-1])
             if progress_file.exists():
@@ -228,7 +259,7 @@ def extensions_for_file_type(file_type):
 
 
 def extract_report_data(filename, model_data):
-    data, _, allrange, _, _ = uti_plot_com.file_load(filename, multicolumn_data=model_data['report'] in ('brillianceReport', 'trajectoryReport'))
+    data, allrange = _load_output_file(filename, model_data['report'] in ('brillianceReport', 'trajectoryReport'))
     if model_data['report'] == 'brillianceReport':
         return _extract_brilliance_report(model_data['models']['brillianceReport'], data)
     if model_data['report'] == 'trajectoryReport':
@@ -308,6 +339,8 @@ def extract_report_data(filename, model_data):
         width_pixels = int(model_data['models'][orig_rep_name]['intensityPlotsWidth'])
         scale = model_data['models'][orig_rep_name]['intensityPlotsScale']
         info = _remap_3d(info, allrange, file_info[filename][0][3], file_info[filename][1][2], width_pixels, scale)
+    else:
+        info.points = info.points.tolist()
     return info
 
 
@@ -581,28 +614,10 @@ def models_related_to_report(data):
             'mirrorReport.grazingAngle',
             'mirrorReport.heightAmplification',
         ]
-    res = template_common.report_fields(data, r, _REPORT_STYLE_FIELDS) + [
-        'electronBeam', 'electronBeamPosition', 'gaussianBeam', 'multipole',
-        'simulation.sourceType', 'tabulatedUndulator', 'undulator',
-        'arbitraryMagField',
-    ]
-    if _uses_tabulated_zipfile(data):
-        res.append(_lib_file_datetime(data['models']['tabulatedUndulator']['magneticFile']))
-
+    res = template_common.report_fields(data, r, _REPORT_STYLE_FIELDS) + _source_related_to_report(data)
     watchpoint = template_common.is_watchpoint(r)
     if watchpoint or r == 'initialIntensityReport':
-        res.extend([
-            'simulation.horizontalPointCount',
-            'simulation.horizontalPosition',
-            'simulation.horizontalRange',
-            'simulation.photonEnergy',
-            'simulation.sampleFactor',
-            'simulation.samplingMethod',
-            'simulation.verticalPointCount',
-            'simulation.verticalPosition',
-            'simulation.verticalRange',
-            'simulation.distanceFromSource',
-        ])
+        res.extend(_INITIAL_WAVEFRONT_FIELDS)
     if r == 'initialIntensityReport':
         beamline = data['models']['beamline']
         res.append([beamline[0]['position'] if len(beamline) else 0])
@@ -611,15 +626,8 @@ def models_related_to_report(data):
         beamline = data['models']['beamline']
         propagation = data['models']['propagation']
         for item in beamline:
-            item_copy = item.copy()
-            del item_copy['title']
-            res.append(item_copy)
-            res.append(propagation[str(item['id'])])
-            if item['type'] == 'mirror':
-                res.append(_lib_file_datetime(item['heightProfileFile']))
-            elif item['type'] == 'sample':
-                res.append(_lib_file_datetime(item['imageFile']))
-            elif item['type'] == 'watch' and item['id'] == wid:
+            res.extend(_beamline_item_related(item, propagation))
+            if item['type'] == 'watch' and item['id'] == wid:
                 break
         if beamline[-1]['id'] == wid:
             res.append('postPropagation')
@@ -697,7 +705,14 @@ def prepare_for_save(data):
 def prepare_output_file(run_dir, data):
     if data['report'] in ('brillianceReport', 'mirrorReport'):
         return
-    #TODO(pjm): only need to rerun extract_report_data() if report style fields have changed
+    # out.json only depends on the report's style fields, the rest of the
+    # report is part of the run dir's hash
+    m = data['models'][data['report']]
+    marker = run_dir.join(_OUTPUT_STYLE_MARKER + hashlib.md5(pkjson.dump_bytes(
+        [m.get(f) for f in _REPORT_STYLE_FIELDS],
+    )).hexdigest())
+    if marker.exists():
+        return
     fn = simulation_db.json_filename(template_common.OUTPUT_BASE_NAME, run_dir)
     if fn.exists():
         fn.remove()
@@ -705,6 +720,9 @@ def prepare_output_file(run_dir, data):
         if output_file.exists():
             res = extract_report_data(str(output_file), data)
             simulation_db.write_result(res, run_dir=run_dir)
+            for f in run_dir.listdir(_OUTPUT_STYLE_MARKER + '*'):
+                f.remove()
+            marker.write('')
 
 
 def python_source_for_model(data, model):
@@ -876,6 +894,17 @@ def _add_report_filenames(v):
         v['{}Filename'.format(k)] = _DATA_FILE_FOR_MODEL[k]['filename']
 
 
+def _beamline_item_related(item, propagation):
+    item_copy = item.copy()
+    del item_copy['title']
+    res = [item_copy, propagation[str(item['id'])]]
+    if item['type'] == 'mirror':
+        res.append(_lib_file_datetime(item['heightProfileFile']))
+    elif item['type'] == 'sample':
+        res.append(_lib_file_datetime(item['imageFile']))
+    return res
+
+
 def _calculate_beam_drift(ebeam_position, source_type, undulator_type, undulator_length, undulator_period):
     if ebeam_position['driftCalculationMethod'] == 'auto':
         """Calculate drift for ideal undulator."""
@@ -886,6 +915,20 @@ def _calculate_beam_drift(ebeam_position, source_type, undulator_type, undulator
     return ebeam_position['drift']
 
 
+def _checkpoint_key(prev, related, models):
+    """Hash of the previous key and the values of related
+
+    related is a list like `models_related_to_report` returns.
+    """
+    res = hashlib.md5(prev.encode('utf-8'))
+    for m in related:
+        if pkcompat.isinstance_str(m):
+            name, field = m.split('.') if '.' in m else (m, None)
+            m = models[name][field] if field else models[name]
+        res.update(json.dumps(m, sort_keys=True).encode('utf-8'))
+    return res.hexdigest()
+
+
 def _compute_material_characteristics(model, photon_energy, prefix=''):
     fields_with_prefix = pkcollections.Dict({
         'material': 'material',
@@ -1276,7 +1319,13 @@ def _fixup_electron_beam(data):
     return data
 
 
-def _generate_beamline_optics(report, models, last_id):
+def _generate_beamline_optics(report, models, last_id, checkpoint_key=None):
+    """Generate set_optics() and the optics parameters
+
+    If checkpoint_key is set, set_optics() also returns the number of
+    elements and the checkpoint key after each beamline item. The key
+    is chained from checkpoint_key (the source) through each item.
+    """
     if not _is_beamline_report(report):
         return '    pass', ''
     has_beamline_elements = len(models.beamline) > 0
@@ -1286,6 +1335,7 @@ def _generate_beamline_optics(report, models, last_id):
     items = []
     prev = None
     propagation = models.propagation
+    source_checkpoint_key = checkpoint_key
     max_name_size = 0
 
     for item in models.beamline:
@@ -1307,6 +1357,14 @@ def _generate_beamline_optics(report, models, last_id):
                     'propagation': prev.drift_propagation,
                     'length': size,
                 }))
+                if checkpoint_key:
+                    checkpoint_key = items[-1].checkpointKey = _checkpoint_key(
+                        checkpoint_key,
+                        [[size, prev.drift_propagation]],
+                        models,
+                    )
+        if checkpoint_key and not is_disabled:
+            related = _beamline_item_related(item, propagation)
         pp = propagation[str(item.id)]
         item.propagation = pp[0]
         item.drift_propagation = pp[1]
@@ -1322,18 +1380,31 @@ def _generate_beamline_optics(report, models, last_id):
                     'length': 0,
                 }))
                 names.append(items[-1].name)
+                if checkpoint_key:
+                    checkpoint_key = items[-1].checkpointKey = _checkpoint_key(
+                        checkpoint_key,
+                        [[0, item.propagation]],
+                        models,
+                    )
             if 'heightProfileFile' in item:
                 item.heightProfileDimension = _height_profile_dimension(item)
             items.append(item)
             names.append(name)
+            if checkpoint_key:
+                checkpoint_key = item.checkpointKey = _checkpoint_key(checkpoint_key, related, models)
         if int(last_id) == int(item.id):
             break
         prev = item
+    want_post_propagation = has_beamline_elements and (int(last_id) == int(models.beamline[-1].id))
+    if checkpoint_key and want_post_propagation and items:
+        # applied with the last item
+        items[-1].checkpointKey = _checkpoint_key(checkpoint_key, ['postPropagation'], models)
     args = {
         'items': items,
         'names': names,
         'postPropagation': models.postPropagation,
-        'wantPostPropagation': has_beamline_elements and (int(last_id) == int(models.beamline[-1].id)),
+        'sourceCheckpointKey': source_checkpoint_key,
+        'wantPostPropagation': want_post_propagation,
         'maxNameSize': max_name_size,
         'nameMap': {
             'apertureShape': 'ap_shape',
@@ -1471,18 +1542,26 @@ def _generate_parameters_file(data, plot_reports=False, run_dir=None):
     if report == 'backgroundImport':
         return template_common.render_jinja(SIM_TYPE, v, 'import.py')
 
-    v['beamlineOptics'], v['beamlineOpticsParameters'] = _generate_beamline_optics(report, data['models'], last_id)
-
-    # und_g and und_ph API units are mm rather than m
-    v['tabulatedUndulator_gap'] *= 1000
-    v['tabulatedUndulator_phase'] *= 1000
-
     if report in data['models'] and 'distanceFromSource' in data['models'][report]:
         position = data['models'][report]['distanceFromSource']
     else:
         position = _get_first_element_position(data)
     v['beamlineFirstElementPosition'] = position
 
+    checkpoint_key = None
+    if run_dir and template_common.is_watchpoint(report) \
+       and feature_config.cfg.srw.wavefront_checkpoints:
+        d = simulation_db.simulation_dir(SIM_TYPE, simulation_db.parse_sid(data)).join(_WAVEFRONT_CHECKPOINT_DIR)
+        pkio.mkdir_parent(d)
+        template_common.prune_files(d, '*.pkl', _MAX_WAVEFRONT_CHECKPOINT_BYTES)
+        v['wavefrontCheckpointDir'] = str(d)
+        checkpoint_key = _wavefront_source_key(data, position)
+    v['beamlineOptics'], v['beamlineOpticsParameters'] = _generate_beamline_optics(report, data['models'], last_id, checkpoint_key)
+
+    # und_g and und_ph API units are mm rather than m
+    v['tabulatedUndulator_gap'] *= 1000
+    v['tabulatedUndulator_phase'] *= 1000
+
     # 1: auto-undulator 2: auto-wiggler
     v['energyCalculationMethod'] = 1 if _is_undulator_source(data['models']['simulation']) else 2
 
@@ -1493,7 +1572,7 @@ def _generate_parameters_file(data, plot_reports=False, run_dir=None):
     v[report] = 1
     _add_report_filenames(v)
     v['setupMagneticMeasurementFiles'] = plot_reports and _uses_tabulated_zipfile(data)
-    v['srwMain'] = _generate_srw_main(data, plot_reports)
+    v['srwMain'] = _generate_srw_main(data, plot_reports, bool(checkpoint_key))
 
     if run_dir and _uses_tabulated_zipfile(data):
         src_zip = str(run_dir.join(v['tabulatedUndulator_magneticFile']))
@@ -1511,7 +1590,7 @@ def _generate_parameters_file(data, plot_reports=False, run_dir=None):
     return template_common.render_jinja(SIM_TYPE, v)
 
 
-def _generate_srw_main(data, plot_reports):
+def _generate_srw_main(data, plot_reports, want_checkpoints=False):
     report = data['report']
     source_type = data['models']['simulation']['sourceType']
     run_all = report == _RUN_ALL_MODEL
@@ -1522,6 +1601,8 @@ def _generate_srw_main(data, plot_reports):
         content.append('setup_magnetic_measurement_files("{}", v)'.format(data['models']['tabulatedUndulator']['magneticFile']))
     if run_all or template_common.is_watchpoint(report) or report == 'multiElectronAnimation':
         content.append('op = set_optics(v)')
+        if want_checkpoints:
+            content.append('setup_wavefront_checkpoints(op)')
     else:
         # set_optics() can be an expensive call for mirrors, only invoke if needed
         content.append('op = None')
@@ -1810,6 +1891,46 @@ def _process_undulator_definition(model):
         return model
 
 
+def _load_output_file(filename, multicolumn):
+    """Parse filename with uti_plot_com once per version of the file
+
+    Single column data is saved in binary form next to the file, so
+    restyling a report doesn't parse the text again.
+
+    Returns:
+        tuple: data (ndarray unless multicolumn) and allrange
+    """
+    if multicolumn:
+        data, _, allrange, _, _ = uti_plot_com.file_load(filename, multicolumn_data=True)
+        return data, allrange
+    st = os.stat(filename)
+    k = [st.st_mtime, st.st_size]
+    raw = filename + _RAW_OUTPUT_SUFFIX
+    if os.path.exists(raw):
+        try:
+            with np.load(raw) as z:
+                if z['key'].tolist() == k:
+                    return z['data'], pkjson.load_any(str(z['allrange']))
+        except Exception:
+            pkdlog('{}: reparsing: {}', raw, pkdexc())
+    data, _, allrange, _, _ = uti_plot_com.file_load(filename)
+    data = np.asarray(data)
+    try:
+        t = raw + '.tmp'
+        with open(t, 'wb') as f:
+            np.savez(
+                f,
+                key=np.array(k),
+                data=data,
+                # json keeps the point counts as ints
+                allrange=np.array(pkjson.dump_pretty(list(allrange))),
+            )
+        os.rename(t, raw)
+    except Exception:
+        pkdlog('{}: unable to save: {}', raw, pkdexc())
+    return data, allrange
+
+
 def _remap_3d(info, allrange, z_label, z_units, width_pixels, scale='linear'):
     x_range = [allrange[3], allrange[4], allrange[5]]
     y_range = [allrange[6], allrange[7], allrange[8]]
@@ -1881,6 +2002,17 @@ def _save_user_model_list(model_name, beam_list):
     simulation_db.write_json(filepath, beam_list)
 
 
+def _source_related_to_report(data):
+    res = [
+        'electronBeam', 'electronBeamPosition', 'gaussianBeam', 'multipole',
+        'simulation.sourceType', 'tabulatedUndulator', 'undulator',
+        'arbitraryMagField',
+    ]
+    if _uses_tabulated_zipfile(data):
+        res.append(_lib_file_datetime(data['models']['tabulatedUndulator']['magneticFile']))
+    return res
+
+
 def _superscript(val):
     return re.sub(r'\^2', u'\u00B2', val)
 
@@ -1986,6 +2118,32 @@ def _validate_safe_zip(zip_file_name, target_dir='.', *args):
         assert res, '{} failed validator: {}'.format(os.path.basename(zip_file_name), err_string)
 
 
+def _wavefront_source_key(data, position):
+    """Key of the wavefront computed for a watchpoint report before the beamline
+
+    Args:
+        data (dict): simulation
+        position (float): distance of the wavefront (op_r)
+    Returns:
+        str: md5 of the source and wavefront fields
+    """
+    r = data['report']
+    return _checkpoint_key(
+        '',
+        _source_related_to_report(data) + [
+            # the distance is position, not simulation.distanceFromSource
+            f for f in _INITIAL_WAVEFRONT_FIELDS if f != 'simulation.distanceFromSource'
+        ] + [
+            {'beamlineFirstElementPosition': position},
+            # the watchpoint report is rendered as the initialIntensityReport
+            '{}.fieldUnits'.format(r),
+            'sourceIntensityReport.magneticField',
+            'sourceIntensityReport.precision',
+        ],
+        data['models'],
+    )
+
+
 def _zip_path_for_file(zf, file_to_find):
     """Find the full path of the specified file within the zip.
 
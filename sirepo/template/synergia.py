@@ -7,14 +7,16 @@ u"""Synergia execution template.
 
 from __future__ import absolute_import, division, print_function
 from pykern import pkio
+from pykern import pkjson
 from pykern.pkdebug import pkdc, pkdp, pkdlog
 from sirepo import simulation_db
 from sirepo.srschema import get_enums
 from sirepo.template import template_common, elegant_common, elegant_lattice_importer
 from synergia import foundation
-import glob
 import h5py
 import math
+import numpy as np
+import os
 import py.path
 import re
 import werkzeug
@@ -37,6 +39,11 @@ _FILE_ID_SEP = '-'
 
 _IGNORE_ATTRIBUTES = ['lrad']
 
+#: Per particle file column ranges, see `_particle_file_ranges`
+_PARTICLE_RANGES_FILE = 'particle-ranges.json'
+
+_PARTICLE_RANGES_VERSION = 1
+
 _SCHEMA = simulation_db.get_schema(SIM_TYPE)
 
 _UNITS = {
@@ -457,15 +464,16 @@ def _compute_range_across_files(run_dir, data):
     res = {}
     for v in _SCHEMA.enum.PhaseSpaceCoordinate6:
         res[v[0]] = []
-    for filename in _particle_file_list(run_dir):
-        with h5py.File(str(filename), 'r') as f:
-            for field in res:
-                values = f['particles'][:, _COORD6.index(field)].tolist()
-                if len(res[field]):
-                    res[field][0] = min(min(values), res[field][0])
-                    res[field][1] = max(max(values), res[field][1])
-                else:
-                    res[field] = [min(values), max(values)]
+    for ranges in _particle_file_ranges(run_dir):
+        for field in res:
+            r = ranges[_COORD6.index(field)]
+            if r is None:
+                continue
+            if len(res[field]):
+                res[field][0] = min(r[0], res[field][0])
+                res[field][1] = max(r[1], res[field][1])
+            else:
+                res[field] = list(r)
     return res
 
 
@@ -476,8 +484,8 @@ def _drift_name(length):
 def _extract_bunch_plot(report, frame_index, run_dir):
     filename = _particle_file_list(run_dir)[frame_index]
     with h5py.File(str(filename), 'r') as f:
-        x = f['particles'][:, _COORD6.index(report['x'])].tolist()
-        y = f['particles'][:, _COORD6.index(report['y'])].tolist()
+        x = f['particles'][:, _COORD6.index(report['x'])]
+        y = f['particles'][:, _COORD6.index(report['y'])]
         data = simulation_db.read_json(run_dir.join(template_common.INPUT_BASE_NAME))
         if 'bunchAnimation' not in data.models:
             # In case the simulation was run before the bunchAnimation was added
@@ -562,6 +570,13 @@ def _extract_turn_comparison_plot(report, run_dir, turn_count):
         }
 
 
+def _finite_range(values):
+    v = values[np.isfinite(values)]
+    if not len(v):
+        return None
+    return [float(np.min(v)), float(np.max(v))]
+
+
 def _generate_lattice(data, beamline_map, v):
     beamlines = {}
     report = data['report'] if 'report' in data else ''
@@ -931,7 +946,55 @@ def _nlinsert_name(model, el_name):
 
 
 def _particle_file_list(run_dir):
-    return sorted(glob.glob(str(run_dir.join('particles_*.h5'))))
+    return [
+        str(f) for f in template_common.progress_files(run_dir, '.', 'particles_*.h5')
+    ]
+
+
+def _particle_file_ranges(run_dir):
+    """Min and max of each coordinate for each particle file
+
+    Ranges are saved in `_PARTICLE_RANGES_FILE` keyed by file name, mtime,
+    and size so only new or rewritten files are read.
+
+    Returns:
+        list: per file, [min, max] (or None if no finite values) per `_COORD6`
+    """
+    p = run_dir.join(_PARTICLE_RANGES_FILE)
+    cache = {}
+    if p.check():
+        try:
+            c = pkjson.load_any(p)
+            if c.version == _PARTICLE_RANGES_VERSION:
+                cache = c.files
+        except Exception:
+            pass
+    res = []
+    files = {}
+    changed = False
+    for filename in _particle_file_list(run_dir):
+        st = os.stat(filename)
+        n = os.path.basename(filename)
+        e = cache.get(n)
+        if not e or e.mtime != st.st_mtime or e.size != st.st_size:
+            with h5py.File(filename, 'r') as f:
+                v = f['particles'][:, :len(_COORD6)]
+            e = dict(
+                mtime=st.st_mtime,
+                size=st.st_size,
+                ranges=[_finite_range(v[:, i]) for i in range(len(_COORD6))],
+            )
+            changed = True
+        files[n] = e
+        res.append(e['ranges'])
+    if changed or len(files) != len(cache):
+        t = run_dir.join(_PARTICLE_RANGES_FILE + '.tmp')
+        pkjson.dump_pretty(
+            dict(version=_PARTICLE_RANGES_VERSION, files=files),
+            filename=t,
+        )
+        t.rename(p)
+    return res
 
 
 def _plot_field(field):
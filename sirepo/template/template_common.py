@@ -11,6 +11,9 @@ from pykern import pkio
 from pykern import pkjinja
 from pykern import pkresource
 from pykern.pkdebug import pkdc, pkdlog, pkdp
+import collections
+import fnmatch
+import glob
 import hashlib
 import json
 import numpy as np
@@ -19,6 +22,9 @@ import py.path
 import re
 import sirepo.template
 import subprocess
+import threading
+import time
+import uuid
 
 ANIMATION_ARGS_VERSION_RE = re.compile(r'v(\d+)$')
 
@@ -35,6 +41,10 @@ OUTPUT_BASE_NAME = 'out'
 #: Python file (not all simulations)
 PARAMETERS_PYTHON_FILE = 'parameters.py'
 
+#: Output files of a running simulation, one json record per line. The
+#: first line identifies the run.
+PROGRESS_MANIFEST = 'progress-manifest.jsonl'
+
 #: stderr and stdout
 RUN_LOG = 'run.log'
 
@@ -42,10 +52,21 @@ _HISTOGRAM_BINS_MAX = 500
 
 _PLOT_LINE_COLOR = ['#1f77b4', '#ff7f0e', '#2ca02c']
 
+#: Directories modified this recently are listed again, mtimes may be coarse
+_PROGRESS_SCAN_SETTLE_SECONDS = 2
+
+#: Most manifests and directory listings remembered per process
+_PROGRESS_STATE_MAX = 64
+
 _RESOURCE_DIR = py.path.local(pkresource.filename('template'))
 
 _WATCHPOINT_REPORT_NAME = 'watchpointReport'
 
+#: manifest path or (directory, pattern) to read state, least recently used first
+_progress_state = collections.OrderedDict()
+
+_progress_state_lock = threading.Lock()
+
 
 def compute_field_range(args, compute_range):
     """ Computes the fieldRange values for all parameters across all animation files.
@@ -295,6 +316,96 @@ def parse_enums(enum_schema):
     return res
 
 
+def progress_files(run_dir, directory, pattern, key=None):
+    """Output files of a simulation in frame order
+
+    If the simulation records its files with `record_progress_files`,
+    only the lines appended to `PROGRESS_MANIFEST` since the last call
+    are read. Otherwise, the directory is only listed again when its
+    mtime changes.
+
+    Args:
+        run_dir (py.path): simulation's run dir
+        directory (str): relative to run_dir
+        pattern (str): glob of file names
+        key (func): sort key of file paths [sorted by name]
+    Returns:
+        list: py.path of each file
+    """
+    d = os.path.normpath(directory)
+    res = [
+        run_dir.join(r.filename) for r in _progress_manifest(run_dir) or []
+        if os.path.dirname(r.filename) == ('' if d == '.' else d)
+        and fnmatch.fnmatch(os.path.basename(r.filename), pattern)
+    ]
+    if not res:
+        # the simulation doesn't record these files or hasn't yet
+        res = _progress_scan(run_dir.join(directory), pattern)
+    return sorted(res, key=key or str)
+
+
+def prune_files(directory, pattern, max_bytes):
+    """Remove the least recently modified files above max_bytes
+
+    Used to bound caches which are shared by runs, e.g. checkpoints.
+
+    Args:
+        directory (py.path): cache
+        pattern (str): glob of file names
+        max_bytes (int): total size to keep
+    """
+    files = []
+    total = 0
+    for f in directory.listdir(pattern):
+        try:
+            st = f.stat()
+        except Exception:
+            # removed by another run
+            continue
+        files.append((st.mtime, st.size, f))
+        total += st.size
+    for _, size, f in sorted(files, key=lambda x: x[0]):
+        if total <= max_bytes:
+            break
+        pkio.unchecked_remove(f)
+        total -= size
+
+
+def record_progress_files(run_dir, directory, pattern, iteration=None):
+    """Append new output files to the `PROGRESS_MANIFEST`
+
+    Called by a running simulation after it writes output, so status
+    polls don't have to list the output directory. Only call this when
+    the files are complete.
+
+    Args:
+        run_dir (py.path): simulation's run dir
+        directory (str): relative to run_dir
+        pattern (str): glob of file names
+        iteration (int): simulation step when the files were written [None]
+    """
+    run_dir = pkio.py_path(run_dir)
+    p = run_dir.join(PROGRESS_MANIFEST)
+    seen = set(r.filename for r in _progress_manifest(run_dir) or [])
+    lines = []
+    for f in sorted(glob.glob(str(run_dir.join(directory, pattern)))):
+        n = os.path.normpath(run_dir.bestrelpath(pkio.py_path(f)))
+        if n in seen:
+            continue
+        lines.append(json.dumps(dict(
+            index=len(seen) + len(lines),
+            filename=n,
+            iteration=iteration,
+            mtime=os.path.getmtime(f),
+        )) + '\n')
+    if lines:
+        if not p.check():
+            # run dirs are recreated, so readers can't rely on the inode
+            lines.insert(0, json.dumps(dict(run=uuid.uuid4().hex)) + '\n')
+        with open(str(p), 'a') as f:
+            f.write(''.join(lines))
+
+
 def render_jinja(sim_type, v, name=PARAMETERS_PYTHON_FILE):
     """Render the values into a jinja template.
 
@@ -490,6 +601,81 @@ def _escape(v):
     return re.sub("[\"'()]", '', str(v))
 
 
+def _progress_manifest(run_dir):
+    """Records appended to the manifest or None if there isn't one"""
+    p = str(run_dir.join(PROGRESS_MANIFEST))
+    try:
+        st = os.stat(p)
+    except OSError:
+        return None
+    with _progress_state_lock:
+        res = _progress_state.pop(p, None)
+        try:
+            with open(p, 'rb') as f:
+                if res and (
+                    res.inode != st.st_ino or res.offset > st.st_size
+                    or f.read(len(res.head)) != res.head
+                ):
+                    # manifest of a new run
+                    res = None
+                if not res:
+                    res = _progress_manifest_state(st)
+                try:
+                    _progress_manifest_read(f, res)
+                except ValueError:
+                    pkdlog('{}: rereading: offset={}', p, res.offset)
+                    res = _progress_manifest_state(st)
+                    try:
+                        _progress_manifest_read(f, res)
+                    except ValueError as e:
+                        pkdlog('{}: invalid record after offset={}: {}', p, res.offset, e)
+        except IOError:
+            # removed with the run dir
+            return None
+        _progress_state_put(p, res)
+        return list(res.records)
+
+
+def _progress_manifest_read(f, state):
+    """Parse complete lines after state.offset"""
+    f.seek(state.offset)
+    b = f.read()
+    for l in b[:b.rfind(b'\n') + 1].splitlines(True):
+        r = json.loads(l.decode('utf-8'))
+        if not state.head:
+            state.head = l
+        if 'filename' in r:
+            state.records.append(pkcollections.Dict(r))
+        state.offset += len(l)
+
+
+def _progress_manifest_state(st):
+    return pkcollections.Dict(head=b'', inode=st.st_ino, offset=0, records=[])
+
+
+def _progress_scan(directory, pattern):
+    k = (str(directory), pattern)
+    try:
+        m = os.path.getmtime(k[0])
+    except OSError:
+        return []
+    with _progress_state_lock:
+        res = _progress_state.pop(k, None)
+        if not res or res.mtime != m or time.time() - m < _PROGRESS_SCAN_SETTLE_SECONDS:
+            res = pkcollections.Dict(
+                mtime=m,
+                files=[pkio.py_path(f) for f in glob.glob(str(directory.join(pattern)))],
+            )
+        _progress_state_put(k, res)
+        return list(res.files)
+
+
+def _progress_state_put(key, value):
+    _progress_state[key] = value
+    while len(_progress_state) > _PROGRESS_STATE_MAX:
+        _progress_state.popitem(last=False)
+
+
 def _plot_range(report, axis):
     half_size = float(report['{}Size'.format(axis)]) / 2.0
     midpoint = float(report['{}Offset'.format(axis)])
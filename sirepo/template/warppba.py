@@ -16,6 +16,7 @@ from pykern import pkio
 from pykern.pkdebug import pkdc, pkdp
 from sirepo import simulation_db
 from sirepo.template import template_common
+import collections
 import h5py
 import numpy
 import os
@@ -29,6 +30,11 @@ SIM_TYPE = 'warppba'
 WANT_BROWSER_FRAME_CACHE = True
 
 _REPORT_STYLE_FIELDS = ['colorMap', 'notes']
+
+#: Parsed OpenPMDTimeSeries by file, reused across frames by extract workers
+_OPMD_CACHE_SIZE = 32
+
+_opmd_cache = collections.OrderedDict()
 _SCHEMA = simulation_db.get_schema(SIM_TYPE)
 
 def background_percent_complete(report, run_dir, is_running):
@@ -96,19 +102,14 @@ def extract_particle_report(args, particle_type, run_dir, data_file):
     yarg = args.y
     nbins = args.histogramBins
     opmd = _opmd_time_series(data_file)
-    data_list = opmd.get_particle(
-        var_list=[xarg, yarg],
-        species=particle_type,
-        iteration=numpy.array([data_file.iteration]),
-        select=None,
-        output=True,
-        plot=False,
-    )
-    with h5py.File(data_file.filename) as f:
-        data_list.append(main.read_species_data(f, particle_type, 'w', ()))
     select = _particle_selection_args(args)
-    if select:
-        with h5py.File(data_file.filename) as f:
+    # same reads as opmd.get_particle, with one open for values, weights, and selection
+    with h5py.File(data_file.filename, 'r') as f:
+        data_list = [
+            main.read_species_data(f, particle_type, v, ())
+            for v in (xarg, yarg, 'w')
+        ]
+        if select:
             main.apply_selection(f, data_list, select, particle_type, ())
     xunits = ' [m]' if len(xarg) == 1 else ''
     yunits = ' [m]' if len(yarg) == 1 else ''
@@ -428,10 +429,7 @@ def _field_animation(args, data_file):
 
 
 def _h5_file_list(run_dir):
-    return pkio.walk_tree(
-        run_dir.join('hdf5'),
-        r'\.h5$',
-    )
+    return template_common.progress_files(run_dir, 'hdf5', '*.h5')
 
 
 def _iteration_title(opmd, data_file):
@@ -440,14 +438,23 @@ def _iteration_title(opmd, data_file):
 
 
 def _opmd_time_series(data_file):
-    prev = None
-    try:
-        prev = main.list_h5_files
-        main.list_h5_files = lambda x: ([data_file.filename], [data_file.iteration])
-        return OpenPMDTimeSeries(py.path.local(data_file.filename).dirname)
-    finally:
-        if prev:
-            main.list_h5_files = prev
+    st = os.stat(data_file.filename)
+    k = (data_file.filename, st.st_mtime, st.st_size)
+    res = _opmd_cache.pop(k, None)
+    if res is None:
+        prev = None
+        try:
+            prev = main.list_h5_files
+            main.list_h5_files = lambda x: ([data_file.filename], [data_file.iteration])
+            res = OpenPMDTimeSeries(py.path.local(data_file.filename).dirname)
+        finally:
+            if prev:
+                main.list_h5_files = prev
+        while len(_opmd_cache) >= _OPMD_CACHE_SIZE:
+            _opmd_cache.popitem(last=False)
+    # most recently used last
+    _opmd_cache[k] = res
+    return res
 
 
 def _particle_selection_args(args):
@@ -14,11 +14,14 @@ from rswarp.utilities.file_utils import readparticles
 from scipy import constants
 from sirepo import simulation_db
 from sirepo.template import template_common
+import collections
 import h5py
 import numpy as np
+import os
 import os.path
 import py.path
 import re
+import threading
 
 
 COMPARISON_STEP_SIZE = 100
@@ -30,6 +33,7 @@ _CULL_PARTICLE_SLOPE = 1e-4
 _DENSITY_FILE = 'density.npy'
 _EGUN_CURRENT_FILE = 'egun-current.npy'
 _EGUN_STATUS_FILE = 'egun-status.txt'
+_MAX_ROW_LOGS = 32
 _OPTIMIZER_OUTPUT_FILE = 'opt.out'
 _OPTIMIZER_RESULT_FILE = 'opt.json'
 _OPTIMIZER_STATUS_FILE = 'opt-run.out'
@@ -38,8 +42,14 @@ _OPTIMIZE_PARAMETER_FILE = 'parameters-optimize.py'
 _PARTICLE_FILE = 'particles.npy'
 _PARTICLE_PERIOD = 100
 _REPORT_STYLE_FIELDS = ['colorMap', 'notes', 'color', 'impactColorMap']
+_ROW_LOG_HEAD_SIZE = 256
 _SCHEMA = simulation_db.get_schema(SIM_TYPE)
 
+#: path to parse state of files read by _read_rows, least recently read first
+_row_logs = collections.OrderedDict()
+_row_logs_lock = threading.Lock()
+
+
 def background_percent_complete(report, run_dir, is_running):
     if report == 'optimizerAnimation':
         return _optimizer_percent_complete(run_dir, is_running)
@@ -180,8 +190,16 @@ def get_simulation_frame(run_dir, data, model_data):
         data_file = open_data_file(run_dir, data['modelName'], frame_index)
         return _extract_field(args.field, model_data, data_file)
     if data['modelName'] == 'particleAnimation' or data['modelName'] == 'particle3d':
-        args = template_common.parse_animation_args(data, {'': ['renderCount', 'startTime']})
-        return _extract_particle(run_dir, model_data, int(args.renderCount))
+        args = template_common.parse_animation_args(data, {
+            '': ['renderCount', 'startTime'],
+            4: ['renderCount', 'maxPoints', 'startTime'],
+        })
+        return _extract_particle(
+            run_dir,
+            model_data,
+            int(args.renderCount),
+            int(args.get('maxPoints') or _SCHEMA.model[data['modelName']].maxPoints[2]),
+        )
     if data['modelName'] == 'egunCurrentAnimation':
         return _extract_egun_current(model_data, run_dir.join(_EGUN_CURRENT_FILE), frame_index)
     if data['modelName'] == 'impactDensityAnimation':
@@ -298,39 +316,24 @@ def _add_margin(bounds):
     return [bounds[0] - margin, bounds[1] + margin]
 
 
-def _add_particle_paths(electrons, x_points, y_points, z_points, half_height, limit):
+def _add_particle_paths(electrons, x_points, y_points, z_points, half_height, limit, max_points):
     # adds paths for the particleAnimation report
-    # culls adjacent path points with similar slope
-    count = 0
-    cull_count = 0
-    for i in range(min(len(electrons[1]), limit)):
-        res = {'x': [], 'y': [], 'z': []}
-        num_points = len(electrons[1][i])
-        prev = [None, None, None]
-        for j in range(num_points):
-            curr = [
-                electrons[1][i][j],
-                electrons[0][i][j],
-                electrons[2][i][j],
-            ]
-            if j > 0 and j < num_points - 1:
-                next = [
-                    electrons[1][i][j+1],
-                    electrons[0][i][j+1],
-                    electrons[2][i][j+1]
-                ]
-                if _cull_particle_point(curr, next, prev):
-                    cull_count += 1
-                    continue
-            res['x'].append(curr[0])
-            res['y'].append(curr[1])
-            res['z'].append(curr[2])
-            prev = curr
-        count += len(res['x'])
-        x_points.append(res['x'])
-        y_points.append(res['y'])
-        z_points.append(res['z'])
-    pkdc('particles: {} paths, {} points {} points culled', len(x_points), count, cull_count)
+    # culls path points with similar slope, all paths at once
+    n = min(len(electrons[1]), limit)
+    if n <= 0:
+        return
+    lengths = np.array([len(electrons[1][i]) for i in range(n)])
+    valid = np.arange(np.max(lengths)) < lengths[:, np.newaxis]
+    # (path, point, [x, y, z]) padded with nan
+    paths = np.full(valid.shape + (3,), np.nan)
+    for i, e in enumerate((1, 0, 2)):
+        paths[..., i][valid] = np.concatenate([electrons[e][j] for j in range(n)])
+    keep = _cull_particle_points(paths, valid, lengths, max_points)
+    for p in np.split(paths[keep], np.cumsum(np.sum(keep, axis=1))[:-1]):
+        x_points.append(p[:, 0].tolist())
+        y_points.append(p[:, 1].tolist())
+        z_points.append(p[:, 2].tolist())
+    pkdc('particles: {} paths, {} points {} points culled', n, np.sum(keep), np.sum(valid & ~keep))
 
 
 def _create_plots(dimension, data, values, x_range):
@@ -372,13 +375,35 @@ def _create_plots(dimension, data, values, x_range):
     return plots, y_range
 
 
-def _cull_particle_point(curr, next, prev):
-    # check all three dimensions xy, xz, yz
-    if _particle_line_has_slope(curr, next, prev, 0, 1) \
-       or _particle_line_has_slope(curr, next, prev, 0, 2) \
-       or _particle_line_has_slope(curr, next, prev, 1, 2):
-        return False
-    return True
+def _cull_particle_points(paths, valid, lengths, max_points):
+    """Points to keep on each path
+
+    A point is kept when the change in slope (in any of xy, xz or yz)
+    accumulated since the previous kept point reaches the cull slope.
+    The cull slope is doubled until the total fits in max_points.
+    Path endpoints are always kept.
+    """
+    d = np.diff(paths, axis=1)
+    turn = np.zeros(valid.shape)
+    if turn.shape[1] > 2:
+        for i1, i2 in ((0, 1), (0, 2), (1, 2)):
+            s = _slopes(d[..., i1], d[..., i2])
+            turn[:, 1:-1] = np.fmax(turn[:, 1:-1], np.abs(np.diff(s, axis=1)))
+    # nan at the end of shorter paths
+    turn[~(valid & np.isfinite(turn))] = 0
+    turn = np.cumsum(turn, axis=1)
+    ends = np.zeros(valid.shape, dtype=bool)
+    p = np.flatnonzero(lengths)
+    ends[p, 0] = True
+    ends[p, lengths[p] - 1] = True
+    slope = _CULL_PARTICLE_SLOPE
+    while True:
+        step = np.floor(turn / slope)
+        res = ends.copy()
+        res[:, 1:] |= valid[:, 1:] & (step[:, 1:] > step[:, :-1])
+        if np.sum(res) <= max(max_points, np.sum(ends)):
+            return res
+        slope *= 2
 
 
 def _extract_current(data, data_file):
@@ -519,29 +544,83 @@ def _extract_impact_density(run_dir, data):
 
 def _read_optimizer_output(run_dir):
     # only considers unique points as steps
-    opt_file = run_dir.join(_OPTIMIZER_OUTPUT_FILE)
-    if not opt_file.exists():
+    res = _read_rows(run_dir.join(_OPTIMIZER_OUTPUT_FILE))
+    if not res:
         return None, None
+    return res.rows, res.best_row
+
+
+def _read_new_rows(path, state):
+    with open(path, 'rb') as f:
+        f.seek(state.offset)
+        b = f.read()
+    end = b.rfind(b'\n') + 1
+    if not state.offset:
+        state.head = b[:end][:_ROW_LOG_HEAD_SIZE]
+    state.offset += end
+    for line in b[:end].decode('utf-8', 'replace').split('\n'):
+        try:
+            v = np.array(line.split(), dtype=float)
+        except ValueError:
+            continue
+        if len(v) <= _OPT_RESULT_INDEX \
+           or state.table is not None and len(v) != state.table.shape[1]:
+            continue
+        if state.table is None:
+            state.table = np.zeros((64, len(v)))
+        elif state.count == len(state.table):
+            state.table = np.concatenate((state.table, np.zeros(state.table.shape)))
+        state.table[state.count] = v
+        state.count += 1
+        if state.best_row is None or v[_OPT_RESULT_INDEX] > state.best_row[_OPT_RESULT_INDEX]:
+            state.best_row = v
+
+
+def _read_rows(path):
+    """Rows of numbers in a file which is only appended to
+
+    Only the lines appended since the last call in this process are
+    parsed. A replaced or truncated file is read from the start.
+
+    Args:
+        path (py.path): whitespace separated values, one row per line
+    Returns:
+        Dict: rows (ndarray) and best_row (largest _OPT_RESULT_INDEX) or None
+    """
+    k = str(path)
     try:
-        values = np.loadtxt(str(opt_file))
-        if len(values):
-            if len(values.shape) == 1:
-                values = np.array([values])
-        else:
-            return None, None
-    except TypeError:
-        return None, None
-    except ValueError:
-        return None, None
+        st = os.stat(k)
+    except OSError:
+        return None
+    with _row_logs_lock:
+        res = _row_logs.pop(k, None)
+        if not res or res.inode != st.st_ino or res.offset > st.st_size \
+           or not _row_log_head_matches(k, res.head):
+            res = pkcollections.Dict(
+                inode=st.st_ino,
+                head=b'',
+                offset=0,
+                count=0,
+                table=None,
+                best_row=None,
+            )
+        _row_logs[k] = res
+        while len(_row_logs) > _MAX_ROW_LOGS:
+            _row_logs.popitem(last=False)
+        if res.offset < st.st_size:
+            _read_new_rows(k, res)
+        if not res.count:
+            return None
+        return pkcollections.Dict(
+            rows=res.table[:res.count],
+            best_row=res.best_row,
+        )
 
-    res = []
-    best_row = None
-    # steps, time, tolerance, result, p1, ... pn
-    for v in values:
-        res.append(v)
-        if best_row is None or v[_OPT_RESULT_INDEX] > best_row[_OPT_RESULT_INDEX]:
-            best_row = v
-    return np.array(res), best_row
+
+def _row_log_head_matches(path, head):
+    # a file removed and recreated may get the same inode
+    with open(path, 'rb') as f:
+        return f.read(len(head)) == head
 
 
 def _extract_optimization_results(run_dir, data, args):
@@ -577,7 +656,7 @@ def _extract_optimization_results(run_dir, data, args):
     }
 
 
-def _extract_particle(run_dir, data, limit):
+def _extract_particle(run_dir, data, limit, max_points):
     v = np.load(str(run_dir.join(_PARTICLE_FILE)))
     kept_electrons = v[0]
     lost_electrons = v[1]
@@ -590,11 +669,12 @@ def _extract_particle(run_dir, data, limit):
     x_points = []
     y_points = []
     z_points = []
-    _add_particle_paths(kept_electrons, x_points, y_points, z_points, half_height, limit)
+    # the plot's point budget is shared by the kept and lost paths
+    _add_particle_paths(kept_electrons, x_points, y_points, z_points, half_height, limit, max_points // 2)
     lost_x = []
     lost_y = []
     lost_z = []
-    _add_particle_paths(lost_electrons, lost_x, lost_y, lost_z, half_height, limit)
+    _add_particle_paths(lost_electrons, lost_x, lost_y, lost_z, half_height, limit, max_points // 2)
     return {
         'title': 'Particle Trace',
         'x_range': [0, plate_spacing],
@@ -686,9 +766,10 @@ def _generate_parameters_file(data):
 
 
 def _h5_file_list(run_dir, model_name):
-    return pkio.walk_tree(
-        run_dir.join('diags/xzsolver/hdf5' if model_name == 'currentAnimation' else 'diags/fields/electric'),
-        r'\.h5$',
+    return template_common.progress_files(
+        run_dir,
+        'diags/xzsolver/hdf5' if model_name == 'currentAnimation' else 'diags/fields/electric',
+        '*.h5',
     )
 
 
@@ -756,21 +837,15 @@ def _optimizer_percent_complete(run_dir, is_running):
     if is_running:
         status_file = run_dir.join(_OPTIMIZER_STATUS_FILE)
         if status_file.exists():
-            try:
-                if not summary_data:
-                    summary_data = {}
-                rows = np.loadtxt(str(status_file))
-                if len(rows.shape) == 1:
-                    rows = np.array([rows])
-                summary_data['statusRows'] = rows.tolist()
+            if not summary_data:
+                summary_data = {}
+            rows = _read_rows(status_file)
+            if rows:
+                summary_data['statusRows'] = rows.rows.tolist()
                 summary_data['fields'] = optimizer.fields
                 summary_data['frameCount'] = frame_count
                 summary_data['initialSteps'] = optimizer.initialSteps
                 summary_data['optimizerSteps'] = optimizer.optimizerSteps
-            except TypeError:
-                pass
-            except ValueError:
-                pass
     if summary_data:
         return {
             'percentComplete': 0 if is_running else 100,
@@ -791,12 +866,6 @@ def _optimizer_percent_complete(run_dir, is_running):
     }
 
 
-def _particle_line_has_slope(curr, next, prev, i1, i2):
-    return abs(
-        _slope(curr[i1], curr[i2], next[i1], next[i2]) - _slope(prev[i1], prev[i2], curr[i1], curr[i2])
-    ) >= _CULL_PARTICLE_SLOPE
-
-
 def _prepare_conductors(data):
     type_by_id = {}
     for ct in data.models.conductorTypes:
@@ -902,8 +971,7 @@ def _simulation_percent_complete(run_dir, is_running):
     return res
 
 
-def _slope(x1, y1, x2, y2):
-    if x2 - x1 == 0:
-        # treat no slope as flat for comparison
-        return 0
-    return (y2 - y1) / (x2 - x1)
+def _slopes(dx, dy):
+    # treat no slope as flat for comparison
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(dx == 0, 0, dy / dx)
@@ -11,6 +11,8 @@ from pykern import pkjinja
 from pykern.pkdebug import pkdp, pkdc, pkdlog
 from sirepo import simulation_db
 from sirepo.template import template_common
+from sirepo.template import webcon_dataset
+from sirepo.template import webcon_monitor
 import StringIO
 import copy
 import csv
@@ -112,7 +114,12 @@ def background_percent_complete(report, run_dir, is_running):
                 'percentComplete': 0,
                 'frameCount': count,
                 'summaryData': {
-                    'monitorValues': values,
+                    'monitorValues': {
+                        k: {
+                            'vals': v.vals.tolist(),
+                            'times': (v.times - start_time).tolist(),
+                        } for k, v in values.items()
+                    },
                 }
             }
     return {
@@ -294,9 +301,9 @@ def get_centroid_report(run_dir, data):
 def get_data_file(run_dir, model, frame, options=None):
     data = simulation_db.read_json(run_dir.join(template_common.INPUT_BASE_NAME))
     report = data.models[data.report]
-    path = _analysis_data_path(run_dir, data)
-    col_info = _column_info(path)
-    plot_data = _load_file_with_history(report, path, col_info)
+    dataset = _analysis_dataset(_analysis_data_path(run_dir, data))
+    col_info = dataset.meta
+    plot_data = _load_file_with_history(report, dataset)
     buf = StringIO.StringIO()
     buf.write(','.join(col_info['names']) + '\n')
     np.savetxt(buf, plot_data, delimiter=',')
@@ -471,6 +478,10 @@ def read_epics_values(server_address, fields):
     return res
 
 
+def remove_lib_file_cache(path):
+    webcon_dataset.remove(path)
+
+
 def run_epics_command(server_address, cmd):
     return template_common.subprocess_output(cmd, epics_env(server_address))
 
@@ -529,6 +540,13 @@ def _analysis_data_path(run_dir, data):
     return str(run_dir.join(_analysis_data_file(data)))
 
 
+def _analysis_dataset(path):
+    return webcon_dataset.read(
+        path,
+        lambda p: _parse_analysis_file(p, _column_info(p)),
+    )
+
+
 def _analysis_report_name_for_fft_report(report, data):
     return data.models[report].get('analysisReport', 'analysisReport')
 
@@ -932,6 +950,17 @@ def _hex_color_to_rgb(color):
     return rgb
 
 
+def _history_mask(report, values, col_info, step):
+    if step['action'] == 'trim':
+        idx = _safe_index(col_info, step['trimField'])
+        v = values[:, idx] * col_info['scale'][idx]
+        return (v >= step['trimMin']) & (v <= step['trimMax'])
+    report2 = copy.deepcopy(report)
+    report2.update(step)
+    clusters = _compute_clusters(report2, values, col_info)
+    return np.array(clusters['group']) == step['clusterIndex']
+
+
 def _init_default_beamline(data):
     #TODO(pjm): hard-coded beamline for now, using elegant format
     data.models.elements = [
@@ -1063,21 +1092,21 @@ def _lib_file_datetime(filename):
     return 0
 
 
-def _load_file_with_history(report, path, col_info):
-    res = np.genfromtxt(path, delimiter=',', skip_header=col_info['header_row_count'])
-    if 'history' in report:
-        for action in report.history:
-            if action.action == 'trim':
-                idx = _safe_index(col_info, action.trimField)
-                scale = col_info['scale'][idx]
-                res = res[(res[:,idx] * scale >= action.trimMin) & (res[:, idx] * scale <= action.trimMax)]
-            elif action.action == 'cluster':
-                report2 = copy.deepcopy(report)
-                report2.update(action)
-                clusters = _compute_clusters(report2, res, col_info)
-                labels = np.array(clusters['group'])
-                res = res[labels == action.clusterIndex,:]
-    return res
+def _load_file_with_history(report, dataset):
+    steps = []
+    for action in report.get('history', []):
+        if action.action == 'trim':
+            steps.append(action)
+        elif action.action == 'cluster':
+            # only the cluster settings affect the selected rows
+            s = {k: v for k, v in report.items() if k.startswith('cluster')}
+            s.update(action)
+            steps.append(s)
+    return webcon_dataset.replay(
+        dataset,
+        steps,
+        lambda values, step: _history_mask(report, values, dataset.meta, step),
+    )
 
 
 def _monitor_data_for_plots(data, history, start_time, type):
@@ -1093,13 +1122,10 @@ def _monitor_data_for_plots(data, history, start_time, type):
             m_data[el_name] = {}
         el_setting = s_map.setting
         h = history[mon_setting]
-        t_deltas = [
-            round(((dt.days * 86400) + dt.seconds + (dt.microseconds / 1000000))) for dt in
-            [t - start_time for t in h.times]
-        ]
+        t_deltas = np.round(h.times - start_time).tolist()
         pos = np.full(len(t_deltas), _position_of_element(data, el['_id']))
         m_data[el_name][el_setting] = {
-            'vals': h.vals,
+            'vals': h.vals.tolist(),
             'times': t_deltas,
             'position': pos.tolist()
         }
@@ -1115,6 +1141,14 @@ def _optimization_values(run_dir):
     return res
 
 
+def _parse_analysis_file(path, col_info):
+    return col_info, np.genfromtxt(
+        path,
+        delimiter=',',
+        skip_header=col_info['header_row_count'],
+    )
+
+
 # only works for unique ids (so not drifts)
 def _position_of_element(data, id):
     p = _element_positions(data)
@@ -1132,42 +1166,14 @@ def _read_epics_kickers(data):
 
 
 def _read_monitor_file(monitor_path, history=False):
-    from datetime import datetime
-    monitor_values = {}
-    count = 0
-    min_time = datetime.max
-    #TODO(pjm): currently reading entire file to get list of current values (most recent at bottom)
-    for line in pkio.read_text(str(monitor_path)).split("\n"):
-        m = re.match(r'(\S+)(.*?)\s([\d\.\e\-\+]+)\s*$', line)
-        if not m:
-            continue
-        var_name = m.group(1)
-        timestamp = m.group(2)
-        t = datetime.strptime(timestamp.strip(), '%Y-%m-%d %H:%M:%S.%f')
-        min_time = min(min_time, t)
-        var_value = m.group(3)
-        var_name = re.sub(r'^vagrant:', '', var_name)
-        var_name = re.sub(r':', '_', var_name)
-        if not history:
-            monitor_values[var_name] = float(var_value)
-        else:
-            if var_name not in monitor_values:
-                monitor_values[var_name] = pkcollections.Dict({
-                    'vals': [],
-                    'times': []
-                })
-            monitor_values[var_name].vals.append(float(var_value))
-            monitor_values[var_name].times.append(t)
-        count += 1
-    return monitor_values, count, min_time
+    m = webcon_monitor.read(monitor_path)
+    return m.history if history else m.latest, m.count, m.start_time
 
 
 def _report_info(run_dir, data):
     report = data.models[data.report]
-    path = _analysis_data_path(run_dir, data)
-    col_info = _column_info(path)
-    plot_data = _load_file_with_history(report, path, col_info)
-    return report, col_info, plot_data
+    dataset = _analysis_dataset(_analysis_data_path(run_dir, data))
+    return report, dataset.meta, _load_file_with_history(report, dataset)
 
 
 def _safe_index(col_info, idx):
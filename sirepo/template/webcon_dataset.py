@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+u"""Parsed analysis datasets and their history for webcon
+
+The uploaded CSV is parsed once into a .npz file keyed by the sha256 of
+the CSV, in a cache directory next to the lib file. The rows selected by
+each prefix of a report's history (trim and cluster actions) are saved in
+the same directory, so adding a step only applies that step to the rows
+of the previous prefix. The least recently used files are removed above
+`_MAX_CACHE_BYTES`, and a file's entries are removed with the file.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkio
+from pykern import pkjson
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo.template import template_common
+import hashlib
+import json
+import numpy as np
+import os
+import uuid
+
+#: Directory next to the (resolved) CSV file
+CACHE_DIR = 'webcon-dataset-cache'
+
+#: Cached tables and rows above this size are removed, oldest first
+_MAX_CACHE_BYTES = 1024 ** 3
+
+_CACHE_FILES = '*.np[yz]'
+
+#: path to (mtime, size, sha256)
+_digests = {}
+
+
+def read(path, parse):
+    """Parsed contents of path
+
+    Args:
+        path (str): CSV file, may be a symlink into the lib dir
+        parse (func): path to (meta, ndarray), called on a cache miss
+    Returns:
+        Dict: dir (py.path), key (sha256), meta, and table (ndarray)
+    """
+    d, k = _cache_dir(path)
+    p = d.join(k + '.npz')
+    if p.check():
+        try:
+            with np.load(str(p)) as z:
+                res = pkcollections.Dict(
+                    dir=d,
+                    key=k,
+                    meta=pkjson.load_any(str(z['meta'])),
+                    table=z['table'],
+                )
+            # least recently used is by mtime
+            p.setmtime()
+            return res
+        except Exception:
+            pkdlog('{}: reparsing: {}', p, pkdexc())
+    meta, values = parse(path)
+    pkio.mkdir_parent(d)
+    _write(
+        d,
+        p,
+        lambda f: np.savez(
+            f,
+            meta=np.array(pkjson.dump_pretty(meta)),
+            table=values,
+        ),
+    )
+    return pkcollections.Dict(dir=d, key=k, meta=meta, table=values)
+
+
+def remove(path):
+    """Remove the cached dataset and history of path
+
+    Called before path is deleted.
+
+    Args:
+        path (str): CSV file
+    """
+    p = os.path.realpath(str(path))
+    if not os.path.exists(p):
+        return
+    d, k = _cache_dir(p)
+    if d.check():
+        for f in d.listdir(k + '*'):
+            pkio.unchecked_remove(f)
+    _digests.pop(p, None)
+
+
+def replay(dataset, steps, apply):
+    """Rows of dataset selected by the steps
+
+    The rows after each prefix of steps are saved so only the steps
+    after the longest saved prefix are applied.
+
+    Args:
+        dataset (Dict): from `read`
+        steps (list): dicts which fully describe each step
+        apply (func): (values, step) to boolean mask of values
+    Returns:
+        ndarray: selected rows of dataset.table
+    """
+    keys = []
+    h = hashlib.sha256()
+    for s in steps:
+        h.update(json.dumps(s, sort_keys=True).encode('utf-8'))
+        keys.append(h.hexdigest())
+    rows = None
+    start = 0
+    for i in range(len(keys), 0, -1):
+        p = _rows_path(dataset, keys[i - 1])
+        if p.check():
+            try:
+                rows = np.load(str(p))
+                p.setmtime()
+                start = i
+                break
+            except Exception:
+                pkdlog('{}: ignoring: {}', p, pkdexc())
+    if rows is None:
+        rows = np.arange(len(dataset.table))
+    for i in range(start, len(steps)):
+        rows = rows[apply(dataset.table[rows], steps[i])]
+        _write(dataset.dir, _rows_path(dataset, keys[i]), lambda f: np.save(f, rows))
+    return dataset.table[rows]
+
+
+def _cache_dir(path):
+    """Cache directory and key of path
+
+    Returns:
+        tuple: py.path and sha256 of the contents
+    """
+    p = os.path.realpath(str(path))
+    st = os.stat(p)
+    x = _digests.get(p)
+    if x and x[0] == st.st_mtime and x[1] == st.st_size:
+        res = x[2]
+    else:
+        h = hashlib.sha256()
+        with open(p, 'rb') as f:
+            for b in iter(lambda: f.read(1 << 20), b''):
+                h.update(b)
+        res = h.hexdigest()
+        _digests[p] = (st.st_mtime, st.st_size, res)
+    return pkio.py_path(os.path.dirname(p)).join(CACHE_DIR), res
+
+
+def _rows_path(dataset, key):
+    return dataset.dir.join('{}-rows-{}.npy'.format(dataset.key, key))
+
+
+def _write(directory, path, writer):
+    t = '{}-{}.tmp'.format(path, uuid.uuid4().hex)
+    try:
+        with open(t, 'wb') as f:
+            writer(f)
+        os.rename(t, str(path))
+    except Exception:
+        pkio.unchecked_remove(t)
+        raise
+    template_common.prune_files(directory, _CACHE_FILES, _MAX_CACHE_BYTES)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+u"""Incremental store of the EPICS camonitor log
+
+camonitor appends one line per value change to the monitor log. Only the
+bytes appended since the last read are parsed. The store keeps the current
+value of each PV and the most recent `_HISTORY_SIZE` values and times in
+numpy arrays, and is saved with its byte offset next to the log so other
+processes (and the next poll) pick up where the last read stopped.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkjson
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import contextlib
+import datetime
+import fcntl
+import numpy as np
+import os
+import re
+import threading
+
+#: File next to the monitor log with the saved store
+STORE_SUFFIX = '.store.npz'
+
+#: Values kept per PV, older values are dropped
+_HISTORY_SIZE = 10000
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+_LINE_RE = re.compile(r'(\S+)(.*?)\s([\d\.e\-\+]+)\s*$')
+
+_STORE_VERSION = 1
+
+#: path to (store file stat, store) of the last read in this process
+_stores = {}
+
+_lock = threading.Lock()
+
+
+def read(monitor_path):
+    """Bring the store up to date and return it
+
+    Args:
+        monitor_path (py.path): camonitor output
+    Returns:
+        Dict: latest (PV to latest float), count (lines read),
+            start_time (epoch seconds of first value or None),
+            and history (PV to Dict(vals, times) ndarrays, times in epoch seconds)
+    """
+    p = str(monitor_path)
+    s = p + STORE_SUFFIX
+    with _lock, _file_lock(p + '.lock'):
+        res = _load(p, s)
+        st = os.stat(p)
+        if res.inode != st.st_ino or res.offset > st.st_size:
+            # camonitor restarted with a new log
+            res = _new_store(st)
+        if res.offset < st.st_size and _parse(p, res):
+            _save(s, res)
+            _stores[p] = (_stat(s), res)
+    return res
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _load(path, store_path):
+    k = _stat(store_path)
+    x = _stores.get(path)
+    if x and x[0] == k:
+        return x[1]
+    res = None
+    if k:
+        try:
+            res = _read_store(store_path)
+        except Exception:
+            pkdlog('{}: unable to read store, rebuilding: {}', store_path, pkdexc())
+    if res is None:
+        res = _new_store(os.stat(path))
+    _stores[path] = (k, res)
+    return res
+
+
+def _new_store(st):
+    return pkcollections.Dict(
+        version=_STORE_VERSION,
+        inode=st.st_ino,
+        offset=0,
+        count=0,
+        start_time=None,
+        latest=pkcollections.Dict(),
+        history=pkcollections.Dict(),
+    )
+
+
+def _parse(path, store):
+    """Parse complete lines after store.offset
+
+    Returns:
+        bool: True if the offset changed
+    """
+    with open(path, 'rb') as f:
+        f.seek(store.offset)
+        b = f.read()
+    end = b.rfind(b'\n') + 1
+    if not end:
+        return False
+    new = {}
+    for line in b[:end].decode('utf-8', 'replace').split('\n'):
+        m = _LINE_RE.match(line)
+        if not m:
+            continue
+        t = datetime.datetime.strptime(m.group(2).strip(), '%Y-%m-%d %H:%M:%S.%f')
+        t = (t - _EPOCH).total_seconds()
+        n = re.sub(r':', '_', re.sub(r'^vagrant:', '', m.group(1)))
+        v = float(m.group(3))
+        if n not in new:
+            new[n] = ([], [])
+        new[n][0].append(v)
+        new[n][1].append(t)
+        store.latest[n] = v
+        if store.start_time is None or t < store.start_time:
+            store.start_time = t
+        store.count += 1
+    for n, x in new.items():
+        h = store.history.get(n)
+        if h is None:
+            h = store.history[n] = pkcollections.Dict(
+                vals=np.zeros(0),
+                times=np.zeros(0),
+            )
+        h.vals = np.concatenate((h.vals, x[0]))[-_HISTORY_SIZE:]
+        h.times = np.concatenate((h.times, x[1]))[-_HISTORY_SIZE:]
+    store.offset += end
+    return True
+
+
+def _read_store(store_path):
+    with np.load(store_path) as z:
+        res = pkjson.load_any(str(z['meta']))
+        if res.get('version') != _STORE_VERSION:
+            return None
+        res.history = pkcollections.Dict()
+        for n in res.latest:
+            res.history[n] = pkcollections.Dict(
+                vals=z['v.' + n],
+                times=z['t.' + n],
+            )
+    return res
+
+
+def _save(store_path, store):
+    a = {
+        'meta': np.array(pkjson.dump_pretty(pkcollections.Dict(
+            (k, v) for k, v in store.items() if k != 'history'
+        ))),
+    }
+    for n, h in store.history.items():
+        a['v.' + n] = h.vals
+        a['t.' + n] = h.times
+    t = store_path + '.tmp'
+    with open(t, 'wb') as f:
+        np.savez(f, **a)
+    os.rename(t, store_path)
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
@@ -10,7 +10,7 @@ from pykern import pkio
 from pykern import pkjinja
 from pykern.pkdebug import pkdc, pkdp
 from sirepo import simulation_db
-from sirepo.template import template_common, zgoubi_importer
+from sirepo.template import template_common, zgoubi_fai, zgoubi_importer
 import copy
 import io
 import jinja2
@@ -253,9 +253,7 @@ def prepare_output_file(run_dir, data):
 def read_frame_count(run_dir):
     data_file = run_dir.join(_ZGOUBI_DATA_FILE)
     if data_file.exists():
-        col_names, rows = _read_data_file(data_file)
-        ipasses = _ipasses_for_data(col_names, rows)
-        return len(ipasses) + 1
+        return len(zgoubi_fai.read(data_file).ipasses) + 1
     return 0
 
 
@@ -302,8 +300,8 @@ def save_report_data(data, run_dir):
         }
     elif 'bunchReport' in report_name:
         report = data['models'][report_name]
-        col_names, rows = _read_data_file(py.path.local(run_dir).join(_ZGOUBI_DATA_FILE))
-        res = _extract_bunch_data(report, col_names, rows, '')
+        fai = zgoubi_fai.read(py.path.local(run_dir).join(_ZGOUBI_DATA_FILE))
+        res = _extract_bunch_data(report, fai, None, '')
         summary_file = py.path.local(run_dir).join(BUNCH_SUMMARY_FILE)
         if summary_file.exists():
             res['summaryData'] = {
@@ -352,17 +350,13 @@ def _compute_range_across_frames(run_dir, data):
         res[v[0]] = []
     for v in _SCHEMA.enum.EnergyPlotVariable:
         res[v[0]] = []
-    col_names, rows = _read_data_file(py.path.local(run_dir).join(_ZGOUBI_DATA_FILE))
+    fai = zgoubi_fai.read(py.path.local(run_dir).join(_ZGOUBI_DATA_FILE))
     for field in res:
-        values = column_data(field, col_names, rows)
+        r = [fai.ranges[field]]
         initial_field = _initial_phase_field(field)
-        if initial_field in col_names:
-            values += column_data(initial_field, col_names, rows)
-        if len(res[field]):
-            res[field][0] = min(min(values), res[field][0])
-            res[field][1] = max(max(values), res[field][1])
-        else:
-            res[field] = [min(values), max(values)]
+        if initial_field in fai.ranges:
+            r.append(fai.ranges[initial_field])
+        res[field] = [min(x[0] for x in r), max(x[1] for x in r)]
     for field in res.keys():
         factor = _ANIMATION_FIELD_INFO[field][1]
         res[field][0] *= factor
@@ -401,38 +395,34 @@ def _extract_animation(run_dir, data, model_data):
                 report[f] = _initial_phase_field(report[f])
             frame_index = 1
     model.update(report)
-    col_names, all_rows = _read_data_file(run_dir.join(_ZGOUBI_DATA_FILE))
-    ipasses = _ipasses_for_data(col_names, all_rows)
-    ipass = int(ipasses[frame_index - 1])
-    rows = []
-    ipass_index = int(col_names.index('IPASS'))
-    let_index = int(col_names.index('LET'))
-    if report['particleNumber'] != 'all':
-        let_search = "'{}'".format(int(report['particleNumber']) - 1)
-
-    count = 0
-    for row in all_rows:
-        if report['showAllFrames'] == '1':
-            if model_data.models.bunch.method == 'OBJET2.1' and report['particleNumber'] != 'all':
-                if row[let_index] != let_search:
-                    continue
-            rows.append(row)
-        elif int(row[ipass_index]) == ipass:
-            rows.append(row)
+    fai = zgoubi_fai.read(run_dir.join(_ZGOUBI_DATA_FILE))
+    ipass, segments = fai.ipasses[frame_index - 1]
+    if report['showAllFrames'] == '1':
+        rows = None
+        if model_data.models.bunch.method == 'OBJET2.1' and report['particleNumber'] != 'all':
+            let_search = "'{}'".format(int(report['particleNumber']) - 1)
+            rows = np.flatnonzero(fai.columns['LET'] == let_search.encode())
+    else:
+        rows = zgoubi_fai.segment_rows(segments)
     if report['showAllFrames'] == '1':
         title = 'All Frames'
         if model_data.models.bunch.method == 'OBJET2.1' and report['particleNumber'] != 'all':
             title += ', Particle {}'.format(report['particleNumber'])
     else:
         title = 'Initial Distribution' if is_frame_0 else 'Pass {}'.format(ipass)
-    return _extract_bunch_data(model, col_names, rows, title)
+    return _extract_bunch_data(model, fai, rows, title)
 
 
-def _extract_bunch_data(report, col_names, rows, title):
+def _extract_bunch_data(report, fai, rows, title):
     x_info = _ANIMATION_FIELD_INFO[report['x']]
     y_info = _ANIMATION_FIELD_INFO[report['y']]
-    x = np.array(column_data(report['x'], col_names, rows)) * x_info[1]
-    y = np.array(column_data(report['y'], col_names, rows)) * y_info[1]
+    x = fai.columns[report['x']]
+    y = fai.columns[report['y']]
+    if rows is not None:
+        x = x[rows]
+        y = y[rows]
+    x = np.array(x) * x_info[1]
+    y = np.array(y) * y_info[1]
     return template_common.heatmap([x, y], report, {
         'x_label': x_info[0],
         'y_label': y_info[0],
@@ -705,16 +695,6 @@ def _initial_phase_field(field):
     return _INITIAL_PHASE_MAP.get(field, '{}o'.format(field))
 
 
-def _ipasses_for_data(col_names, rows):
-    res = []
-    ipass_index = col_names.index('IPASS')
-    for row in rows:
-        ipass = row[ipass_index]
-        if ipass not in res:
-            res.append(ipass)
-    return res
-
-
 def _is_zip_file(path):
     return re.search(r'\.zip$', str(path), re.IGNORECASE)
 
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+u"""Columnar cache of zgoubi.fai particle output
+
+The text file is parsed once into one binary file per column, which is
+read with np.memmap. The index records the rows of each IPASS and the
+range of each numeric column. While zgoubi is running, only the bytes
+appended since the last read are parsed.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkio
+from pykern import pkjson
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import contextlib
+import fcntl
+import numpy as np
+import os
+import re
+
+#: Directory next to the data file with the index and column files
+CACHE_SUFFIX = '.columns'
+
+#: Non-numeric values (LET, labels) are truncated to this many bytes
+_STRING_WIDTH = 32
+
+_INDEX_FILE = 'index.json'
+
+_LOCK_FILE = 'lock'
+
+_INDEX_VERSION = 1
+
+
+def read(path):
+    """Bring the cache up to date and return it
+
+    Args:
+        path (py.path): zgoubi.fai
+    Returns:
+        Dict: col_names, row_count, ipasses ([ipass, [[start, end], ...]]),
+            ranges (col to [min, max]), and columns (col to ndarray)
+    """
+    d = pkio.py_path(str(path) + CACHE_SUFFIX)
+    pkio.mkdir_parent(d)
+    with _lock(d):
+        idx = _read_index(d)
+        st = os.stat(str(path))
+        if not idx or idx.inode != st.st_ino or idx.offset > st.st_size:
+            idx = _new_index(d, st)
+        if idx.offset < st.st_size:
+            try:
+                _parse(path, d, idx)
+            except ValueError:
+                # a column changed type, start over with the whole file
+                pkdlog('{}: rebuilding cache: {}', path, pkdexc())
+                idx = _new_index(d, st)
+                _parse(path, d, idx)
+            pkjson.dump_pretty(idx, filename=d.join(_INDEX_FILE))
+    res = pkcollections.Dict(
+        col_names=idx.col_names or [],
+        row_count=idx.row_count,
+        ipasses=idx.ipasses,
+        ranges=idx.ranges,
+        columns=pkcollections.Dict(),
+    )
+    for i, n in enumerate(idx.col_types or []):
+        n = idx.col_names[i]
+        if not n:
+            continue
+        if not idx.row_count:
+            res.columns[n] = np.zeros(0, dtype=idx.col_types[i])
+            continue
+        res.columns[n] = np.memmap(
+            str(d.join(_column_file(i))),
+            dtype=idx.col_types[i],
+            mode='r',
+            shape=(idx.row_count,),
+        )
+    return res
+
+
+def segment_rows(segments):
+    """Row indices of a pass
+
+    Args:
+        segments (list): [start, end] pairs from `read` ipasses
+    Returns:
+        ndarray: row indices
+    """
+    return np.concatenate([np.arange(s, e) for s, e in segments])
+
+
+def _append_ipasses(idx, ipass, start):
+    if not len(ipass):
+        return
+    by_pass = {x[0]: x[1] for x in idx.ipasses}
+    # boundaries of runs of equal values
+    b = np.flatnonzero(np.diff(ipass)) + 1
+    for s, e in zip(np.concatenate(([0], b)), np.concatenate((b, [len(ipass)]))):
+        p = int(ipass[s])
+        s = int(s) + start
+        e = int(e) + start
+        x = by_pass.get(p)
+        if x is None:
+            by_pass[p] = [[s, e]]
+            idx.ipasses.append([p, by_pass[p]])
+        elif x[-1][1] == s:
+            x[-1][1] = e
+        else:
+            x.append([s, e])
+
+
+def _column_file(i):
+    return 'c{}.bin'.format(i)
+
+
+def _column_types(rows):
+    res = []
+    for c in rows.T:
+        try:
+            c.astype('f8')
+            res.append('f8')
+        except ValueError:
+            res.append('S{}'.format(_STRING_WIDTH))
+    return res
+
+
+def _header(lines):
+    """Parse title and header lines
+
+    Returns:
+        tuple: column names and number of lines or None, 0 if incomplete
+    """
+    # mode: title -> header
+    mode = 'title'
+    for n, line in enumerate(lines):
+        if mode == 'title':
+            if not re.search(r'^\@', line):
+                mode = 'header'
+            continue
+        line = _normalize(line)
+        # header row starts with '# <letter>'
+        if re.search(r'^#\s+[a-zA-Z]', line):
+            return [
+                re.sub(r'\W|_', '', x) for x in re.split(r'\s+', line)[1:]
+            ], n + 1
+    return None, 0
+
+
+@contextlib.contextmanager
+def _lock(directory):
+    with open(str(directory.join(_LOCK_FILE)), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _new_index(directory, st):
+    for f in directory.listdir('c*.bin'):
+        f.remove()
+    return pkcollections.Dict(
+        version=_INDEX_VERSION,
+        inode=st.st_ino,
+        offset=0,
+        col_names=None,
+        col_types=None,
+        row_count=0,
+        ipasses=[],
+        ranges=pkcollections.Dict(),
+    )
+
+
+def _normalize(line):
+    # work-around odd header/value "! optimp.f" int twiss output
+    line = re.sub(r'\!\s', '', line)
+    # remove space from quoted values
+    return re.sub(r"'(\S*)\s*'", r"'\1'", line)
+
+
+def _parse(path, directory, idx):
+    """Parse complete lines after idx.offset and append to the columns"""
+    with open(str(path), 'rb') as f:
+        f.seek(idx.offset)
+        b = f.read()
+    end = b.rfind(b'\n') + 1
+    if not end:
+        return
+    lines = b[:end].decode('utf-8', 'replace').splitlines()
+    consumed = end
+    if idx.col_names is None:
+        c, n = _header(lines)
+        if c is None:
+            return
+        idx.col_names = c
+        lines = lines[n:]
+    rows = []
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        rows.append(re.split(r'\s+', re.sub(r'^\s+', '', _normalize(line))))
+    if rows:
+        n = len(idx.col_names)
+        # same as the text reader: values are matched to names by position
+        rows = np.array([(r + [''] * n)[:n] for r in rows])
+        if idx.col_types is None:
+            idx.col_types = _column_types(rows)
+        for i, t in enumerate(idx.col_types):
+            v = rows[:, i].astype(t)
+            with open(str(directory.join(_column_file(i))), 'ab') as f:
+                # drop rows appended before a crash which aren't in the index
+                f.truncate(idx.row_count * v.dtype.itemsize)
+                f.write(v.tobytes())
+            if t == 'f8' and idx.col_names[i]:
+                _update_range(idx, idx.col_names[i], v)
+        if 'IPASS' in idx.col_names:
+            i = idx.col_names.index('IPASS')
+            _append_ipasses(idx, rows[:, i].astype('f8').astype(int), idx.row_count)
+        idx.row_count += len(rows)
+    idx.offset += consumed
+
+
+def _read_index(directory):
+    p = directory.join(_INDEX_FILE)
+    if not p.check():
+        return None
+    try:
+        res = pkjson.load_any(p)
+        if res.get('version') == _INDEX_VERSION:
+            return res
+    except Exception:
+        pass
+    return None
+
+
+def _update_range(idx, name, values):
+    v = values[np.isfinite(values)]
+    if not len(v):
+        return
+    r = [float(np.min(v)), float(np.max(v))]
+    if name in idx.ranges:
+        r = [min(r[0], idx.ranges[name][0]), max(r[1], idx.ranges[name][1])]
+    idx.ranges[name] = r
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+u"""Test catalog_db
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+
+
+def test_update_load_delete():
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+    from sirepo import catalog_db
+
+    d = pkunit.empty_work_dir()
+    pkeq({}, catalog_db.load(d))
+    row = dict(
+        sid='abcdEFG1',
+        mtime=1.5,
+        size=100,
+        version='20190101.000000',
+        name='Wiggler',
+        folder='/Light Source Facilities',
+        is_example=True,
+        simulation={'name': 'Wiggler', 'simulationId': 'abcdEFG1'},
+        strings=['Wiggler', 'mirror_1d.dat'],
+    )
+    catalog_db.update(d, [row])
+    rows = catalog_db.load(d)
+    pkeq(['abcdEFG1'], list(rows.keys()))
+    r = rows['abcdEFG1']
+    pkeq(True, r.is_example)
+    pkeq('Wiggler', r.simulation['name'])
+    pkeq(['Wiggler', 'mirror_1d.dat'], r.strings)
+    row['name'] = 'Wiggler 2'
+    catalog_db.update(d, [row])
+    pkeq('Wiggler 2', catalog_db.load(d)['abcdEFG1'].name)
+    pkeq(
+        ['Wiggler 2'],
+        [r.name for r in catalog_db.names_in_folder(d, '/Light Source Facilities', 'Wig')],
+    )
+    pkeq([], catalog_db.names_in_folder(d, '/', 'Wig'))
+    catalog_db.delete(d, ['abcdEFG1'])
+    pkeq({}, catalog_db.load(d))
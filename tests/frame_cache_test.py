@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+u"""Test caching of simulationFrame replies
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import time
+
+
+def test_simulation_frame():
+    from pykern import pkunit
+    from sirepo import srdb
+    from sirepo import srunit
+    from sirepo.template import myapp
+    import os
+
+    fc = srunit.flask_client(sim_types='myapp')
+    fc.sr_login_as_guest('myapp')
+    data = fc.sr_sim_data('myapp', 'Scooby Doo')
+    sid = data.models.simulation.simulationId
+    run = fc.sr_post(
+        'runSimulation',
+        dict(
+            forceRun=False,
+            models=data.models,
+            report='heightWeightReport',
+            simulationId=sid,
+            simulationType=data.simulationType,
+        ),
+    )
+    for _ in range(10):
+        run = fc.sr_post(
+            'runStatus',
+            run.nextRequest
+        )
+        if run.state == 'completed':
+            break
+        time.sleep(1)
+    else:
+        pkunit.pkfail('runStatus: failed to complete: {}', run)
+    in_json = [
+        p for p in srdb.root().visit('in.json')
+        if p.dirpath().basename == 'heightWeightReport' and sid in str(p)
+    ]
+    pkunit.pkeq(1, len(in_json))
+    in_json = in_json[0]
+    frames = []
+
+    def get_simulation_frame(run_dir, data, model_data):
+        frames.append(data['frameIndex'])
+        return {
+            'title': 'frame {}'.format(len(frames)),
+            'points': [1.0, 2.0],
+        }
+
+    patch = dict(
+        WANT_BROWSER_FRAME_CACHE=False,
+        get_animation_name=lambda data: 'heightWeightReport',
+        get_simulation_frame=get_simulation_frame,
+    )
+    saved = dict((k, getattr(myapp, k)) for k in patch if hasattr(myapp, k))
+    try:
+        for k, v in patch.items():
+            setattr(myapp, k, v)
+        uri = '/simulation-frame/' + '*'.join(
+            ['myapp', sid, 'heightWeightReport', '1', '0', '0'],
+        )
+        r = fc.get(uri)
+        pkunit.pkeq(200, r.status_code)
+        pkunit.pkeq(1, len(frames))
+        body = r.get_data()
+        etag = r.headers['ETag']
+        pkunit.pkeq('private, no-cache', r.headers['Cache-Control'])
+        r = fc.get(uri)
+        pkunit.pkeq(200, r.status_code)
+        # served from the cache
+        pkunit.pkeq(1, len(frames))
+        pkunit.pkeq(body, r.get_data())
+        pkunit.pkeq(etag, r.headers['ETag'])
+        r = fc.get(uri, headers={'If-None-Match': etag})
+        pkunit.pkeq(304, r.status_code)
+        pkunit.pkeq(1, len(frames))
+        # a new run rewrites in.json
+        t = os.path.getmtime(str(in_json)) + 10
+        os.utime(str(in_json), (t, t))
+        r = fc.get(uri, headers={'If-None-Match': etag})
+        pkunit.pkeq(200, r.status_code)
+        pkunit.pkeq(2, len(frames))
+        pkunit.pkok(body != r.get_data(), 'stale frame returned after in.json changed')
+        pkunit.pkok(etag != r.headers['ETag'], 'etag unchanged after in.json changed')
+    finally:
+        for k in patch:
+            if k in saved:
+                setattr(myapp, k, saved[k])
+            else:
+                delattr(myapp, k)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+u"""PyTest for :mod:`sirepo.http_reply`
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from sirepo import srunit
+
+_HEADERS = {'X-Sirepo-Matrix-Encoding': 'float32-base64'}
+
+
+@srunit.wrap_in_request(headers=_HEADERS)
+def test_encode_matrix():
+    from pykern import pkunit
+    from sirepo import http_reply
+    import base64
+    import json
+    import numpy
+
+    z = numpy.random.RandomState(1).normal(scale=1e5, size=(7, 11))
+    z[0, 0] = 1e-30
+    value = {
+        'title': 'heatmap',
+        'x_range': [0, 1, 11],
+        'y_range': [0, 1, 7],
+        'z_matrix': z.tolist(),
+    }
+    res = http_reply.encode_matrix(value)
+    pkunit.pkeq(z.tolist(), value['z_matrix'])
+    m = res['z_matrix']
+    pkunit.pkeq('float32-base64', m['encoding'])
+    pkunit.pkeq([7, 11], m['shape'])
+    # same as sirepo.js decodeMatrix
+    actual = numpy.frombuffer(base64.b64decode(m['data']), dtype='<f4').reshape(m['shape'])
+    pkunit.pkok(
+        numpy.allclose(z, actual, rtol=numpy.finfo(numpy.float32).eps, atol=0),
+        'decoded z_matrix differs',
+    )
+    for k in 'title', 'x_range', 'y_range':
+        pkunit.pkeq(value[k], res[k])
+    r = http_reply.gen_json(value)
+    pkunit.pkeq(m, json.loads(r.get_data())['z_matrix'])
+    pkunit.pkok('X-Sirepo-Matrix-Encoding' in r.vary, 'missing Vary: {}', r.vary)
+
+
+@srunit.wrap_in_request(headers=_HEADERS)
+def test_encode_matrix_unchanged():
+    from pykern import pkunit
+    from sirepo import http_reply
+    from sirepo import simulation_db
+
+    for value in (
+        # not heatmaps
+        {'state': 'ok'},
+        {'points': [[1.0, 2.0], [3.0, 4.0]], 'x_range': [0, 1]},
+        ['z_matrix'],
+        # ragged, non-numeric, not 2d
+        {'z_matrix': [[1.0, 2.0], [3.0]]},
+        {'z_matrix': [['a', 'b']]},
+        {'z_matrix': [1.0, 2.0]},
+    ):
+        pkunit.pkok(http_reply.encode_matrix(value) is value, '{}: encoded', value)
+        r = http_reply.gen_json(value)
+        pkunit.pkeq(simulation_db.generate_json(value), r.get_data(as_text=True))
+        pkunit.pkok('X-Sirepo-Matrix-Encoding' not in r.vary, '{}: Vary={}', value, r.vary)
+
+
+@srunit.wrap_in_request()
+def test_encode_matrix_not_accepted():
+    from pykern import pkunit
+    from sirepo import http_reply
+
+    value = {'z_matrix': [[1.0, 2.0], [3.0, 4.0]]}
+    pkunit.pkok(http_reply.encode_matrix(value) is value, 'encoded without {}', _HEADERS)
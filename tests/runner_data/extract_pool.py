@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+u"""Drive `sirepo extract worker` through the runner daemon's extract pool
+
+Run by runner_test in py3, because the runner daemon is py3 only. The
+workers are py2 like the daemon's.
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from pykern import pkcollections
+from pykern import pkio
+from pykern import pkjson
+from pykern import pkunit
+from sirepo.runner_daemon import local_process
+from sirepo.template import template_common
+import os
+import sys
+import time
+import trio
+
+#: every worker started by the pool, in order
+_workers = []
+
+
+class _Worker(local_process._ExtractWorker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _workers.append(self)
+
+
+async def _main(work_dir):
+    local_process._ExtractWorker = _Worker
+    local_process.cfg.extract_pool_size = 2
+    local_process.cfg.extract_worker_max_requests = 3
+    local_process.cfg.extract_worker_timeout = 5
+    pool = local_process._ExtractWorkerPool()
+    myapp = _run_dir(work_dir, 'myapp', 'myapp')
+    try:
+        await _protocol(pool, myapp)
+        await _recycle(pool, myapp)
+        await _lru(pool, myapp, work_dir)
+        await _timeout(pool, myapp, work_dir)
+    finally:
+        # a hung worker would outlive the test
+        for w in _workers:
+            await w.aclose()
+
+
+async def _lru(pool, myapp, work_dir):
+    """Full pool closes the least recently used idle worker"""
+    adm = _run_dir(work_dir, 'adm', 'adm')
+    untyped = _run_dir(work_dir, 'untyped', None)
+    await _result(pool, adm)
+    pkunit.pkeq(['myapp', 'adm'], [w.sim_type for w in pool._idle])
+    # reusing myapp makes adm the least recently used
+    await _result(pool, myapp)
+    pkunit.pkeq(['adm', 'myapp'], [w.sim_type for w in pool._idle])
+    w = pool._idle[0]
+    await _result(pool, untyped)
+    pkunit.pkeq(['myapp', None], [w.sim_type for w in pool._idle])
+    pkunit.pkeq(2, pool._count)
+    pkunit.pkok(_exited(w), 'least recently used worker still running')
+
+
+def _exited(worker):
+    return worker._trio_process.returncode is not None
+
+
+async def _protocol(pool, run_dir):
+    """Requests, replies, and errors share one worker"""
+    r = await _result(pool, run_dir)
+    pkunit.pkeq(1, len(_workers))
+    w = _workers[0]
+    pkunit.pkeq('myapp', w.sim_type)
+    pkunit.pkeq([w], pool._idle)
+    # unknown subcmd is an error reply, not a broken worker
+    r = await pool.run(run_dir, _cmd('no_such_subcmd'))
+    pkunit.pkeq(1, r.returncode)
+    pkunit.pkre('no_such_subcmd', r.stderr.decode('utf-8'))
+    pkunit.pkeq([w], pool._idle)
+    pkunit.pkeq(2, w.requests)
+    pkunit.pkok(not _exited(w), 'worker exited after error reply')
+
+
+async def _recycle(pool, run_dir):
+    """Worker is closed after extract_worker_max_requests"""
+    w = _workers[0]
+    await _result(pool, run_dir)
+    pkunit.pkeq(3, w.requests)
+    pkunit.pkeq([], pool._idle)
+    pkunit.pkeq(0, pool._count)
+    pkunit.pkok(_exited(w), 'recycled worker still running')
+    await _result(pool, run_dir)
+    pkunit.pkeq(2, len(_workers))
+    pkunit.pkeq([_workers[1]], pool._idle)
+
+
+async def _result(pool, run_dir):
+    r = await pool.run(run_dir, _cmd('result', {'simulationType': 'myapp'}))
+    pkunit.pkok(r.returncode == 0, 'returncode={} stderr={}', r.returncode, r.stderr)
+    res, err = pkjson.load_any(r.stdout)
+    pkunit.pkeq(None, err)
+    pkunit.pkeq('completed', res.state)
+    pkunit.pkeq(run_dir.basename, res.run_dir)
+    return r
+
+
+def _cmd(subcmd, *args):
+    return ['sirepo', 'extract', subcmd, pkjson.dump_pretty(args)]
+
+
+def _run_dir(work_dir, name, sim_type):
+    d = work_dir.join(name)
+    pkio.mkdir_parent(d)
+    data = pkcollections.Dict(report='heightWeightReport')
+    if sim_type:
+        data.simulationType = sim_type
+    pkjson.dump_pretty(data, filename=d.join(template_common.INPUT_BASE_NAME + '.json'))
+    pkjson.dump_pretty(
+        {'state': 'completed', 'run_dir': name},
+        filename=d.join(template_common.OUTPUT_BASE_NAME + '.json'),
+    )
+    return d
+
+
+async def _timeout(pool, myapp, work_dir):
+    """Worker of a hung request is killed and not reused"""
+    local_process.cfg.extract_worker_timeout = 2
+    # only the timeout discards the worker
+    local_process.cfg.extract_worker_max_requests = 100
+    d = _run_dir(work_dir, 'hung', 'myapp')
+    # reading the output blocks until there is a writer, i.e. forever
+    o = d.join(template_common.OUTPUT_BASE_NAME + '.json')
+    o.remove()
+    os.mkfifo(str(o))
+    i = pool._idle[:]
+    n = len(_workers)
+    t = time.time()
+    r = await pool.run(d, _cmd('result', {'simulationType': 'myapp'}))
+    t = time.time() - t
+    pkunit.pkeq(1, r.returncode)
+    pkunit.pkre('timed out after 2s', r.stderr.decode('utf-8'))
+    pkunit.pkok(2 <= t < 10, 'timeout took {}s', t)
+    # the idle myapp worker served the hung request
+    w = [x for x in i if x.sim_type == 'myapp'][0]
+    pkunit.pkeq(n, len(_workers))
+    pkunit.pkok(_exited(w), 'hung worker still running')
+    pkunit.pkok(w not in pool._idle, 'hung worker reused')
+    pkunit.pkeq(1, pool._count)
+    # pool still serves requests
+    await _result(pool, myapp)
+    pkunit.pkeq(n + 1, len(_workers))
+
+
+if __name__ == '__main__':
+    trio.run(_main, pkio.py_path(sys.argv[1]))
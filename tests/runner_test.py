@@ -94,6 +94,26 @@ def test_runner_myapp():
         runner.wait()
 
 
+def test_extract_pool():
+    """Extract workers are reused, recycled, evicted, and killed on timeout"""
+    py3_env = _assert_py3()
+
+    from pykern import pkunit
+
+    try:
+        subprocess.check_output(
+            [
+                'pyenv', 'exec', 'python',
+                str(pkunit.data_dir().join('extract_pool.py')),
+                str(pkunit.empty_work_dir()),
+            ],
+            env=py3_env,
+            stderr=subprocess.STDOUT,
+        )
+    except subprocess.CalledProcessError as e:
+        pkunit.pkfail('extract_pool failed: {}', e.output)
+
+
 def _assert_py3():
     """Check if the py3 environment is set up properly"""
     res = dict()
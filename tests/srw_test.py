@@ -9,6 +9,7 @@ import pytest
 
 pytest.importorskip('srwl_bl')
 
+from pykern import pkio
 from pykern import pkresource
 from pykern import pkunit
 from sirepo import srunit
@@ -67,3 +68,116 @@ def test_prepare_aux_files():
     }''')
     d = pkunit.work_dir()
     template_common.copy_lib_files(data, None, d)
+
+
+@srunit.wrap_in_request(sim_types='srw')
+def test_wavefront_source_key():
+    from sirepo import simulation_db
+    from sirepo.template import srw
+
+    for data in simulation_db.examples(srw.SIM_TYPE):
+        data = simulation_db.fixup_old_data(data)[0]
+        w = [i for i in data.models.beamline if i.type == 'watch']
+        if w:
+            break
+    else:
+        pytest.fail('no example with a watchpoint')
+    data.report = 'watchpointReport{}'.format(w[-1].id)
+    p = srw._get_first_element_position(data)
+    k = srw._wavefront_source_key(data, p)
+    # the source is computed at the first element, not distanceFromSource
+    data.models.simulation.distanceFromSource = 12345.0
+    pkunit.pkeq(k, srw._wavefront_source_key(data, p))
+    data.models.beamline[0].position += 1
+    pkunit.pkok(
+        k != srw._wavefront_source_key(data, srw._get_first_element_position(data)),
+        'moving the first element must miss the source checkpoint',
+    )
+
+
+def test_wavefront_checkpoints():
+    """Propagating one item at a time from checkpoints matches a single container"""
+    import numpy
+    import os
+    import re
+    import srwlib
+    import srwlpy
+
+    def optics():
+        pp = [0, 0, 1.0, 0, 0, 1.0, 1.0, 1.0, 1.0, 0, 0, 0]
+        res = srwlib.SRWLOptC(
+            [
+                srwlib.SRWLOptD(10.0),
+                srwlib.SRWLOptL(_Fx=5.0, _Fy=5.0),
+                srwlib.SRWLOptA('r', 'a', 1e-3, 1e-3),
+                srwlib.SRWLOptD(5.0),
+            ],
+            # last is post propagation
+            [list(pp) for _ in range(4)] + [[0, 0, 1.0, 0, 0, 1.0, 1.0, 1.0, 1.0, 0, 0, 0]],
+        )
+        # element count and key after the source and each beamline item
+        res.checkpoints = [[0, 'source'], [1, 'drift'], [2, 'lens'], [4, 'aperture']]
+        return res
+
+    def run():
+        b = srwlib.SRWLGsnBm()
+        b.avgPhotEn = 1000.0
+        b.pulseEn = 0.001
+        b.repRate = 1
+        b.polar = 1
+        b.sigX = 23e-6
+        b.sigY = 23e-6
+        b.sigT = 10e-15
+        b.mx = 0
+        b.my = 0
+        w = srwlib.SRWLWfr()
+        w.allocate(1, 64, 64)
+        w.mesh.zStart = 20.0
+        w.mesh.eStart = w.mesh.eFin = b.avgPhotEn
+        w.mesh.xStart = w.mesh.yStart = -1e-3
+        w.mesh.xFin = w.mesh.yFin = 1e-3
+        w.partBeam.partStatMom1.x = b.x
+        w.partBeam.partStatMom1.y = b.y
+        w.partBeam.partStatMom1.z = b.z
+        w.partBeam.partStatMom1.xp = b.xp
+        w.partBeam.partStatMom1.yp = b.yp
+        srwlpy.CalcElecFieldGaussian(w, b, [0])
+        srwlpy.PropagElecField(w, op)
+        return w
+
+    def assert_same(expect, actual):
+        for f in 'xStart', 'xFin', 'nx', 'yStart', 'yFin', 'ny':
+            pkunit.pkeq(getattr(expect.mesh, f), getattr(actual.mesh, f))
+        for f in 'arEx', 'arEy':
+            e = numpy.array(getattr(expect, f))
+            a = numpy.array(getattr(actual, f))
+            pkunit.pkok(
+                numpy.allclose(e, a, rtol=1e-5, atol=1e-5 * numpy.abs(e).max()),
+                '{}: checkpointed propagation differs',
+                f,
+            )
+
+    src = pkio.read_text(pkresource.filename('template/srw/parameters.py.jinja'))
+    src = re.search(r'^def setup_wavefront_checkpoints.*?(?=^\{% endif %\})', src, re.M | re.S).group(0)
+    d = pkunit.work_dir().join('wavefront-checkpoints')
+    pkio.mkdir_parent(d)
+    originals = [getattr(srwlpy, n) for n in ('CalcElecFieldGaussian', 'CalcElecFieldSR', 'PropagElecField')]
+    try:
+        op = optics()
+        expect = run()
+        # second run resumes after the drift
+        for remove in [], ['aperture.pkl', 'lens.pkl']:
+            for f in remove:
+                d.join(f).remove()
+            op = optics()
+            g = dict(os=os, srwlib=srwlib, srwlpy=srwlpy)
+            exec(src.replace('{{wavefrontCheckpointDir}}', str(d)), g)
+            g['setup_wavefront_checkpoints'](op)
+            assert_same(expect, run())
+            srwlpy.PropagElecField = originals[2]
+            pkunit.pkeq(
+                ['aperture.pkl', 'drift.pkl', 'lens.pkl', 'source.pkl'],
+                sorted(f.basename for f in d.listdir('*.pkl')),
+            )
+    finally:
+        srwlpy.CalcElecFieldGaussian, srwlpy.CalcElecFieldSR, srwlpy.PropagElecField = originals
@@ -53,6 +53,29 @@ def test_rpn():
     })['error'] == 'invalid'
 
 
+def test_native_rpn():
+    from sirepo.template import elegant_common
+    from sirepo.template import elegant_rpn
+
+    for expr in (
+        '1 2 +',
+        '2 3 pow',
+        'pi 4 / sin',
+        '0.5 cosh',
+        '100 log',
+        '3 4 hypot',
+        'c_mks mev *',
+        '7.5 int',
+        '-2 abs',
+    ):
+        v = elegant_rpn.evaluate(expr, {}, [])
+        assert v is not None, expr
+        assert v == float(elegant_common.subprocess_output(['rpnl', expr])), expr
+    # conditionals are left to rpnl
+    assert elegant_rpn.evaluate('1 2 max2', {}, []) is None
+    assert elegant_rpn.evaluate('a b +', {'a': '1', 'b': 'a 2 *'}, ['a', 'b']) == 3.0
+
+
 def _rpn_value(v):
     from sirepo.template import elegant
     v['method'] = 'rpn_value'
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+u"""PyTest for :mod:`sirepo.template.sdds_util`
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkio
+from pykern import pkunit
+import pytest
+
+pytest.importorskip('sdds')
+
+#: binary elegant output in the elegant resources
+_BINARY_FILES = (
+    'SCRIPT-commandInputFile.beam.sdds',
+    'bunchFile-sourceFile.lh_test.sdds',
+)
+
+
+def test_extract_sdds_column():
+    from sirepo.template import sdds_util
+
+    for f in _binary_files():
+        pkunit.pkok(sdds_util.page_index(str(f)), '{}: not indexed', f)
+        _assert_pages(f)
+
+
+def test_file_summary():
+    """elegant output info matches the info read page by page with sddsdata"""
+    import sirepo.template
+    from sirepo.template import elegant_common
+
+    elegant = sirepo.template.import_module('elegant')
+    d = _binary_files()[0].dirpath()
+    _scale_pages(_multi_page(d.join(_BINARY_FILES[0]), 3))
+    for f in elegant_common.RESOURCE_DIR.listdir('*.sdds'):
+        if not d.join(f.basename).check():
+            f.copy(d)
+    for f in sorted(d.listdir('*.sdds')):
+        expect = _baseline_file_info(elegant, f)
+        actual = elegant._file_info(f.basename, d, 'x', 0)
+        if expect is None:
+            pkunit.pkeq(None, actual)
+            continue
+        for k in expect:
+            v = actual[k]
+            if k == 'parameters':
+                v = dict((p, list(x)) for p, x in v.items())
+            pkunit.pkok(expect[k] == v, '{}: {} differs', f.basename, k)
+
+
+def test_file_summary_non_finite():
+    """Non-finite column values are 0 in the range"""
+    from sirepo.template import sdds_util
+    import numpy
+
+    f = _binary_files()[0]
+    i = sdds_util.page_index(str(f))
+    page = i['pages'][0]
+    rows = sdds_util._read_array(str(f), sdds_util._column_dtype(i), page['offset'], page['rows'])
+    x = rows['x'].copy()
+    rows['x'][0] = numpy.inf
+    rows['x'][1] = numpy.nan
+    rows['y'] = numpy.abs(rows['y']) + 1
+    rows['y'][0] = -numpy.inf
+    b = bytearray(f.read_binary())
+    b[page['offset']:page['offset'] + rows.nbytes] = rows.tobytes()
+    f.write_binary(bytes(b))
+    # same size and maybe the same mtime
+    pkio.unchecked_remove(str(f) + sdds_util.PAGE_INDEX_SUFFIX)
+    sdds_util._page_index_cache.clear()
+    res = sdds_util.file_summary(str(f))
+    x = x[2:]
+    pkunit.pkeq([min(0, x.min()), max(0, x.max())], res['fieldRange']['x'])
+    y = rows['y'][1:]
+    pkunit.pkeq([0, y.max()], res['fieldRange']['y'])
+
+
+def test_growing_file():
+    """Pages appended to the file while it is being indexed"""
+    from sirepo.template import sdds_util
+
+    src = _multi_page(_binary_files()[0], 3)
+    b = src.read_binary()
+    d = pkunit.work_dir().join('growing')
+    pkio.mkdir_parent(d)
+    f = d.join(src.basename)
+    header, data = _split(src)
+    page = len(data) // 3
+    # end in the middle of the second page, then in the third
+    for count, end in (
+        (1, len(header) + page + page // 2),
+        (2, len(header) + page * 2 + 17),
+        (3, len(b)),
+    ):
+        f.write_binary(b[:end])
+        pkunit.pkeq(count, len(sdds_util.page_index(str(f))['pages']))
+    _assert_pages(f)
+
+
+def _assert_pages(path):
+    from sirepo.template import sdds_util
+
+    pages = _read_pages(path)
+    pkunit.pkok(pages, '{}: no pages', path)
+    for i, p in enumerate(pages):
+        for c, v in p['columns'].items():
+            res = sdds_util.extract_sdds_column(str(path), c, i)
+            pkunit.pkeq(None, res['err'])
+            pkunit.pkok(
+                v == res['values'],
+                '{}: page={} column={}: indexed values differ',
+                path.basename,
+                i,
+                c,
+            )
+
+
+def _baseline_file_info(elegant, path):
+    """rowCounts, parameters, fieldRange, etc. as elegant._file_info computed
+    them before the summary was cached"""
+    from sirepo.template import sdds_util
+    import sdds
+
+    i = sdds_util._SDDS_INDEX
+    try:
+        if sdds.sddsdata.InitializeInput(i, str(path)) != 1:
+            return None
+        column_names = sdds.sddsdata.GetColumnNames(i)
+        plottable_columns = []
+        field_range = {}
+        for col in column_names:
+            if sdds.sddsdata.GetColumnDefinition(i, col)[4] < elegant._SDDS_STRING_TYPE:
+                plottable_columns.append(col)
+            field_range[col] = []
+        parameter_names = sdds.sddsdata.GetParameterNames(i)
+        parameters = dict([(p, []) for p in parameter_names])
+        row_counts = []
+        while sdds.sddsdata.ReadPage(i) > 0:
+            row_counts.append(sdds.sddsdata.RowCount(i))
+            for j, p in enumerate(parameter_names):
+                parameters[p].append(sdds_util._safe_sdds_value(sdds.sddsdata.GetParameter(i, j)))
+            for j, col in enumerate(column_names):
+                values = sdds.sddsdata.GetColumn(i, j)
+                if not len(values):
+                    continue
+                r = [sdds_util._safe_sdds_value(min(values)), sdds_util._safe_sdds_value(max(values))]
+                if field_range[col]:
+                    r = [min(r[0], field_range[col][0]), max(r[1], field_range[col][1])]
+                field_range[col] = r
+        return {
+            'columns': column_names,
+            'fieldRange': field_range,
+            'pageCount': len(row_counts),
+            'parameterDefinitions': dict(
+                (p, dict(zip(
+                    ['symbol', 'units', 'description', 'format_string', 'type', 'fixed_value'],
+                    sdds.sddsdata.GetParameterDefinition(i, p),
+                ))) for p in parameter_names
+            ),
+            'parameters': parameters,
+            'plottableColumns': plottable_columns,
+            'rowCounts': row_counts,
+        }
+    finally:
+        sdds.sddsdata.Terminate(i)
+
+
+def _binary_files():
+    from sirepo.template import elegant_common
+
+    d = pkunit.work_dir().join('binary')
+    pkio.unchecked_remove(d)
+    pkio.mkdir_parent(d)
+    res = []
+    for n in _BINARY_FILES:
+        f = d.join(n)
+        elegant_common.RESOURCE_DIR.join(n).copy(f)
+        res.append(f)
+    res.append(_multi_page(res[0], 4))
+    return res
+
+
+def _multi_page(path, count):
+    """Copy of path with the pages repeated count times"""
+    header, data = _split(path)
+    res = path.new(purebasename='multi-{}-{}'.format(count, path.purebasename))
+    res.write_binary(header + data * count)
+    return res
+
+
+def _read_pages(path):
+    """Read all pages sequentially with sddsdata"""
+    from sirepo.template import sdds_util
+    import sdds
+
+    res = []
+    i = sdds_util._SDDS_INDEX
+    try:
+        if sdds.sddsdata.InitializeInput(i, str(path)) != 1:
+            return None
+        columns = sdds.sddsdata.GetColumnNames(i)
+        while sdds.sddsdata.ReadPage(i) > 0:
+            res.append(dict(
+                columns=dict(
+                    (c, [sdds_util._safe_sdds_value(v) for v in sdds.sddsdata.GetColumn(i, j)])
+                    for j, c in enumerate(columns)
+                ),
+            ))
+    finally:
+        sdds.sddsdata.Terminate(i)
+    return res
+
+
+def _scale_pages(path):
+    """Scale the float columns of each page so the first page has the widest range"""
+    from sirepo.template import sdds_util
+
+    i = sdds_util.page_index(str(path))
+    dtype = sdds_util._column_dtype(i)
+    b = bytearray(path.read_binary())
+    for n, page in enumerate(i['pages']):
+        rows = sdds_util._read_array(str(path), dtype, page['offset'], page['rows'])
+        for c in dtype.names:
+            if dtype.fields[c][0].kind == 'f':
+                rows[c] *= len(i['pages']) - n
+        b[page['offset']:page['offset'] + rows.nbytes] = rows.tobytes()
+    path.write_binary(bytes(b))
+    pkio.unchecked_remove(str(path) + sdds_util.PAGE_INDEX_SUFFIX)
+    sdds_util._page_index_cache.clear()
+
+
+def _split(path):
+    """Header and page data of a binary sdds file"""
+    from sirepo.template import sdds_util
+
+    with open(str(path), 'rb') as f:
+        h = sdds_util._parse_header(f)
+    b = path.read_binary()
+    return b[:h['dataOffset']], b[h['dataOffset']:]
@@ -12,6 +12,55 @@ import pytest
 
 pytest.importorskip('xraylib')
 
+def test_extract_report_data():
+    pytest.importorskip('Shadow')
+    from pykern.pkunit import pkeq
+    from sirepo.template import shadow
+    import Shadow
+    import numpy
+
+    with pkunit.save_chdir_work():
+        source = Shadow.Source()
+        source.NPOINT = 5000
+        source.ISTAR1 = 6775431
+        beam = Shadow.Beam()
+        beam.genSource(source)
+        oe = Shadow.OE()
+        oe.FMIRR = 5
+        oe.FHIT_C = 1
+        oe.FSHAPE = 1
+        oe.RWIDX1 = oe.RWIDX2 = 0.05
+        oe.RLEN1 = oe.RLEN2 = 5.0
+        oe.T_INCIDENCE = oe.T_REFLECTION = 88.0
+        oe.T_SOURCE = 1000.0
+        oe.T_IMAGE = 0.0
+        beam.traceOE(oe, 1)
+        rays = beam.rays[beam.rays[:, 9] > 0]
+        assert 0 < len(rays) < len(beam.rays)
+        for column, weight in (('1', '23'), ('11', '0'), ('22', '0'), ('26', '25')):
+            res = shadow._extract_report_data(rays, {
+                'column': column,
+                'histogramBins': 50,
+                'weight': weight,
+            })
+            ticket = beam.histo1(int(column), nbins=50, ref=int(weight), nolost=1, calculate_widths=0)
+            assert numpy.allclose(ticket['histogram'], res['points'])
+            assert numpy.allclose(shadow._scale_range(int(column), ticket['xrange']), res['x_range'][:2])
+        for x, y, weight in (('1', '3', '23'), ('4', '6', '0'), ('21', '27', '24')):
+            res = shadow._extract_report_data(rays, {
+                'histogramBins': 40,
+                'overrideSize': '0',
+                'weight': weight,
+                'x': x,
+                'y': y,
+            })
+            ticket = beam.histo2(int(x), int(y), nbins=40, ref=int(weight), nolost=1, calculate_widths=0)
+            assert numpy.allclose(ticket['histogram'].T, res['z_matrix'])
+            assert numpy.allclose(shadow._scale_range(int(x), ticket['xrange']), res['x_range'][:2])
+            assert numpy.allclose(shadow._scale_range(int(y), ticket['yrange']), res['y_range'][:2])
+            pkeq(40, res['x_range'][2])
+
+
 def test_generate_python():
     from pykern import pkio
     from pykern.pkunit import pkeq
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+u"""PyTest for :mod:`sirepo.template.zgoubi_fai`
+
+:copyright: Copyright (c) 2019 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+
+_HEADER = '''@ Zgoubi, "FAISCNL" output
+@ KEX, Do-1, Yo, IPASS, LET, Y, D1
+     zgoubi.fai
+# KEX   Do-1   Yo   IPASS   LET   Y   D1
+# int float float int string float float
+'''
+
+
+def test_append():
+    from pykern import pkio
+    from pykern import pkunit
+    from sirepo.template import zgoubi_fai
+
+    d = pkunit.empty_work_dir()
+    full = _HEADER + _rows(1) + _rows(2) + _rows(1) + _rows(3)
+    # split in the middle of the tenth row
+    split = full.index('\n', len(_HEADER) + len(_rows(1)) * 2) + 10
+    path = d.join('zgoubi.fai')
+    pkio.write_text(path, full[:split])
+    res = zgoubi_fai.read(path)
+    pkunit.pkeq(9, res.row_count)
+    with open(str(path), 'a') as f:
+        f.write(full[split:])
+    res = zgoubi_fai.read(path)
+    one = d.join('one-shot.fai')
+    pkio.write_text(one, full)
+    _assert_same(zgoubi_fai.read(one), res)
+    pkunit.pkeq([[1, [[0, 4], [8, 12]]], [2, [[4, 8]]], [3, [[12, 16]]]], res.ipasses)
+    pkunit.pkeq(list(range(4)) + list(range(8, 12)), zgoubi_fai.segment_rows(res.ipasses[0][1]).tolist())
+
+
+def test_truncate():
+    """Rows appended to the columns before a crash are dropped"""
+    from pykern import pkio
+    from pykern import pkunit
+    from sirepo.template import zgoubi_fai
+    import os
+
+    d = pkunit.empty_work_dir()
+    path = d.join('zgoubi.fai')
+    pkio.write_text(path, _HEADER + _rows(1))
+    zgoubi_fai.read(path)
+    c = pkio.py_path(str(path) + zgoubi_fai.CACHE_SUFFIX)
+    index = c.join('index.json').read()
+    with open(str(path), 'a') as f:
+        f.write(_rows(2))
+    zgoubi_fai.read(path)
+    # index written before the second read
+    c.join('index.json').write(index)
+    with open(str(path), 'a') as f:
+        f.write(_rows(3))
+    res = zgoubi_fai.read(path)
+    pkunit.pkeq(12, res.row_count)
+    for f in c.listdir('c*.bin'):
+        pkunit.pkeq(res.row_count * (32 if f.basename == 'c4.bin' else 8), os.path.getsize(str(f)))
+    one = d.join('one-shot.fai')
+    pkio.write_text(one, _HEADER + _rows(1) + _rows(2) + _rows(3))
+    _assert_same(zgoubi_fai.read(one), res)
+
+
+def _assert_same(expect, actual):
+    from pykern import pkunit
+    import numpy
+
+    for f in 'col_names', 'row_count', 'ipasses', 'ranges':
+        pkunit.pkeq(expect[f], actual[f])
+    pkunit.pkeq(sorted(expect.columns.keys()), sorted(actual.columns.keys()))
+    for k in expect.columns:
+        pkunit.pkok(
+            numpy.array_equal(expect.columns[k], actual.columns[k]),
+            '{}: column differs',
+            k,
+        )
+
+
+def _rows(ipass):
+    return ''.join(
+        "  1  {:.4f}  {:.4f}  {}  'B{}  '  {:.5f}  {:.3f}\n".format(
+            0.1 * i, -0.2 * i, ipass, i, 0.01 * i * ipass, 1.5 * i,
+        ) for i in range(4)
+    )